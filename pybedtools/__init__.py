@@ -8,7 +8,8 @@ from six.moves import urllib
 from six.moves import copyreg
 from . import scripts
 from .cbedtools import (Interval, IntervalFile, overlap, Attributes,
-                        MalformedBedLineError, IntervalIterator)
+                        MalformedBedLineError, IntervalIterator,
+                        BufferedIntervalIterator, IntervalBatch)
 from . import contrib
 from .helpers import (get_tempdir, set_tempdir, cleanup, find_tagged,
                       set_bedtools_path, chromsizes, get_chromsizes_from_ucsc,
@@ -19,7 +20,8 @@ from . import genome_registry
 from . import stats
 from .__main__ import main
 from .version import __version__
-from .filenames import data_dir, example_filename, list_example_files
+from .filenames import (data_dir, example_filename, list_example_files,
+                        tempfile_info)
 from .bedtool import example_bedtool
 
 from . import settings
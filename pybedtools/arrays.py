@@ -0,0 +1,835 @@
+"""
+Columnar, NumPy-backed access to the features in an interval file.
+
+Iterating over a BedTool creates an :class:`Interval` object for every line,
+which is convenient but expensive for files with tens of millions of
+features.  An :class:`IntervalArray` instead parses a file straight into
+contiguous arrays of chromosome codes, starts, ends and strands, so that
+lengths, filters, slices and sorts can be done with vectorized NumPy
+operations.  Other columns are only parsed when asked for, and the original
+lines are written back out untouched when converting to a BedTool.
+
+NumPy is only required for this module; it is not imported by
+:mod:`pybedtools` itself.
+
+>>> import pybedtools
+>>> a = pybedtools.example_bedtool('a.bed').to_arrays()
+>>> len(a)
+4
+>>> print(a.lengths)
+[ 99 100 350  50]
+>>> print(a[a.lengths > 99].to_bedtool()) #doctest: +NORMALIZE_WHITESPACE
+chr1	100	200	feature2	0	+
+chr1	150	500	feature3	0	-
+<BLANKLINE>
+"""
+from __future__ import print_function, division
+import os
+import gzip
+import mmap
+
+import numpy as np
+import six
+
+from .cbedtools import create_interval_from_list, MalformedBedLineError
+from .helpers import isGZIP, isBAM, chromsizes
+
+# Parse this many bytes at a time, which keeps the temporary index arrays
+# used for vectorized parsing at a reasonable size.
+_BLOCKSIZE = 2 ** 24
+
+# Per file type, the field indexes of (start, end, score, strand) and the
+# offset to add to the start field to get a 0-based start.  VCF features are
+# one base long, so the end is derived from the start.  These mirror the
+# conversions done in create_interval_from_list().
+_LAYOUTS = {
+    'bed': (1, 2, 4, 5, 0),
+    'gff': (3, 4, 5, 6, -1),
+    'vcf': (1, None, None, None, 0),
+}
+
+_NEWLINE, _TAB, _CR = 10, 9, 13
+
+
+def _read_buffer(fn):
+    """
+    Returns a read-only buffer of the contents of `fn`, memory-mapped if
+    possible.
+    """
+    if isGZIP(fn):
+        with gzip.open(fn, 'rb') as fh:
+            return fh.read()
+    with open(fn, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _startswith(data, starts, ends, prefix):
+    """
+    Boolean array of whether each line [starts, ends) in `data` starts with
+    bytestring `prefix`.
+    """
+    result = np.zeros(len(starts), dtype=bool)
+    ok = (ends - starts) >= len(prefix)
+    if ok.any():
+        idx = starts[ok][:, None] + np.arange(len(prefix))
+        result[ok] = (
+            data[idx] == np.frombuffer(prefix, dtype=np.uint8)).all(axis=1)
+    return result
+
+
+def _field_bounds(tabs, first_tab, line_starts, line_ends, k):
+    """
+    Returns (field_starts, field_ends, present) for 0-based field `k` of each
+    line.
+    """
+    n = len(line_starts)
+    ntabs = len(tabs)
+    padded = np.concatenate((tabs, [np.iinfo(np.int64).max]))
+    if k == 0:
+        fstarts = line_starts.copy()
+        present = np.ones(n, dtype=bool)
+    else:
+        prev = padded[np.minimum(first_tab + k - 1, ntabs)]
+        present = prev < line_ends
+        fstarts = np.where(present, prev + 1, line_ends)
+    nxt = padded[np.minimum(first_tab + k, ntabs)]
+    fends = np.where(present, np.minimum(nxt, line_ends), line_ends)
+    return fstarts, fends, present
+
+
+def _parse_ints(data, fstarts, fends):
+    """
+    Vectorized conversion of the unsigned integer fields [fstarts, fends) in
+    `data`.
+    """
+    widths = fends - fstarts
+    if len(widths) == 0:
+        return np.zeros(0, dtype=np.int64)
+    maxw = int(widths.max())
+    cols = np.arange(maxw)
+    valid = cols < widths[:, None]
+    idx = np.minimum(fstarts[:, None] + cols, len(data) - 1)
+    digits = data[idx].astype(np.int64) - 48
+    bad = (valid & ((digits < 0) | (digits > 9))).any(axis=1)
+    bad |= (widths == 0) | (widths > 18)
+    if bad.any():
+        i = int(np.flatnonzero(bad)[0])
+        raise MalformedBedLineError(
+            'Expected an integer but got "%s"'
+            % bytes(data[fstarts[i]:fends[i]]).decode('UTF-8', 'replace'))
+    values = np.zeros(len(widths), dtype=np.int64)
+    for j in range(maxw):
+        values = np.where(valid[:, j], values * 10 + digits[:, j], values)
+    return values
+
+
+class IntervalArray(object):
+    def __init__(self, fn):
+        """
+        Parse the BED, GFF/GTF or VCF file `fn` (optionally gzipped) into
+        contiguous arrays.
+
+        The following attributes are available:
+
+            `chroms`: list of unique chromosome names, in order of first
+            appearance
+
+            `chrom_codes`: int32 array of indexes into `chroms`, one per
+            feature
+
+            `starts`, `ends`: int64 arrays of 0-based, half-open coordinates
+            (the same values as Interval.start and Interval.end)
+
+            `strands`: |S1 array of b'+', b'-' or b'.'
+
+        Scores and any other columns are parsed on first access; see
+        :attr:`scores` and :meth:`column`.
+        """
+        if not isinstance(fn, six.string_types):
+            raise ValueError("IntervalArray requires a filename; use "
+                             "BedTool.saveas() for non-file BedTools")
+        if isBAM(fn):
+            raise ValueError("BAM files are not supported by IntervalArray")
+        self._load(fn, _read_buffer(fn))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Parses the lines in the bytestring `data`, rather than a file, into a
+        new IntervalArray.
+        """
+        obj = cls.__new__(cls)
+        obj._load(None, data)
+        return obj
+
+    def _load(self, fn, buffer):
+        self.fn = fn
+        self._buffer = buffer
+        self._data = np.frombuffer(self._buffer, dtype=np.uint8)
+        self.file_type = None
+        self._parse()
+        self._scores = None
+
+    @classmethod
+    def _new(cls, parent, idx):
+        """
+        Creates a new IntervalArray sharing the buffer of `parent`, restricted
+        to features `idx` (anything accepted by NumPy indexing).
+        """
+        obj = cls.__new__(cls)
+        obj.fn = parent.fn
+        obj._buffer = parent._buffer
+        obj._data = parent._data
+        obj.file_type = parent.file_type
+        obj.chroms = parent.chroms
+        obj.chrom_codes = parent.chrom_codes[idx]
+        obj.starts = parent.starts[idx]
+        obj.ends = parent.ends[idx]
+        obj.strands = parent.strands[idx]
+        obj._line_starts = parent._line_starts[idx]
+        obj._line_ends = parent._line_ends[idx]
+        if parent._scores is not None:
+            obj._scores = parent._scores[idx]
+        else:
+            obj._scores = None
+        return obj
+
+    def _sniff(self, line_starts, line_ends):
+        line = bytes(self._data[line_starts[0]:line_ends[0]])
+        fields = line.decode('UTF-8').rstrip('\r').split('\t')
+        file_type = create_interval_from_list(fields).file_type
+        if file_type not in _LAYOUTS:
+            raise ValueError(
+                "%s files are not supported by IntervalArray" % file_type)
+        self.file_type = file_type
+
+    def _parse(self):
+        data = self._data
+        size = len(data)
+        chrom_lookup = {}
+        self.chroms = []
+        parts = []
+
+        block_start = 0
+        while block_start < size:
+            block_end = min(block_start + _BLOCKSIZE, size)
+            if block_end < size:
+                # extend the block to the end of the current line
+                nl = self._buffer.find(b'\n', block_end)
+                block_end = size if nl == -1 else nl + 1
+            parsed = self._parse_block(block_start, block_end, chrom_lookup)
+            if parsed is not None:
+                parts.append(parsed)
+            block_start = block_end
+
+        if parts:
+            cols = [np.concatenate(i) for i in zip(*parts)]
+        else:
+            cols = [np.zeros(0, dtype=np.int32)] + \
+                [np.zeros(0, dtype=np.int64)] * 2 + \
+                [np.zeros(0, dtype='S1')] + \
+                [np.zeros(0, dtype=np.int64)] * 2
+        (self.chrom_codes, self.starts, self.ends, self.strands,
+         self._line_starts, self._line_ends) = cols
+
+    def _parse_block(self, block_start, block_end, chrom_lookup):
+        data = self._data
+        block = data[block_start:block_end]
+        newlines = np.flatnonzero(block == _NEWLINE) + block_start
+        line_starts = np.concatenate(([block_start], newlines + 1))
+        line_ends = np.concatenate((newlines, [block_end]))
+        if line_starts[-1] == block_end:
+            line_starts = line_starts[:-1]
+            line_ends = line_ends[:-1]
+
+        # Treat Windows line endings like IntervalIterator does
+        nonempty = line_ends > line_starts
+        cr = np.zeros(len(line_ends), dtype=bool)
+        cr[nonempty] = data[line_ends[nonempty] - 1] == _CR
+        field_ends = line_ends - cr
+
+        # Skip the same header and blank lines as IntervalIterator
+        skip = field_ends == line_starts
+        for prefix in (b'@', b'#', b'track', b'browser'):
+            skip |= _startswith(data, line_starts, field_ends, prefix)
+        for i in np.flatnonzero(~skip & np.isin(data[line_starts], (32, 9))):
+            if not bytes(data[line_starts[i]:field_ends[i]]).strip():
+                skip[i] = True
+        keep = ~skip
+        line_starts = line_starts[keep]
+        line_ends = line_ends[keep]
+        field_ends = field_ends[keep]
+        if len(line_starts) == 0:
+            return None
+
+        if self.file_type is None:
+            self._sniff(line_starts, field_ends)
+        start_idx, end_idx, score_idx, strand_idx, offset = \
+            _LAYOUTS[self.file_type]
+
+        tabs = np.flatnonzero(block == _TAB) + block_start
+        first_tab = np.searchsorted(tabs, line_starts)
+
+        def bounds(k):
+            return _field_bounds(tabs, first_tab, line_starts, field_ends, k)
+
+        # Chromosomes: collapse runs of identical names, then look up each
+        # distinct name once.  Names are zero-padded rows of bytes; since
+        # names can't contain NUL, rows are equal only if names are equal.
+        cstarts, cends, _ = bounds(0)
+        clens = cends - cstarts
+        maxlen = max(int(clens.max()), 1)
+        cols = np.arange(maxlen)
+        names = np.where(
+            cols < clens[:, None],
+            data[np.minimum(cstarts[:, None] + cols, len(data) - 1)],
+            0).astype(np.uint8)
+        same = (names[1:] == names[:-1]).all(axis=1)
+        run_starts = np.concatenate(([0], np.flatnonzero(~same) + 1))
+        run_names = np.ascontiguousarray(names[run_starts]).view(
+            np.dtype((np.void, maxlen))).ravel()
+        uniq, first, inverse = np.unique(
+            run_names, return_index=True, return_inverse=True)
+        codes = np.empty(len(uniq), dtype=np.int32)
+        for k in np.argsort(first):
+            i = run_starts[first[k]]
+            chrom = bytes(data[cstarts[i]:cends[i]]).decode('UTF-8')
+            code = chrom_lookup.get(chrom)
+            if code is None:
+                code = chrom_lookup[chrom] = len(self.chroms)
+                self.chroms.append(chrom)
+            codes[k] = code
+        run_lengths = np.diff(np.concatenate((run_starts, [len(cstarts)])))
+        chrom_codes = np.repeat(codes[inverse.ravel()], run_lengths)
+
+        fs, fe, present = bounds(start_idx)
+        if not present.all():
+            raise MalformedBedLineError('Too few fields in %s' % self.fn)
+        starts = _parse_ints(data, fs, fe) + offset
+        if end_idx is None:
+            ends = starts + 1
+        else:
+            fs, fe, present = bounds(end_idx)
+            if not present.all():
+                raise MalformedBedLineError('Too few fields in %s' % self.fn)
+            ends = _parse_ints(data, fs, fe)
+        if (starts > ends).any():
+            raise MalformedBedLineError("Start is greater than stop")
+
+        strands = np.full(len(starts), b'.', dtype='S1')
+        if strand_idx is not None:
+            fs, fe, present = bounds(strand_idx)
+            single = present & (fe - fs == 1)
+            strands[single] = data[fs[single]].view('S1')
+
+        return (chrom_codes, starts, ends, strands, line_starts, line_ends)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __repr__(self):
+        return '<IntervalArray(%s, %s features)>' % (self.fn, len(self))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._interval(i)
+
+    def __getitem__(self, key):
+        """
+        An integer returns an :class:`Interval`; slices, boolean masks and
+        integer arrays return a new IntervalArray.
+        """
+        if isinstance(key, six.integer_types + (np.integer,)):
+            n = len(self)
+            if key < 0:
+                key += n
+            if not 0 <= key < n:
+                raise IndexError('IntervalArray index out of range')
+            return self._interval(key)
+        return self._new(self, key)
+
+    def _line(self, i):
+        line = bytes(self._data[self._line_starts[i]:self._line_ends[i]])
+        return line.decode('UTF-8').rstrip('\r')
+
+    def _interval(self, i):
+        return create_interval_from_list(self._line(i).split('\t'))
+
+    @property
+    def chrom(self):
+        """
+        Array of chromosome names, one per feature.
+        """
+        return np.array(self.chroms, dtype=object)[self.chrom_codes]
+
+    @property
+    def lengths(self):
+        """
+        Array of feature lengths (ends - starts).
+        """
+        return self.ends - self.starts
+
+    @property
+    def scores(self):
+        """
+        Float array of scores, with NaN where the score is missing or ".".
+        Parsed on first access.
+        """
+        if self._scores is None:
+            score_idx = _LAYOUTS[self.file_type][2] \
+                if self.file_type else None
+            if score_idx is None:
+                self._scores = np.full(len(self), np.nan)
+            else:
+                self._scores = np.array(
+                    [float(i) if i not in ('', '.') else np.nan
+                     for i in self.column(score_idx, missing='')],
+                    dtype=float)
+        return self._scores
+
+    def column(self, i, missing=None):
+        """
+        Returns an object array of the raw string values of 0-based column `i`
+        for each feature.  Lines with fewer fields get `missing`.
+        """
+        values = []
+        for k in range(len(self)):
+            fields = self._line(k).split('\t')
+            values.append(fields[i] if i < len(fields) else missing)
+        return np.array(values, dtype=object)
+
+    def filter(self, mask):
+        """
+        Returns a new IntervalArray with only the features where boolean array
+        `mask` is True.  Like :meth:`BedTool.filter`, but vectorized:
+
+        >>> import pybedtools
+        >>> a = pybedtools.example_bedtool('a.bed').to_arrays()
+        >>> b = a.filter(a.strands == b'-')
+        >>> print(b.to_bedtool()) #doctest: +NORMALIZE_WHITESPACE
+        chr1	150	500	feature3	0	-
+        <BLANKLINE>
+        """
+        mask = np.asarray(mask, dtype=bool)
+        if mask.shape != self.starts.shape:
+            raise ValueError('mask must have one item per feature')
+        return self._new(self, mask)
+
+    def argsort(self):
+        """
+        Returns the indexes that sort by chromosome name and then start
+        position, as in `sort -k1,1 -k2,2n`.  The sort is stable.
+        """
+        ranks = np.empty(len(self.chroms), dtype=np.int64)
+        ranks[sorted(range(len(self.chroms)),
+                     key=lambda i: self.chroms[i])] = \
+            np.arange(len(self.chroms))
+        return np.lexsort((self.starts, ranks[self.chrom_codes]))
+
+    def sort(self):
+        """
+        Returns a new IntervalArray sorted by chromosome and start.
+        """
+        return self._new(self, self.argsort())
+
+    def to_bedtool(self, fn=None):
+        """
+        Writes the original lines of the features in this IntervalArray to
+        `fn` (a new tempfile by default) and returns a BedTool for it.
+        Consecutive lines are written in single chunks without being parsed.
+        """
+        from .bedtool import BedTool
+        if fn is None:
+            fn = BedTool._tmp()
+        starts = self._line_starts
+        ends = self._line_ends
+        if len(starts) == 0:
+            open(fn, 'wb').close()
+            return BedTool(fn)
+        breaks = np.flatnonzero(starts[1:] != ends[:-1] + 1) + 1
+        run_starts = np.concatenate(([0], breaks))
+        run_ends = np.concatenate((breaks, [len(starts)])) - 1
+        with open(fn, 'wb') as fout:
+            for i, j in zip(run_starts, run_ends):
+                fout.write(self._buffer[starts[i]:ends[j]])
+                fout.write(b'\n')
+        return BedTool(fn)
+
+
+def _as_intervalarray(obj):
+    """
+    Converts an IntervalArray, BedTool or filename to an IntervalArray.
+    """
+    if isinstance(obj, IntervalArray):
+        return obj
+    if isinstance(obj, six.string_types):
+        return IntervalArray(obj)
+    if not isinstance(obj.fn, six.string_types):
+        obj = obj.saveas()
+    return obj.to_arrays()
+
+
+def _genome_bounds(genome):
+    """
+    Returns (chrom, start, stop) for each chromosome of `genome`, which can
+    be a chromsizes dictionary, a genome file or an assembly name.
+    """
+    if isinstance(genome, six.string_types):
+        if os.path.exists(genome):
+            bounds = []
+            with open(genome) as fin:
+                for line in fin:
+                    fields = line.split()
+                    if fields and not fields[0].startswith('#'):
+                        bounds.append((fields[0], 0, int(fields[1])))
+            return bounds
+        genome = chromsizes(genome)
+    bounds = []
+    for chrom, value in sorted(genome.items()):
+        if isinstance(value, six.integer_types):
+            start, stop = 0, value
+        else:
+            start, stop = value
+        bounds.append((chrom, int(start), int(stop)))
+    return bounds
+
+
+def _merge(starts, ends):
+    """
+    Sorts the intervals [starts, ends) and merges those that overlap or are
+    book-ended.
+    """
+    order = np.argsort(starts, kind='mergesort')
+    starts = starts[order]
+    ends = ends[order]
+    if len(starts) == 0:
+        return starts, ends
+    reach = np.maximum.accumulate(ends)
+    first = np.flatnonzero(
+        np.concatenate(([True], starts[1:] > reach[:-1])))
+    return starts[first], np.maximum.reduceat(ends, first)
+
+
+class Shuffler(object):
+    """
+    Randomly places the features of an interval file in a genome, many times
+    over, like `bedtools shuffle` -- but in-process, with each batch of
+    replicates drawn at once as NumPy arrays.
+
+    `features` is an IntervalArray, BedTool or filename.  `genome` is a
+    chromsizes dictionary (as returned by :func:`pybedtools.chromsizes`), a
+    genome file or an assembly name.  The chromosomes are laid end to end in
+    a single coordinate system, so that a batch of replicates is just a pair
+    of `starts` and `ends` arrays with one row per replicate; use
+    :meth:`coordinates` to convert them back to chromosomes and positions.
+    The `starts` and `ends` attributes hold the unshuffled features in the
+    same coordinates.
+
+    The other arguments follow `bedtools shuffle`:
+
+        `incl`: features only start within these regions
+
+        `excl`: features don't overlap these regions
+
+        `chrom`: each feature stays on its own chromosome
+
+        `noOverlapping`: the features of a replicate don't overlap each other
+
+        `seed`: seeds the random number generator, so that the same
+        replicates are drawn each time
+
+    Placements that break one of these rules, or that run off the end of a
+    chromosome, are drawn again, up to `maxTries` times.
+
+    >>> import pybedtools
+    >>> a = pybedtools.example_bedtool('a.bed')
+    >>> b = pybedtools.example_bedtool('b.bed')
+    >>> shuffler = Shuffler(a, {'chr1': (0, 5000)}, seed=1)
+    >>> counter = shuffler.counter(b)
+    >>> for starts, ends in shuffler.shuffle(1000):
+    ...     hits = (counter.counts(starts, ends) > 0).sum(axis=1)
+    >>> hits.shape
+    (1000,)
+    """
+    def __init__(self, features, genome, incl=None, excl=None, chrom=False,
+                 noOverlapping=False, seed=None, maxTries=1000):
+        bounds = _genome_bounds(genome)
+        self.chroms = [i[0] for i in bounds]
+        self._lookup = dict((c, i) for i, c in enumerate(self.chroms))
+        sizes = np.array([i[2] for i in bounds], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(sizes)))
+        self._space_starts = self.offsets[:-1] + np.array(
+            [i[1] for i in bounds], dtype=np.int64)
+        self._space_ends = self.offsets[:-1] + sizes
+
+        self.features = _as_intervalarray(features)
+        codes, starts, ends = self._linear(self.features)
+        if len(codes) < len(self.features):
+            raise ValueError('features on chromosomes missing from genome')
+        self.starts = starts
+        self.ends = ends
+        self.lengths = ends - starts
+        self.noOverlapping = noOverlapping
+        self.maxTries = maxTries
+        self.random_state = np.random.RandomState(seed)
+
+        if incl is not None:
+            seg_codes, seg_starts, seg_ends = \
+                self._linear(_as_intervalarray(incl))
+            seg_starts = np.maximum(seg_starts, self._space_starts[seg_codes])
+            seg_ends = np.minimum(seg_ends, self._space_ends[seg_codes])
+            keep = seg_ends > seg_starts
+            seg_starts, seg_ends = _merge(seg_starts[keep], seg_ends[keep])
+        else:
+            keep = self._space_ends > self._space_starts
+            seg_starts = self._space_starts[keep]
+            seg_ends = self._space_ends[keep]
+
+        if excl is not None:
+            _, ex_starts, ex_ends = self._linear(_as_intervalarray(excl))
+            self._excl = _merge(ex_starts, ex_ends)
+        else:
+            self._excl = None
+
+        # Each feature is placed at a position drawn from a stretch of the
+        # segments laid end to end: all of them, or with chrom=True, those
+        # on the feature's chromosome.
+        self._seg_starts = seg_starts
+        self._seg_cum = cum = np.concatenate(
+            ([0], np.cumsum(seg_ends - seg_starts)))
+        if chrom:
+            lo = np.searchsorted(seg_starts, self.offsets[codes])
+            hi = np.searchsorted(seg_starts, self.offsets[codes + 1])
+        else:
+            lo = np.zeros(len(codes), dtype=np.int64)
+            hi = np.full(len(codes), len(seg_starts), dtype=np.int64)
+        self._base = cum[lo]
+        self._space = cum[hi] - cum[lo]
+        if (self._space <= 0).any():
+            raise ValueError(
+                'no space to place features on %s'
+                % self.chroms[codes[np.argmax(self._space <= 0)]])
+
+    def _linear(self, features):
+        """
+        Returns the genome codes and the starts and ends, in the coordinates
+        of this Shuffler, of the features of IntervalArray `features` that
+        are on chromosomes of the genome.
+        """
+        lookup = np.array([self._lookup.get(c, -1) for c in features.chroms],
+                          dtype=np.int64)
+        codes = lookup[features.chrom_codes]
+        keep = codes >= 0
+        codes = codes[keep]
+        lo = self.offsets[codes]
+        hi = self.offsets[codes + 1]
+        starts = np.minimum(lo + features.starts[keep], hi)
+        ends = np.minimum(lo + features.ends[keep], hi)
+        return codes, starts, ends
+
+    def _draw(self, cols):
+        """
+        Random positions for the features `cols`, each drawn uniformly from
+        the space available to it.
+        """
+        space = self._space[cols]
+        u = (self.random_state.random_sample(len(cols)) * space).astype(
+            np.int64)
+        u = self._base[cols] + np.minimum(u, space - 1)
+        i = np.searchsorted(self._seg_cum, u, side='right') - 1
+        return self._seg_starts[i] + u - self._seg_cum[i]
+
+    def _rejected(self, starts, ends):
+        """
+        Boolean array of whether each placement runs off its chromosome or
+        overlaps an excluded region.
+        """
+        codes = np.searchsorted(self.offsets, starts, side='right') - 1
+        bad = ends > self._space_ends[codes]
+        if self._excl is not None and len(self._excl[0]):
+            ex_starts, ex_ends = self._excl
+            k = np.searchsorted(ex_starts, ends, side='left')
+            bad |= (k > 0) & (ex_ends[np.maximum(k - 1, 0)] > starts)
+        return bad
+
+    def _overlapping(self, starts):
+        """
+        Boolean array, shaped like `starts`, of features that overlap an
+        earlier feature of the same replicate.
+        """
+        order = np.argsort(starts, axis=1, kind='mergesort')
+        rows = np.arange(starts.shape[0])[:, None]
+        sorted_starts = starts[rows, order]
+        reach = np.maximum.accumulate(
+            sorted_starts + self.lengths[order], axis=1)
+        clash = np.zeros(starts.shape, dtype=bool)
+        clash[:, 1:] = sorted_starts[:, 1:] < reach[:, :-1]
+        result = np.empty(starts.shape, dtype=bool)
+        result[rows, order] = clash
+        return result
+
+    def _place(self, k):
+        """
+        Starts of `k` replicates, as a (k, features) array.
+        """
+        n = len(self.lengths)
+        starts = np.zeros((k, n), dtype=np.int64)
+        flat_starts = starts.reshape(-1)
+        todo = np.ones(k * n, dtype=bool)
+        for _ in range(self.maxTries):
+            idx = np.flatnonzero(todo)
+            if not len(idx):
+                if not self.noOverlapping:
+                    return starts
+                todo = self._overlapping(starts).reshape(-1)
+                if not todo.any():
+                    return starts
+                continue
+            cols = idx % n
+            flat_starts[idx] = self._draw(cols)
+            bad = self._rejected(flat_starts[idx],
+                                 flat_starts[idx] + self.lengths[cols])
+            todo[:] = False
+            todo[idx[bad]] = True
+        raise ValueError(
+            'could not place all features after %s tries' % self.maxTries)
+
+    def shuffle(self, iterations, batchsize=None):
+        """
+        Draws `iterations` replicates, yielding them in batches of
+        `batchsize` (by default, a few million features per batch) as
+        (starts, ends) arrays with one row per replicate.
+        """
+        if batchsize is None:
+            batchsize = max(1, 2 ** 22 // max(1, len(self.lengths)))
+        done = 0
+        while done < iterations:
+            k = min(batchsize, iterations - done)
+            starts = self._place(k)
+            yield starts, starts + self.lengths
+            done += k
+
+    def coordinates(self, positions):
+        """
+        Converts `positions` in the coordinates of this Shuffler to a pair of
+        arrays of chromosome names and positions on those chromosomes.
+        """
+        codes = np.searchsorted(self.offsets, positions, side='right') - 1
+        codes = np.minimum(codes, len(self.chroms) - 1)
+        return (np.array(self.chroms, dtype=object)[codes],
+                positions - self.offsets[codes])
+
+    def counter(self, other):
+        """
+        Returns an :class:`OverlapCounter` for the features of `other` (an
+        IntervalArray, BedTool or filename) in the coordinates of this
+        Shuffler.
+        """
+        _, starts, ends = self._linear(_as_intervalarray(other))
+        return OverlapCounter(starts, ends, self.offsets[-1])
+
+
+class OverlapCounter(object):
+    """
+    Finds how many features of a fixed set overlap each of many intervals,
+    and by how many bp, with binary searches of the sorted feature starts and
+    ends -- so that batches of shuffled replicates can be compared with a
+    file without intersecting each one.  Usually created with
+    :meth:`Shuffler.counter`.
+
+    `starts` and `ends` are the features' coordinates, and `span` is the
+    size of the coordinate system they are in.
+    """
+    def __init__(self, starts, ends, span):
+        self.starts = np.sort(starts)
+        self.ends = np.sort(ends)
+        self.span = int(span)
+        self._start_sums = np.concatenate(([0], np.cumsum(self.starts)))
+        self._end_sums = np.concatenate(([0], np.cumsum(self.ends)))
+        self._merged = None
+
+    def _by_start(self, func, starts, ends):
+        """
+        Returns func(starts, ends), calling it with each row of intervals
+        sorted by start: binary searches for sorted values are several times
+        faster, as consecutive searches touch the same memory.
+        """
+        starts = np.asarray(starts)
+        ends = np.asarray(ends)
+        if starts.ndim != 2:
+            return func(starts, ends)
+        rows = np.arange(starts.shape[0])[:, None]
+        order = np.argsort(starts, axis=1)
+        result = np.empty(starts.shape, dtype=np.int64)
+        result[rows, order] = func(starts[rows, order], ends[rows, order])
+        return result
+
+    def _counts(self, starts, ends):
+        return (np.searchsorted(self.starts, ends, side='left') -
+                np.searchsorted(self.ends, starts, side='right'))
+
+    def counts(self, starts, ends):
+        """
+        Number of features overlapping each interval [starts, ends), as
+        `bedtools intersect -c` would report.
+        """
+        return self._by_start(self._counts, starts, ends)
+
+    def _covered(self, x):
+        """
+        Total bp of the features before each position `x`.
+        """
+        i = np.searchsorted(self.starts, x, side='left')
+        j = np.searchsorted(self.ends, x, side='left')
+        return (x * i - self._start_sums[i]) - (x * j - self._end_sums[j])
+
+    def bp(self, starts, ends):
+        """
+        Total bp overlap between each interval [starts, ends) and each of the
+        features, which is the summed length of the features that `bedtools
+        intersect` would report for the interval.
+        """
+        return self._by_start(
+            lambda s, e: self._covered(e) - self._covered(s), starts, ends)
+
+    def jaccard(self, starts, ends):
+        """
+        The statistics of `bedtools jaccard` between each row of intervals
+        and the features, as a dictionary of arrays with one item per row
+        and the same keys as :meth:`BedTool.jaccard`.
+        """
+        if self._merged is None:
+            self._merged = OverlapCounter(
+                *_merge(self.starts, self.ends), span=self.span)
+        merged = self._merged
+        k = starts.shape[0]
+
+        # Shift each row into its own stretch of coordinates so that all rows
+        # can be merged at once; the 1 bp gap between stretches keeps a
+        # feature ending at `span` from touching one starting at 0 in the
+        # next row
+        stride = self.span + 1
+        shift = np.arange(k, dtype=np.int64)[:, None] * stride
+        m_starts, m_ends = _merge((starts + shift).reshape(-1),
+                                  (ends + shift).reshape(-1))
+        rows = m_starts // stride
+        m_starts = m_starts - rows * stride
+        m_ends = m_ends - rows * stride
+
+        def per_row(values):
+            return np.rint(np.bincount(
+                rows, weights=values, minlength=k)).astype(np.int64)
+
+        intersection = per_row(merged.bp(m_starts, m_ends))
+        union = per_row(m_ends - m_starts) + \
+            int((merged.ends - merged.starts).sum()) - intersection
+        with np.errstate(divide='ignore', invalid='ignore'):
+            jaccard = np.where(union > 0, intersection / union, 0.0)
+        return {
+            'intersection': intersection,
+            'union-intersection': union,
+            'jaccard': jaccard,
+            'n_intersections': per_row(merged.counts(m_starts, m_ends)),
+        }
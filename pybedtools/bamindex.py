@@ -0,0 +1,213 @@
+"""
+Region queries of indexed BAM files, used by :meth:`BedTool.fetch` and to
+restrict the BAM inputs of :meth:`BedTool.intersect` and
+:meth:`BedTool.coverage` to the reads that can affect their output.
+
+With a ".bai" or ".csi" index next to a BAM file, only the BGZF blocks
+holding reads that overlap the query regions are read and decompressed, so
+querying a targeted panel reads megabytes of a whole-genome BAM rather than
+all of it.  Regions are sorted and merged first, so each read is returned
+once, in the order of the file.  With `threads`, groups of regions are
+fetched in parallel, each thread using its own handle; pysam releases the
+GIL while it reads and decompresses.
+"""
+import os
+from multiprocessing.pool import ThreadPool
+
+import six
+import pysam
+
+from . import settings
+from .cbedtools import Interval, create_interval_from_segment
+from .tabix import region
+import pybedtools
+
+
+def index_fn(fn):
+    """
+    Returns the filename of the ".bai" or ".csi" index of the BAM file `fn`,
+    or None if there is none.
+    """
+    for index in (fn + '.bai', os.path.splitext(fn)[0] + '.bai',
+                  fn + '.csi'):
+        if os.path.exists(index):
+            return index
+    return None
+
+
+def merge_regions(regions, references, lengths, limit=None):
+    """
+    Returns a list of (chrom, start, end) tuples for `regions`, sorted in the
+    order of `references` (the reference names of a BAM file) and merged
+    where they overlap or touch.  Regions on chromosomes missing from
+    `references` are dropped, and a region naming a whole chromosome covers
+    its length from `lengths`.  As in BEDTools, zero-length regions (such
+    as insertion sites) are widened by 1 bp on each side.
+
+    `regions` is an Interval, a "chrom:start-end" string or the name of a
+    chromosome, or an iterable of these, of (chrom, start, end) tuples, or
+    of a mix (such as a BedTool).  If `limit` is given and there are more
+    regions than that, returns None.
+    """
+    if isinstance(regions, (six.string_types, Interval)):
+        regions = [regions]
+    order = dict((name, i) for i, name in enumerate(references))
+    found = []
+    for n, r in enumerate(regions):
+        if limit is not None and n >= limit:
+            return None
+        if isinstance(r, tuple):
+            chrom, start, end = r
+        else:
+            chrom, start, end = region(r)
+        tid = order.get(chrom)
+        if tid is None:
+            continue
+        if start is None:
+            start, end = 0, lengths[tid]
+        elif start == end:
+            start, end = max(start - 1, 0), end + 1
+        found.append((tid, start, end))
+
+    found.sort()
+    merged = []
+    for tid, start, end in found:
+        if merged and merged[-1][0] == tid and start <= merged[-1][2]:
+            if end > merged[-1][2]:
+                merged[-1][2] = end
+        else:
+            merged.append([tid, start, end])
+    return [(references[tid], start, end) for tid, start, end in merged]
+
+
+def _fetch(bam, regions, previous=None):
+    """
+    Yields the reads in the open AlignmentFile `bam` that overlap the merged
+    `regions`, skipping those that also overlap the region before (the last
+    of `previous`, for the first region).
+    """
+    for chrom, start, end in regions:
+        for read in bam.fetch(chrom, start, end):
+            # Already returned for the previous region on this chromosome
+            if previous is not None and previous[0] == chrom \
+                    and read.reference_start < previous[2]:
+                continue
+            yield read
+        previous = (chrom, start, end)
+
+
+def _fetch_group(args):
+    fn, index, regions, previous = args
+    with pysam.AlignmentFile(fn, index_filename=index) as bam:
+        return list(_fetch(bam, regions, previous))
+
+
+def fetch(fn, regions, threads=None, index=None):
+    """
+    Yields the reads (pysam AlignedSegments) of the indexed BAM file `fn`
+    that overlap `regions` (see :func:`merge_regions`), each once and in the
+    order of the file.
+
+    With `threads` greater than 1, groups of regions are fetched in that many
+    threads at once.  `index` is the index file, by default found by
+    :func:`index_fn`.
+    """
+    if index is None:
+        index = index_fn(fn)
+        if index is None:
+            raise ValueError(
+                '%s has no .bai or .csi index; create one with '
+                'pysam.index()' % fn)
+    with pysam.AlignmentFile(fn, index_filename=index) as bam:
+        regions = merge_regions(regions, bam.references, bam.lengths)
+        if not threads or threads < 2 or len(regions) < 2:
+            for read in _fetch(bam, regions):
+                yield read
+            return
+
+    n = min(len(regions), 4 * threads)
+    bounds = [len(regions) * i // n for i in range(n + 1)]
+    tasks = [(fn, index, regions[bounds[i]:bounds[i + 1]],
+              regions[bounds[i] - 1] if i else None) for i in range(n)]
+    pool = ThreadPool(threads)
+    try:
+        for reads in pool.imap(_fetch_group, tasks):
+            for read in reads:
+                yield read
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def intervals(fn, regions, threads=None, index=None):
+    """
+    Like :func:`fetch`, but yields SAM Intervals.
+    """
+    with pysam.AlignmentFile(fn) as bam:
+        chroms = [i.encode('UTF-8') for i in bam.references]
+    for read in fetch(fn, regions, threads, index):
+        yield create_interval_from_segment(read, chroms)
+
+
+def write(fn, regions, out, threads=None, index=None):
+    """
+    Writes the reads of the indexed BAM file `fn` that overlap `regions` to
+    the new BAM file `out`, with the same header.  Returns `out`.
+    """
+    with pysam.AlignmentFile(fn) as template:
+        with pysam.AlignmentFile(out, 'wb', template=template) as fout:
+            for read in fetch(fn, regions, threads, index):
+                fout.write(read)
+    return out
+
+
+def _filename(value):
+    """
+    Returns the filename of a file-based BedTool or a filename, else None.
+    """
+    fn = getattr(value, 'fn', value)
+    if isinstance(fn, six.string_types) and os.path.exists(fn):
+        return fn
+    return None
+
+
+def restrict(kwargs, pushdown):
+    """
+    Returns `kwargs` for a wrapped BEDTools program with an indexed BAM input
+    replaced by a temporary BAM of only its reads that overlap the regions
+    in another input.
+
+    `pushdown` maps each argument that may be an indexed BAM to the argument
+    holding the regions and the arguments which, when set, mean that reads
+    elsewhere would change the output (see :func:`pybedtools.bedtool._wraps`).
+    Nothing is changed when `settings.bam_pushdown_regions` is 0 or the
+    regions are more than that, when the inputs aren't files, or when the BAM
+    has no index.
+    """
+    limit = settings.bam_pushdown_regions
+    if not limit:
+        return kwargs
+    for bam_kw, (regions_kw, unsafe) in pushdown.items():
+        if bam_kw not in kwargs or regions_kw not in kwargs:
+            continue
+        if any(kwargs.get(i) for i in unsafe):
+            continue
+        bam_fn = _filename(kwargs[bam_kw])
+        regions_fn = _filename(kwargs[regions_kw])
+        if bam_fn is None or regions_fn is None \
+                or not pybedtools.helpers.isBAM(bam_fn) \
+                or pybedtools.helpers.isBAM(regions_fn):
+            continue
+        index = index_fn(bam_fn)
+        if index is None:
+            continue
+        with pysam.AlignmentFile(bam_fn, index_filename=index) as bam:
+            regions = merge_regions(pybedtools.BedTool(regions_fn),
+                                    bam.references, bam.lengths, limit)
+        if regions is None:
+            continue
+        out = write(bam_fn, regions, pybedtools.BedTool._tmp(),
+                    settings.bam_threads, index)
+        kwargs = dict(kwargs)
+        kwargs[bam_kw] = out
+    return kwargs
@@ -4,6 +4,8 @@ from textwrap import dedent
 import shutil
 import subprocess
 import operator
+import heapq
+import math
 import os
 import sys
 import random
@@ -17,11 +19,21 @@ import pysam
 from warnings import warn
 
 from .helpers import (
-    get_tempdir, _tags, call_bedtools, _flatten_list, _check_sequence_stderr,
-    isBAM, isBGZIP, isGZIP, BEDToolsError, _call_randomintersect)
+    get_tempdir, _add_tag, call_bedtools, _flatten_list, _check_sequence_stderr,
+    isBAM, isBGZIP, isGZIP, BEDToolsError, PipeOutput, _call_randomintersect)
 from . import helpers
-from .cbedtools import IntervalFile, IntervalIterator, Interval, create_interval_from_list, BedToolsFileError
+from .cbedtools import (IntervalFile, IntervalIterator, Interval,
+                        create_interval_from_list, BedToolsFileError,
+                        create_interval_from_segment,
+                        BufferedIntervalIterator, LineIndex,
+                        _file_signature, count_feature_lines)
 from . import filenames
+from . import native
+from . import cache
+from . import tabix
+from . import bgzf
+from . import bamindex
+from .lazy import LazyBedTool
 import pybedtools
 from . import settings
 from . import filenames
@@ -30,6 +42,7 @@ from . import filenames
 _implicit_registry = {}
 _other_registry = {}
 _bam_registry = {}
+_native_registry = {}
 
 
 def _jaccard_output_to_dict(s, **kwargs):
@@ -53,6 +66,27 @@ def _jaccard_output_to_dict(s, **kwargs):
     return dict(list(zip(header, data)))
 
 
+# Count, field count and file type of files, keyed by absolute path.  Each
+# entry is a (signature, values) tuple, where the signature is the (size,
+# mtime) of the file the values were found for.
+_file_stats = {}
+
+# Limit on the number of files in _file_stats
+_file_stats_size = 10000
+
+
+def _native_engine(engine):
+    """
+    True if `engine` (or if it is None, `pybedtools.settings.engine`) is
+    "native".
+    """
+    engine = engine or settings.engine
+    if engine not in ('bedtools', 'native'):
+        raise ValueError(
+            'engine must be "bedtools" or "native", not %r' % engine)
+    return engine == 'native'
+
+
 def _reldist_output_handler(s, **kwargs):
     """
     reldist, if called with -detail, returns a valid BED file with the relative
@@ -83,10 +117,90 @@ def _reldist_output_handler(s, **kwargs):
     return results
 
 
+# Whether each BEDTools program can be found, and its help formatted for
+# a docstring, by program name.  Filled in on first use rather than at import,
+# since both mean looking for (or running) the program.
+_installed_cache = {}
+_help_cache = {}
+
+
+def _installed(prog):
+    """
+    True if the BEDTools program `prog` can be found, without running it.
+    """
+    try:
+        return _installed_cache[prog]
+    except KeyError:
+        pass
+    try:
+        cmd = helpers._version_2_15_plus_names(prog)[0]
+    except OSError:
+        found = False
+    else:
+        found = helpers._find_executable(cmd)
+    _installed_cache[prog] = found
+    return found
+
+
+def _bedtools_help(prog):
+    """
+    Returns the help printed by the BEDTools program `prog`, formatted to be
+    appended to a docstring.
+    """
+    try:
+        return _help_cache[prog]
+    except KeyError:
+        pass
+
+    # Call the program with -h to get help, which prints to stderr.
+    try:
+        p = subprocess.Popen(helpers._version_2_15_plus_names(prog) + ['-h'],
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        help_str = p.communicate()[1].decode()
+
+        # underscores throw off ReStructuredText syntax of docstrings, so
+        # replace 'em
+        help_str = help_str.replace('_', '**')
+
+        # indent
+        help_str = help_str.split('\n')
+        help_str = ['\n\n**Original BEDTools help:**::'] \
+            + ['\t' + i for i in help_str]
+        help_str = '\n'.join(help_str) + '\n'
+
+    except OSError:
+        help_str = '\n\n"%s" does not appear to be installed or on the ' \
+            'path, so this method is disabled unless it can be run with ' \
+            '`engine="native"`.\n' % prog
+    _help_cache[prog] = help_str
+    return help_str
+
+
+class _HelpOnLookup(object):
+    """
+    Holds a method of BedTool wrapping a BEDTools program, adding the program's
+    help to its docstring the first time it is looked up on the class (as by
+    ``help(BedTool.intersect)``, IPython's ``BedTool.intersect?`` or Sphinx).
+    Looking the method up on a BedTool just binds it, as usual.
+    """
+    def __init__(self, func):
+        self.func = func
+        self._documented = False
+
+    def __get__(self, obj, objtype=None):
+        if obj is None and not self._documented:
+            self.func.__doc__ = (self.func.__doc__ or '') \
+                + _bedtools_help(self.func._prog)
+            self._documented = True
+        return self.func.__get__(obj, objtype)
+
+
 def _wraps(prog=None, implicit=None, bam=None, other=None, uses_genome=False,
            make_tempfile_for=None, check_stderr=None, add_to_bedtool=None,
            nonbam=None, force_bam=False, genome_none_if=None, genome_if=None,
-           genome_ok_if=None, does_not_return_bedtool=None):
+           genome_ok_if=None, does_not_return_bedtool=None, native=None,
+           pushdown=None):
     """
     Do-it-all wrapper, to be used as a decorator.
 
@@ -151,43 +265,22 @@ def _wraps(prog=None, implicit=None, bam=None, other=None, uses_genome=False,
     where `output` is the output from the [possibly streaming] call to BEDTools
     and `kwargs` are passed verbatim from the wrapped method call. This is used
     for jaccard and reldist methods.
-    """
-
-    # NOTE: We are calling each BEDTools program to get its help and adding
-    # that to the docstring of each method. This is run at import time. However
-    # if BEDTools is not on the path at import time, `not_implemented` is set
-    # to True and isn't reset later until the module is reloaded.
-    #
-    # helpers.set_bedtools_path therefore will trigger a module reload.
-    not_implemented = False
-
-    # Call the program with -h to get help, which prints to stderr.
-    try:
-        p = subprocess.Popen(helpers._version_2_15_plus_names(prog) + ['-h'],
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
-        help_str = p.communicate()[1].decode()
 
-        # underscores throw off ReStructuredText syntax of docstrings, so
-        # replace 'em
-        help_str = help_str.replace('_', '**')
-
-        # indent
-        help_str = help_str.split('\n')
-        help_str = ['\n\n**Original BEDTools help:**::'] \
-            + ['\t' + i for i in help_str]
-        help_str = '\n'.join(help_str) + '\n'
-
-    # If the program can't be found, then we'll eventually replace the method
-    # with a version that does nothing but raise a NotImplementedError (plus
-    # a helpful message).
-    except OSError:
-        help_str = '"%s" does not appear to be installed '\
-            'or on the path, so this method is '\
-            'disabled.  Please install a more recent '\
-            'version of BEDTools and re-import to '\
-            'use this method.' % prog
-        not_implemented = True
+    *native*, if not None, is an in-process implementation of the program (see
+    :mod:`pybedtools.native`), used instead of calling BEDTools when the
+    method is called with `engine="native"` (or when
+    `pybedtools.settings.engine` is "native").  Its signature should be
+    ``func(bedtool, **kwargs)``, and it should return `NotImplemented` for
+    kwargs it doesn't support so that BEDTools is called after all.
+
+    *pushdown*, if not None, is a dictionary mapping each arg that may be an
+    indexed BAM file to a tuple of the arg holding the regions the program
+    compares it with, and the args that, when given, make reads outside those
+    regions matter to the output.  The BAM is then replaced with just its
+    reads overlapping the regions, read using its index (see
+    :func:`pybedtools.bamindex.restrict`).  For example, {'b': ('a', [])}
+    for coverageBed.
+    """
 
     def decorator(func):
         """
@@ -203,13 +296,23 @@ def _wraps(prog=None, implicit=None, bam=None, other=None, uses_genome=False,
             _other_registry[prog] = other
         if bam is not None:
             _bam_registry[prog] = bam
+        if native is not None:
+            _native_registry[prog] = native
 
-        # Here's where we replace an unable-to-be-found program's method with
-        # one that only returns a NotImplementedError
-        if not_implemented:
-            def not_implemented_func(*args, **kwargs):
-                raise NotImplementedError(help_str)
-            return not_implemented_func
+        def call_native(self, args, kwargs):
+            """
+            Pops the `engine` kwarg and, if the native engine was requested
+            and supports the kwargs, returns its result; otherwise returns
+            NotImplemented.
+            """
+            if not _native_engine(kwargs.pop('engine', None)) \
+                    or native is None:
+                return NotImplemented
+            _kwargs = dict(kwargs)
+            if len(args) > 0:
+                assert len(args) == 1
+                _kwargs[other] = args[0]
+            return native(self, **_kwargs)
 
         _add_doc = []
         if implicit:
@@ -239,6 +342,17 @@ def _wraps(prog=None, implicit=None, bam=None, other=None, uses_genome=False,
             A newly created function that will be returned by the _wraps()
             decorator
             """
+            result = call_native(self, args, kwargs)
+            if result is not NotImplemented:
+                return result
+
+            # If the program can't be found, raise a NotImplementedError (plus
+            # a helpful message) rather than failing to run it
+            if not _installed(prog):
+                raise NotImplementedError(
+                    '"%s" does not appear to be installed or on the path, so '
+                    'this method is disabled.  Please install a more recent '
+                    'version of BEDTools to use this method.' % prog)
 
             # Only one non-keyword argument is supported; this is then assumed
             # to be "other" (e.g., `-b` for intersectBed)
@@ -294,6 +408,10 @@ def _wraps(prog=None, implicit=None, bam=None, other=None, uses_genome=False,
             if check_for_genome:
                 kwargs = self.check_genome(**kwargs)
 
+            # Only read the parts of an indexed BAM input that can matter
+            if pushdown is not None:
+                kwargs = bamindex.restrict(kwargs, pushdown)
+
             # For sequence methods, we may need to make a tempfile that will
             # hold the resulting sequence.  For example, fastaFromBed needs to
             # make a tempfile for 'fo' if no 'fo' was explicitly specified by
@@ -338,11 +456,23 @@ def _wraps(prog=None, implicit=None, bam=None, other=None, uses_genome=False,
 
             decode_output = not result_is_bam
 
+            # Results written to a single file can be cached (see
+            # pybedtools.cache)
+            cache_key = None
+            if settings.result_cache and tmp is not None and stdin is None \
+                    and make_tempfile_for is None:
+                cache_key = cache.key(cmds)
+
             # Do the actual call
-            stream = call_bedtools(cmds, tmp, stdin=stdin,
-                                   check_stderr=check_stderr,
-                                   decode_output=decode_output,
-                                   )
+            if cache_key is not None and cache.fetch(cache_key, tmp):
+                stream = tmp
+            else:
+                stream = call_bedtools(cmds, tmp, stdin=stdin,
+                                       check_stderr=check_stderr,
+                                       decode_output=decode_output,
+                                       )
+                if cache_key is not None:
+                    cache.store(cache_key, tmp)
 
             if does_not_return_bedtool:
                 return does_not_return_bedtool(stream, **kwargs)
@@ -366,18 +496,20 @@ def _wraps(prog=None, implicit=None, bam=None, other=None, uses_genome=False,
             del kwargs
             return result
 
-        # Now add the edited docstring (original Python doctring plus BEDTools
-        # help) to the newly created method above
+        # Now add the edited docstring to the newly created method above.  The
+        # BEDTools help is added on first lookup (see _HelpOnLookup), since
+        # getting it means running the program.
         if func.__doc__ is None:
             orig = ''
         else:
             orig = func.__doc__
 
-        wrapped.__doc__ = orig + "\n".join(_add_doc) + help_str
+        wrapped.__doc__ = orig + "\n".join(_add_doc)
 
         # Add the original method's name to a new attribute so we can access it
         # when logging history
         wrapped._name = func.__name__
+        wrapped._prog = prog
 
         return wrapped
 
@@ -507,7 +639,10 @@ class BedTool(object):
             # If tuple or list, then save as file first
             # (fixes #73)
             elif isinstance(fn, (list, tuple)):
-                fn = BedTool(iter(fn)).saveas().fn
+                # (keep a reference, so that the tempfile is still in use
+                # when this BedTool takes it over)
+                saved = BedTool(iter(fn)).saveas()
+                fn = saved.fn
 
             # Otherwise assume iterator, say an open file as from
             # subprocess.PIPE
@@ -515,10 +650,12 @@ class BedTool(object):
                 fn = fn
 
         self.fn = fn
+        if isinstance(fn, six.string_types):
+            filenames.track(fn, self)
         tag = ''.join(
             [random.choice(string.ascii_lowercase) for _ in range(8)])
         self._tag = tag
-        _tags[tag] = self
+        _add_tag(tag, self)
         self._hascounts = False
         self._file_type = None
         self.history = History()
@@ -608,13 +745,32 @@ class BedTool(object):
         fout.close()
         return self.intersect(tmp)
 
-    def tabix_intervals(self, interval_or_string):
+    def tabix_intervals(self, interval_or_string, stream=False):
         """
         Retrieve all intervals within coordinates from a "tabixed" BedTool.
 
         Given either a string in "chrom:start-stop" format, or an interval-like
-        object with chrom, start, stop attributes, return a *streaming* BedTool
-        of the features in this BedTool that overlap the provided interval.
+        object with chrom, start, stop attributes, return a BedTool of the
+        features in this BedTool that overlap the provided interval.
+
+        The results are saved to a tempfile, unless `stream` is True, in which
+        case a streaming BedTool of the results (held in memory) is returned
+        instead.
+
+        Open tabix handles are kept and reused by later calls; see
+        :mod:`pybedtools.tabix`.
+        """
+        return self.tabix_intervals_many([interval_or_string], stream)[0]
+
+    def tabix_intervals_many(self, regions, stream=False, arrays=False):
+        """
+        Like :meth:`tabix_intervals`, for each of `regions`, but using a
+        single tabix handle for all of them.
+
+        Returns a list with one result per region: a BedTool saved to a
+        tempfile, a streaming BedTool if `stream` is True, or a
+        :class:`pybedtools.arrays.IntervalArray` (which requires NumPy) if
+        `arrays` is True.
         """
         if not self._tabixed():
             raise ValueError(
@@ -624,40 +780,62 @@ class BedTool(object):
         # tabix expects 1-based coords, but BEDTools works with
         # zero-based. pybedtools and pysam also work with zero-based. So we can
         # pass zero-based directly to the pysam tabix interface.
-        tbx = pysam.TabixFile(self.fn)
-
-        # If an interval is passed, use its coordinates directly
-        if isinstance(interval_or_string, Interval):
-            interval = interval_or_string
-            chrom, start, end = interval.chrom, interval.start, interval.stop
-        # Parse string directly instead of relying on Interval, in order to
-        # permit full chromosome fetching
-        else:
-            match = helpers.coord_re.search(interval_or_string)
-            # Assume string is contig if it doesn't fit chrom:start-end format
-            if match is None:
-                chrom = interval_or_string
-                start, end = None, None
-            # Otherwise parse the coordinates
-            else:
-                chrom, start, end = match.group(1, 2, 3)
-                start, end = int(start), int(end)
-
-        # Fetch results.
-        results = tbx.fetch(str(chrom), start, end)
+        results = tabix.fetch(self.fn, regions)
 
         # pysam.ctabix.TabixIterator does not include newlines when yielding so
         # we need to add them.
-        def gen():
-            for i in results:
-                yield i + '\n'
+        if arrays:
+            from .arrays import IntervalArray
+            return [IntervalArray.from_bytes(
+                ''.join(i + '\n' for i in lines).encode())
+                for lines in results]
+        if stream:
+            return [BedTool(i + '\n' for i in lines) for lines in results]
 
         # xref #190
-        x = BedTool(gen()).saveas()
-        tbx.close()
-        return x
+        saved = []
+        for lines in results:
+            fn = self._tmp()
+            with open(fn, 'w') as fout:
+                fout.writelines(i + '\n' for i in lines)
+            saved.append(BedTool(fn))
+        return saved
+
+    def fetch(self, regions, stream=False, threads=None):
+        """
+        Retrieve the reads overlapping `regions` from an indexed BAM file.
+
+        `regions` is a string in "chrom:start-stop" format or naming
+        a chromosome, an interval-like object, or an iterable of these (such
+        as a BedTool of target regions).  Using the ".bai" or ".csi" index
+        next to the BAM file, only the parts of the file holding those reads
+        are read.  Each read is returned once, in the order of the file, even
+        if it overlaps several regions.
+
+        Returns a BedTool of a new BAM file of the reads, or if `stream` is
+        True, a streaming BedTool of SAM Intervals.  With `threads`, groups
+        of regions are fetched in that many threads at once.  See
+        :mod:`pybedtools.bamindex`.
+
+        :meth:`BedTool.intersect` and :meth:`BedTool.coverage` do the same
+        for their indexed BAM inputs, when the other input has at most
+        `pybedtools.settings.bam_pushdown_regions` features.
+        """
+        if not self._isbam or not isinstance(self.fn, six.string_types):
+            raise ValueError('fetch() needs a BedTool of a BAM file')
+        index = bamindex.index_fn(self.fn)
+        if index is None:
+            raise ValueError(
+                '%s has no .bai or .csi index; create one with '
+                'pysam.index()' % self.fn)
+        if stream:
+            return BedTool(bamindex.intervals(self.fn, regions, threads,
+                                              index))
+        return BedTool(bamindex.write(self.fn, regions, self._tmp(), threads,
+                                      index))
 
-    def tabix(self, in_place=True, force=False, is_sorted=False):
+    def tabix(self, in_place=True, force=False, is_sorted=False,
+              threads=None, csi=False):
         """
         Prepare a BedTool for use with Tabix.
 
@@ -678,30 +856,55 @@ class BedTool(object):
         is_sorted : bool
             If True (default is False), then assume the file is already sorted
             so that BedTool.bgzip() doesn't have to do that work.
+
+        threads : int
+            Number of threads compressing the file (by default, one per CPU).
+
+        csi : bool
+            If True, write a CSI index (".csi") instead of a tabix index
+            (".tbi"); needed for chromosomes longer than 2**29 bp.
+
+        BED and GFF files are indexed as they are compressed, in the same
+        pass -- and when sorting, straight from the output of `bedtools
+        sort` -- rather than read again afterwards; see
+        :mod:`pybedtools.bgzf`.
         """
         # Return quickly if nothing to do
         if self._tabixed() and not force:
             return self
 
-        # Make sure it's BGZIPed
-        fn = self.bgzip(in_place=in_place, force=force)
+        preset = None
+        if isinstance(self.fn, six.string_types) and not isBGZIP(self.fn):
+            preset = self.file_type
+            if preset not in bgzf._PRESETS:
+                preset = None
 
-        pysam.tabix_index(fn, force=force, preset=self.file_type)
+        # Make sure it's BGZIPed
+        fn = self._bgzip(in_place=in_place, force=force, is_sorted=is_sorted,
+                         threads=threads, preset=preset, csi=csi)
+
+        # Other formats, and files that were already BGZIPed, are indexed
+        # afterwards
+        if preset is None:
+            pysam.tabix_index(fn, force=force, preset=BedTool(fn).file_type,
+                              csi=csi)
         return BedTool(fn)
 
     def _tabixed(self):
         """
         Verifies that we're working with a tabixed file: a string filename
-        pointing to a BGZIPed file with a .tbi file in the same dir.
+        pointing to a BGZIPed file with a .tbi or .csi file in the same dir.
         """
         if (
             isinstance(self.fn, six.string_types) and
             isBGZIP(self.fn) and
-            os.path.exists(self.fn + '.tbi')
+            (os.path.exists(self.fn + '.tbi') or
+             os.path.exists(self.fn + '.csi'))
         ):
             return True
 
-    def bgzip(self, in_place=True, force=False, is_sorted=False):
+    def bgzip(self, in_place=True, force=False, is_sorted=False,
+              threads=None):
         """
         Helper function for more control over "tabixed" BedTools.
 
@@ -713,15 +916,22 @@ class BedTool(object):
         sorting to tempfile).
 
         If `is_sorted`, then assume the file is already sorted. Otherwise call
-        bedtools sort with the `-header` option.
+        bedtools sort with the `-header` option, compressing its output as it
+        is produced.
 
         `force` will overwrite without asking.
+
+        Blocks are compressed by `threads` threads (by default, one per CPU).
         """
-        if force:
-            force_arg = "-f"
-        else:
-            force_arg = ""
+        return self._bgzip(in_place=in_place, force=force,
+                           is_sorted=is_sorted, threads=threads)
 
+    def _bgzip(self, in_place=True, force=False, is_sorted=False,
+               threads=None, preset=None, csi=False):
+        """
+        bgzip(), also indexing the file as it's written if `preset` is "bed"
+        or "gff".
+        """
         # It may already be BGZIPed...
         if isinstance(self.fn, six.string_types) and not force:
             if isBGZIP(self.fn):
@@ -729,30 +939,64 @@ class BedTool(object):
 
         # If not in_place, then make a tempfile for the BGZIPed version
         if not in_place:
-            # Get tempfile name, sorted or not
-            if not is_sorted:
-                fn = self.sort(header=True).fn
-            else:
-                fn = self._tmp()
-
+            outfn = self._tmp() + '.gz'
             # Register for later deletion
-            outfn = fn + '.gz'
             BedTool.TEMPFILES.append(outfn)
-
-            # Creates tempfile.gz
-            pysam.tabix_compress(fn, outfn, force=force)
-            return outfn
+            if preset is not None:
+                BedTool.TEMPFILES.append(outfn + ('.csi' if csi else '.tbi'))
 
         # Otherwise, make sure the BGZIPed version has a similar name to the
         # current BedTool's file
-        if in_place:
-            if not is_sorted:
-                fn = self.sort(header=True).saveas().fn
-            else:
-                fn = self.fn
+        else:
             outfn = self.fn + '.gz'
-            pysam.tabix_compress(fn, outfn, force=force)
-            return outfn
+            if os.path.exists(outfn) and not force:
+                raise IOError(
+                    "Filename '%s' already exists, use *force* to overwrite"
+                    % outfn)
+
+        if is_sorted:
+            source = self
+        else:
+            source = self.sort(header=True, stream=True)
+        bgzf.compress(source._byte_chunks(), outfn, threads=threads,
+                      preset=preset, csi=csi)
+        return outfn
+
+    def _byte_chunks(self, size=2 ** 20):
+        """
+        Yields the contents of this BedTool in chunks of bytes, read directly
+        from its file or from the pipe of an unread BEDTools call.
+        """
+        if isinstance(self.fn, six.string_types):
+            opener = gzip.open if isGZIP(self.fn) else open
+            with opener(self.fn, 'rb') as fin:
+                for chunk in iter(lambda: fin.read(size), b''):
+                    yield chunk
+            return
+
+        if isinstance(self.fn, PipeOutput):
+            pipe = self.fn.take_pipe()
+            if pipe is not None:
+                try:
+                    for chunk in iter(lambda: pipe.read(size), b''):
+                        yield chunk
+                finally:
+                    pipe.close()
+                self.fn.wait()
+                return
+
+        lines = []
+        n = 0
+        for feature in self:
+            line = str(feature)
+            lines.append(line)
+            n += len(line)
+            if n >= size:
+                yield ''.join(lines).encode('UTF-8')
+                lines = []
+                n = 0
+        if lines:
+            yield ''.join(lines).encode('UTF-8')
 
     def delete_temporary_history(self, ask=True, raw_input_func=None):
         """
@@ -831,6 +1075,8 @@ class BedTool(object):
             return result
 
         decorated.__doc__ = method.__doc__
+        if hasattr(method, '_prog'):
+            decorated._prog = method._prog
         return decorated
 
     def filter(self, func, *args, **kwargs):
@@ -867,6 +1113,10 @@ class BedTool(object):
         >>> a.field_count()
         6
         """
+        return self._cached_stat(('field_count', n),
+                                 lambda: self._field_count(n))
+
+    def _field_count(self, n):
         if self.file_type == 'empty':
             return 0
         i = 0
@@ -875,11 +1125,36 @@ class BedTool(object):
             if i > n:
                 break
             i += 1
-            # TODO: make this more efficient.
             fields.update([len(feat.fields)])
         assert len(fields) == 1, fields
         return list(fields)[0]
 
+    def _cached_stat(self, key, func):
+        """
+        Returns func(), which should compute something about this BedTool's
+        file.  For files on disk, the result is saved in `_file_stats` under
+        `key` until the file's size or modification time changes.
+        """
+        if not isinstance(self.fn, six.string_types) \
+                or not os.path.exists(self.fn):
+            return func()
+        path = os.path.abspath(self.fn)
+        signature = _file_signature(path)
+        try:
+            cached_signature, values = _file_stats[path]
+        except KeyError:
+            cached_signature = None
+        if cached_signature != signature:
+            if len(_file_stats) >= _file_stats_size:
+                _file_stats.clear()
+            values = {}
+            _file_stats[path] = (signature, values)
+        try:
+            return values[key]
+        except KeyError:
+            result = values[key] = func()
+            return result
+
     def each(self, func, *args, **kwargs):
         """
         Modify each feature with a user-defined function.
@@ -951,11 +1226,17 @@ class BedTool(object):
 
         # group on the name.
         exon_intervals = IntervalFile(exon_iter.fn)
-        for g in gene_iter:
-            # search finds all, but we just want the ones that completely
+        genes = list(gene_iter)
+
+        # genes are sorted, so the exons for all of them can be found in
+        # a single pass.
+        offsets, hits = exon_intervals.all_hits_many(
+            genes, same_strand=True, sorted=True)
+        for j, g in enumerate(genes):
+            # hits are all overlaps, but we just want the ones that completely
             # overlap this gene.
             exons = [
-                e for e in exon_intervals.search(g, same_strand=True)
+                e for e in hits[offsets[j]:offsets[j + 1]]
                 if e.start >= g.start and e.end <= g.end]
 
             for i, exon in enumerate(exons):
@@ -1003,13 +1284,16 @@ class BedTool(object):
         if self._isbam:
             self._file_type = 'bam'
         else:
-            try:
-                self._file_type = six.advance_iterator(iter(self)).file_type
-            except StopIteration:
-                self._file_type = 'empty'
+            self._file_type = self._cached_stat('file_type', self._sniff)
 
         return self._file_type
 
+    def _sniff(self):
+        try:
+            return six.advance_iterator(iter(self)).file_type
+        except StopIteration:
+            return 'empty'
+
     def cut(self, indexes, stream=False):
         """
         Analagous to unix `cut`.
@@ -1049,12 +1333,15 @@ class BedTool(object):
         Makes a tempfile and registers it in the BedTool.TEMPFILES class
         variable.  Adds a "pybedtools." prefix and ".tmp" extension for easy
         deletion if you forget to call pybedtools.cleanup().
+
+        BedTools created for the file keep it in use; see
+        `settings.tempfile_refcount` and `settings.tempfile_quota`.
         '''
         tmpfn = tempfile.NamedTemporaryFile(prefix=settings.tempfile_prefix,
                                             suffix=settings.tempfile_suffix,
                                             delete=False)
         tmpfn = tmpfn.name
-        BedTool.TEMPFILES.append(tmpfn)
+        filenames.register_tempfile(tmpfn)
         return tmpfn
 
     def __iter__(self):
@@ -1072,9 +1359,9 @@ class BedTool(object):
             if not os.path.exists(self.fn):
                 raise BedToolsFileError("{0} does not exist".format(self.fn))
             if isGZIP(self.fn):
-                return IntervalIterator(gzip.open(self.fn, 'rt'))
+                return BufferedIntervalIterator(gzip.open(self.fn, 'rb'))
             else:
-                return IntervalIterator(open(self.fn, 'r'))
+                return BufferedIntervalIterator(open(self.fn, 'rb'))
         # Any other kind of input (streaming string from stdout; iterable of
         # Intervals, iterable of (chrom, start, stop) tuples, etc are handled
         # appropriately by IntervalIterator.
@@ -1084,7 +1371,7 @@ class BedTool(object):
     @property
     def intervals(self):
         if isinstance(self.fn, six.string_types):
-            return IntervalFile(self.fn)
+            return IntervalFile(self.fn, index=settings.interval_index)
         else:
             raise ValueError("Please convert to a file-based BedTool using saveas")
 
@@ -1130,10 +1417,42 @@ class BedTool(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def _line_index(self):
+        """
+        Returns a LineIndex of this BedTool's file, or None if
+        `pybedtools.settings.line_index` is False or the file can't be
+        indexed.
+        """
+        if not settings.line_index or self._isbam \
+                or not isinstance(self.fn, six.string_types) \
+                or not os.path.exists(self.fn) or isGZIP(self.fn):
+            return None
+        index = getattr(self, '_line_offsets', None)
+        if index is None or index.signature != _file_signature(self.fn):
+            index = self._line_offsets = LineIndex(self.fn)
+        return index
+
+    def _lines_to_bedtool(self, index, inds):
+        """
+        Writes the lines `inds` of LineIndex `index` to a new tempfile and
+        returns a BedTool for it.
+        """
+        tmpfn = self._tmp()
+        with open(tmpfn, 'wb') as fout:
+            for i in inds:
+                fout.write(index.line(i))
+                fout.write(b'\n')
+        return BedTool(tmpfn)
+
     def __getitem__(self, key):
+        index = self._line_index()
         if isinstance(key, slice):
+            if index is not None:
+                return (index[i] for i in range(*key.indices(len(index))))
             return islice(self, key.start, key.stop, key.step)
         elif isinstance(key, int):
+            if index is not None:
+                return index[key]
             return list(islice(self, key, key + 1))[0]
         else:
             raise ValueError('Only slices or integers allowed for indexing '
@@ -1181,9 +1500,7 @@ class BedTool(object):
         if as_string:
             return ''.join(str(line) for line in self[:n])
         else:
-            for i, line in enumerate(iter(self)):
-                if i == (n):
-                    break
+            for line in self[:n]:
                 print(line, end=' ')
 
     def set_chromsizes(self, chromsizes):
@@ -1234,6 +1551,20 @@ class BedTool(object):
             return fn
 
 
+        # Unread output of a BEDTools call is copied straight from its pipe
+        # rather than parsed into Intervals and formatted again
+        stream = iterable.fn if isinstance(iterable, BedTool) else iterable
+        if isinstance(stream, PipeOutput) and not compressed:
+            pipe = stream.take_pipe()
+            if pipe is not None:
+                with open(fn, 'wb') as out_:
+                    if trackline:
+                        out_.write((trackline.strip() + '\n').encode())
+                    shutil.copyfileobj(pipe, out_)
+                pipe.close()
+                stream.wait()
+                return fn
+
         if isinstance(iterable, BedTool) and isinstance(iterable.fn, six.string_types):
             if compressed:
                 with gzip.open(fn, 'wt') as out_:
@@ -1322,6 +1653,12 @@ class BedTool(object):
             #     kwargs[inarg1] = 'stdin'
             #     stdin = instream1
 
+            # Unread output of another BEDTools call: connect the processes
+            # with an OS pipe (see helpers.call_bedtools)
+            elif isinstance(instream1, PipeOutput) and not instream1.started:
+                kwargs[inarg1] = 'stdin'
+                stdin = instream1
+
             # A generator or iterator: pipe it as a generator of lines
             else:
                 kwargs[inarg1] = 'stdin'
@@ -1526,12 +1863,13 @@ class BedTool(object):
         """
         if not isinstance(interval, Interval):
             raise ValueError("Need an Interval instance")
-        fn = self.fn
-        if not isinstance(fn, six.string_types):
-            fn = self.saveas().fn
-        if self._isbam:
-            fn = self.bam_to_bed().fn
-        interval_file = pybedtools.IntervalFile(fn)
+        bedtool = self
+        if not isinstance(bedtool.fn, six.string_types):
+            bedtool = bedtool.saveas()
+        if bedtool._isbam:
+            bedtool = bedtool.bam_to_bed()
+        interval_file = pybedtools.IntervalFile(
+            bedtool.fn, index=settings.interval_index)
         return interval_file.all_hits(interval, same_strand, overlap)
 
     def any_hits(self, interval, same_strand=False, overlap=0.0):
@@ -1554,12 +1892,13 @@ class BedTool(object):
         """
         if not isinstance(interval, Interval):
             raise ValueError("Need an Interval instance")
-        fn = self.fn
-        if not isinstance(fn, six.string_types):
-            fn = self.saveas().fn
-        if self._isbam:
-            fn = self.bam_to_bed().fn
-        interval_file = pybedtools.IntervalFile(fn)
+        bedtool = self
+        if not isinstance(bedtool.fn, six.string_types):
+            bedtool = bedtool.saveas()
+        if bedtool._isbam:
+            bedtool = bedtool.bam_to_bed()
+        interval_file = pybedtools.IntervalFile(
+            bedtool.fn, index=settings.interval_index)
         return interval_file.any_hits(interval, same_strand, overlap)
 
     def count_hits(self, interval, same_strand=False, overlap=0.0):
@@ -1582,12 +1921,13 @@ class BedTool(object):
         """
         if not isinstance(interval, Interval):
             raise ValueError("Need an Interval instance")
-        fn = self.fn
-        if not isinstance(fn, six.string_types):
-            fn = self.saveas().fn
-        if self._isbam:
-            fn = self.bam_to_bed().fn
-        interval_file = pybedtools.IntervalFile(fn)
+        bedtool = self
+        if not isinstance(bedtool.fn, six.string_types):
+            bedtool = bedtool.saveas()
+        if bedtool._isbam:
+            bedtool = bedtool.bam_to_bed()
+        interval_file = pybedtools.IntervalFile(
+            bedtool.fn, index=settings.interval_index)
         return interval_file.count_hits(interval, same_strand, overlap)
 
     @_log_to_history
@@ -1680,10 +2020,15 @@ class BedTool(object):
 
     @_log_to_history
     @_wraps(prog='intersectBed', implicit='a', other='b', bam='abam',
-            nonbam='bed')
+            nonbam='bed', native=native.intersect,
+            pushdown={'abam': ('b', ['v', 'c', 'C', 'loj', 'wao']),
+                      'b': ('a', [])})
     def intersect(self):
         """
         Wraps `bedtools intersect`.
+
+        With `engine="native"`, common uses of intersect are run in-process
+        instead; see :func:`pybedtools.native.intersect`.
         """
 
     @_log_to_history
@@ -1843,13 +2188,17 @@ class BedTool(object):
         """
 
     @_log_to_history
-    @_wraps(prog='mergeBed', implicit='i', other=None, bam=None)
+    @_wraps(prog='mergeBed', implicit='i', other=None, bam=None,
+            native=native.merge)
     def merge(self):
         """
         Wraps `bedtools merge`.
 
         Merge overlapping features together. Returns a new BedTool object.
 
+        With `engine="native"`, merge is run in-process instead; see
+        :func:`pybedtools.native.merge`.
+
         Example usage:
 
             >>> a = pybedtools.example_bedtool('a.bed')
@@ -1927,7 +2276,7 @@ class BedTool(object):
         """
 
     @_log_to_history
-    @_wraps(prog='sortBed', implicit='i')
+    @_wraps(prog='sortBed', implicit='i', native=native.sort)
     def sort(self):
         """
         Wraps `bedtools sort`.
@@ -1935,6 +2284,9 @@ class BedTool(object):
         Note that chromosomes are sorted lexograpically, so chr12 will come
         before chr9.
 
+        With `engine="native"`, sort is run in-process instead; see
+        :func:`pybedtools.native.sort`.
+
         Example usage:
 
         >>> a = pybedtools.BedTool('''
@@ -2048,7 +2400,7 @@ class BedTool(object):
 
     @_log_to_history
     @_wraps(prog='coverageBed', implicit='a', other='b', bam='abam',
-            nonbam='ALL')
+            nonbam='ALL', pushdown={'b': ('a', [])})
     def coverage(self):
         """
         Wraps `bedtools coverage`.
@@ -2092,10 +2444,15 @@ class BedTool(object):
         """
 
     @_log_to_history
-    @_wraps(prog='complementBed', implicit='i', uses_genome=True)
+    @_wraps(prog='complementBed', implicit='i', uses_genome=True,
+            native=native.complement)
     def complement(self):
         """
         Wraps `bedtools complement`.
+
+        With `engine="native"`, complement is run in-process instead; see
+        :func:`pybedtools.native.complement`.
+
         Example usage:
 
         >>> a = pybedtools.example_bedtool('a.bed')
@@ -2377,11 +2734,24 @@ class BedTool(object):
         >>> a = pybedtools.example_bedtool('a.bed')
         >>> a.count()
         4
+
+        For files, lines are counted without parsing them, and the count is
+        saved until the file changes, so calling this again is free.
         """
         if hasattr(self, 'next') or hasattr(self, '__next__'):
             return sum(1 for _ in self)
+        if isinstance(self.fn, six.string_types) \
+                and os.path.exists(self.fn):
+            return self._cached_stat('count', self._count_lines)
         return sum(1 for _ in iter(self))
 
+    def _count_lines(self):
+        if self._isbam:
+            return sum(1 for _ in iter(self))
+        if isGZIP(self.fn):
+            return count_feature_lines(gzip.open(self.fn, 'rb'))
+        return count_feature_lines(open(self.fn, 'rb'))
+
     def print_sequence(self):
         """
         Print the sequence that was retrieved by BedTool.sequence.
@@ -2433,7 +2803,8 @@ class BedTool(object):
         return new_bedtool
 
     def randomstats(self, other, iterations, new=False, genome_fn=None,
-                    include_distribution=False, **kwargs):
+                    include_distribution=False, engine=None, statistics=None,
+                    **kwargs):
         """
         Dictionary of results from many randomly shuffled intersections.
 
@@ -2484,6 +2855,16 @@ class BedTool(object):
 
             print(results['percentile'])
             90.0
+
+        With `engine="native"`, `self` and `other` are each read once and
+        the actual and randomized overlaps are all computed in-process by
+        :func:`pybedtools.stats.random_statistics`, with the shufflings drawn
+        in batches rather than one shuffleBed call each, which is fast
+        enough for 100,000 iterations.  `statistics` can then also list
+        "bp" (the total length of the overlapping features) and "jaccard"
+        (as reported by :meth:`BedTool.jaccard`); the results will include
+        a dictionary of these same statistics for each one, under the
+        "statistics" key.
         """
         if ('intersect_kwargs' not in kwargs) or \
                 (kwargs['intersect_kwargs'] is None):
@@ -2492,6 +2873,7 @@ class BedTool(object):
             import numpy as np
         except ImportError:
             raise ImportError("Need to install NumPy for stats...")
+        names = ['count'] + [i for i in (statistics or []) if i != 'count']
 
         def percentileofscore(a, score):
             """
@@ -2508,74 +2890,109 @@ class BedTool(object):
                 a_len = np.array(list(range(len(a)))) + 1.0
 
             a = np.sort(a)
-            idx = [a == score]
+            idx = a == score
             pct = (np.mean(a_len[idx]) / n) * 100.0
             return pct
 
+        def summarize(actual, distribution):
+            # Median of distribution
+            med_count = np.median(distribution)
+
+            n = float(len(distribution))
+
+            frac_above = np.sum(distribution > actual) / n
+            frac_below = np.sum(distribution < actual) / n
+
+            normalized = actual / med_count
+
+            lower_thresh = 2.5
+            upper_thresh = 97.5
+            lower, upper = np.percentile(
+                distribution, [lower_thresh, upper_thresh])
+
+            actual_percentile = percentileofscore(distribution, actual)
+            d = {
+                'actual': actual,
+                'frac randomized above actual': frac_above,
+                'frac randomized below actual': frac_below,
+                'median randomized': med_count,
+                'normalized': normalized,
+                'percentile': actual_percentile,
+                'lower_%sth' % lower_thresh: lower,
+                'upper_%sth' % upper_thresh: upper,
+            }
+            if include_distribution:
+                d['distribution'] = distribution
+            return d
+
         if isinstance(other, six.string_types):
             other = BedTool(other)
         else:
             assert isinstance(other, BedTool),\
                 'Either filename or another BedTool instance required'
 
-        # Actual (unshuffled) counts.
-        i_kwargs = kwargs['intersect_kwargs']
-        actual = len(self.intersect(other, **i_kwargs))
-
-        # List of counts from randomly shuffled versions.
-        # Length of counts == *iterations*.
-
-        if not new:
-            distribution = self.randomintersection(
-                other, iterations=iterations, **kwargs)
-        else:
-            # use new mechanism
-            if genome_fn is None:
+        result = NotImplemented
+        if _native_engine(engine):
+            shuffle_kwargs = dict(kwargs.get('shuffle_kwargs') or {})
+            if genome_fn and 'g' not in shuffle_kwargs \
+                    and 'genome' not in shuffle_kwargs:
+                shuffle_kwargs['g'] = genome_fn
+            g, shuffle_kwargs = self._shuffle_genome(
+                shuffle_kwargs, kwargs.get('debug', False))
+            result = pybedtools.stats.random_statistics(
+                self, other, g, iterations, shuffle_kwargs,
+                kwargs['intersect_kwargs'], statistics=names)
+
+        if result is NotImplemented:
+            if len(names) > 1:
                 raise ValueError(
-                    '`genome_fn` must be provided if using the '
-                    'new _randomintersection mechanism')
-            distribution = self._randomintersection(
-                other, iterations=iterations, genome_fn=genome_fn, **kwargs)
-
-        distribution = np.array(list(distribution))
-
-        # Median of distribution
-        med_count = np.median(distribution)
+                    'statistics other than "count" need engine="native"')
 
-        n = float(len(distribution))
+            # Actual (unshuffled) counts.
+            i_kwargs = kwargs['intersect_kwargs']
+            actual = len(self.intersect(other, **i_kwargs))
 
-        frac_above = sum(distribution > actual) / n
-        frac_below = sum(distribution < actual) / n
+            # List of counts from randomly shuffled versions.
+            # Length of counts == *iterations*.
 
-        normalized = actual / med_count
-
-        lower_thresh = 2.5
-        upper_thresh = 97.5
-        lower, upper = np.percentile(
-            distribution, [lower_thresh, upper_thresh])
-
-        actual_percentile = percentileofscore(distribution, actual)
-        d = {
+            if not new:
+                distribution = self.randomintersection(
+                    other, iterations=iterations, engine='bedtools',
+                    **kwargs)
+            else:
+                # use new mechanism
+                if genome_fn is None:
+                    raise ValueError(
+                        '`genome_fn` must be provided if using the '
+                        'new _randomintersection mechanism')
+                distribution = self._randomintersection(
+                    other, iterations=iterations, genome_fn=genome_fn,
+                    engine='bedtools', **kwargs)
+
+            result = {
+                'self': len(self),
+                'other': len(other),
+                'actual': {'count': actual},
+                'distribution': {
+                    'count': np.array(list(distribution))},
+            }
+
+        d = summarize(result['actual']['count'],
+                      result['distribution']['count'])
+        d.update({
             'iterations': iterations,
-            'actual': actual,
             'file_a': self.fn,
             'file_b': other.fn,
-            self.fn: len(self),
-            other.fn: len(other),
-            'self': len(self),
-            'other': len(other),
-            'frac randomized above actual': frac_above,
-            'frac randomized below actual': frac_below,
-            'median randomized': med_count,
-            'normalized': normalized,
-            'percentile': actual_percentile,
-            'lower_%sth' % lower_thresh: lower,
-            'upper_%sth' % upper_thresh: upper,
-        }
-        if include_distribution:
-            d['distribution'] = distribution
-        else:
-            del distribution
+            self.fn: result['self'],
+            other.fn: result['other'],
+            'self': result['self'],
+            'other': result['other'],
+        })
+        if len(names) > 1:
+            d['statistics'] = dict(
+                (name, summarize(result['actual'][name],
+                                 result['distribution'][name]))
+                for name in names)
         return d
 
     def random_op(self, *args, **kwargs):
@@ -2620,7 +3037,7 @@ class BedTool(object):
         if processes == 1:
             for it in range(iterations):
                 yield func(*func_args, **func_kwargs)
-            raise StopIteration
+            return
 
         if _orig_pool:
             p = _orig_pool
@@ -2635,16 +3052,17 @@ class BedTool(object):
         #
         # Here, we don't care about the order, and don't want the subprocesses
         # to block.
+        # Lists of Intervals are sent back as one IntervalBatch each
+        from .parallel import _call_batched, _from_batch
         results = [
-            p.apply_async(func, func_args, func_kwargs)
+            p.apply_async(_call_batched, (func, func_args, func_kwargs))
             for it in range(iterations)]
         for r in results:
-            yield r.get()
-        raise StopIteration
+            yield _from_batch(r.get())
 
     def random_jaccard(self, other, genome_fn=None, iterations=None,
                        processes=1, _orig_pool=None, shuffle_kwargs=None,
-                       jaccard_kwargs=None):
+                       jaccard_kwargs=None, engine=None):
         """
         Computes the naive Jaccard statistic (intersection divided by union).
 
@@ -2666,6 +3084,11 @@ class BedTool(object):
         Returns a tuple of the observed Jaccard statistic and a list of the
         randomized statistics (which will be an empty list if `iterations` was
         None).
+
+        With `engine="native"` and NumPy installed, the shufflings are done
+        in-process, all at once, by :class:`pybedtools.arrays.Shuffler`
+        instead of by shuffleBed and jaccard; see
+        :func:`pybedtools.stats.random_jaccards`.
         """
         if shuffle_kwargs is None:
             shuffle_kwargs = {}
@@ -2674,6 +3097,12 @@ class BedTool(object):
         if not genome_fn:
             raise ValueError(
                 "Need a genome filename in order to perform randomization")
+        if _native_engine(engine):
+            result = pybedtools.stats.random_jaccards(
+                self, other, genome_fn, iterations, shuffle_kwargs,
+                jaccard_kwargs)
+            if result is not NotImplemented:
+                return result
         return list(
             self.parallel_apply(
                 iterations=iterations,
@@ -2690,10 +3119,11 @@ class BedTool(object):
 
     def _randomintersection(self, other, iterations, genome_fn,
                             intersect_kwargs=None, _orig_pool=None,
-                            shuffle_kwargs=None, processes=1):
+                            shuffle_kwargs=None, processes=1, engine=None):
         """
         Re-implementation of BedTool.randomintersection using the new
-        `random_op` method
+        `random_op` method, or with `engine="native"`, using
+        :func:`pybedtools.stats.random_intersections`
         """
         if shuffle_kwargs is None:
             shuffle_kwargs = {}
@@ -2702,6 +3132,12 @@ class BedTool(object):
         if not genome_fn:
             raise ValueError(
                 "Need a genome filename in order to perform randomization")
+        if _native_engine(engine):
+            result = pybedtools.stats.random_intersections(
+                self, other, genome_fn, iterations, shuffle_kwargs,
+                intersect_kwargs)
+            if result is not NotImplemented:
+                return result
         return list(
             self.parallel_apply(
                 iterations=iterations,
@@ -2718,7 +3154,7 @@ class BedTool(object):
 
     def randomintersection_bp(self, other, iterations, genome_fn,
                               intersect_kwargs=None, shuffle_kwargs=None,
-                              processes=1, _orig_pool=None):
+                              processes=1, _orig_pool=None, engine=None):
         """
         Like randomintersection, but return the bp overlap instead of the
         number of intersecting intervals.
@@ -2730,6 +3166,12 @@ class BedTool(object):
         if not genome_fn:
             raise ValueError(
                 "Need a genome filename in order to perform randomization")
+        if _native_engine(engine):
+            result = pybedtools.stats.random_intersections(
+                self, other, genome_fn, iterations, shuffle_kwargs,
+                intersect_kwargs, bp=True)
+            if result is not NotImplemented:
+                return result
         return list(
             self.parallel_apply(
                 iterations=iterations,
@@ -2744,10 +3186,22 @@ class BedTool(object):
             )
         )
 
+    def _shuffle_genome(self, shuffle_kwargs, debug=False):
+        """
+        Returns the genome filename given by `shuffle_kwargs` (or by
+        self.chromsizes) and the remaining shuffle kwargs, for the functions
+        in :mod:`pybedtools.stats`.  With `debug`, the seed defaults to 0.
+        """
+        kwargs = dict(shuffle_kwargs or {})
+        if debug:
+            kwargs.setdefault('seed', 0)
+        kwargs = self.check_genome(**kwargs)
+        return kwargs.pop('g'), kwargs
+
     def randomintersection(self, other, iterations, intersect_kwargs=None,
                            shuffle_kwargs=None, debug=False,
                            report_iterations=False, processes=None,
-                           _orig_processes=None):
+                           _orig_processes=None, engine=None):
         """
         Perform `iterations` shufflings, each time intersecting with `other`.
 
@@ -2767,6 +3221,13 @@ class BedTool(object):
         set the seed to the iteration number.  You may also break up the
         intersections across multiple processes with *processes* > 1.
 
+        With `engine="native"` and NumPy installed, all the shufflings are
+        instead done in-process by :class:`pybedtools.arrays.Shuffler` and
+        compared with *other* without writing them to files, which is much
+        faster for many iterations; see
+        :func:`pybedtools.stats.random_intersections`.  The "seed" kwarg then
+        seeds the whole series of shufflings, and debug=True uses a seed of 0.
+
         Example usage:
 
             >>> chromsizes = {'chr1':(0, 1000)}
@@ -2778,6 +3239,17 @@ class BedTool(object):
             [2, 2, 3, 0, 3, 3, 0, 0, 2, 4]
 
         """
+        if _native_engine(engine):
+            g, kwargs = self._shuffle_genome(shuffle_kwargs, debug)
+            i_kwargs = dict(intersect_kwargs or {})
+            i_kwargs.setdefault('u', True)
+            result = pybedtools.stats.random_intersections(
+                self, other, g, iterations, kwargs, i_kwargs)
+            if result is not NotImplemented:
+                for value in result:
+                    yield value
+                return
+
         if processes is not None:
             p = multiprocessing.Pool(processes)
             iterations_each = [iterations // processes] * processes
@@ -2796,7 +3268,7 @@ class BedTool(object):
             for r in results:
                 for value in r.get():
                     yield value
-            raise StopIteration
+            return
 
         if shuffle_kwargs is None:
             shuffle_kwargs = {}
@@ -3037,9 +3509,10 @@ class BedTool(object):
         return BedTool(fn)
 
     @_log_to_history
-    def random_subset(self, n, seed=None):
+    def random_subset(self, n, seed=None, weights=None, stratify=None):
         '''
-        Return a BedTool containing a random subset.
+        Return a BedTool containing a random subset of `n` features, in the
+        order they appear in this BedTool.
 
         Example usage:
 
@@ -3047,19 +3520,75 @@ class BedTool(object):
         >>> b = a.random_subset(2)
         >>> len(b)
         2
-        '''
-        idxs = list(range(len(self)))
-        if seed is not None:
-            random.seed(seed)
-        random.shuffle(idxs)
-        idxs = idxs[:n]
 
-        tmpfn = self._tmp()
-        tmp = open(tmpfn, 'w')
+        Features are chosen in a single pass by reservoir sampling, keeping
+        only the chosen features in memory, so this also works for streaming
+        BedTools.  `seed` makes the choice reproducible; otherwise the
+        `random` module's global state is used.
+
+        `weights`, if given, is a function that returns a non-negative weight
+        for a feature.  Features are then chosen, without replacement, with
+        probability proportional to their weights (using the method of
+        Efraimidis and Spirakis, 2006); features of weight 0 are never
+        chosen.
+
+        `stratify`, if given, is a function that returns a group for a
+        feature, or the name of an Interval attribute like "chrom".  Up to
+        `n` features are then chosen from each group:
+
+        >>> b = a.random_subset(1, seed=1, stratify='strand')
+        >>> sorted(f.strand for f in b)
+        ['+', '-']
+
+        With `pybedtools.settings.line_index = True`, and neither `weights`
+        nor `stratify`, only the chosen lines of a file are read, using a
+        :class:`pybedtools.cbedtools.LineIndex`.
+        '''
+        rng = random.Random(seed) if seed is not None else random
+        if weights is None and stratify is None:
+            index = self._line_index()
+            if index is not None:
+                idxs = rng.sample(six.moves.range(len(index)),
+                                  min(n, len(index)))
+                return self._lines_to_bedtool(index, sorted(idxs))
+        if isinstance(stratify, six.string_types):
+            stratify = operator.attrgetter(stratify)
+
+        # Per group, the number of features seen so far and the reservoir:
+        # a list of (position, line) or, when weighted, a heap of (key,
+        # position, line) that keeps the `n` largest keys
+        seen = {}
+        reservoirs = {}
         for i, f in enumerate(self):
-            if i in idxs:
-                tmp.write(str(f))
-        tmp.close()
+            group = stratify(f) if stratify is not None else None
+            reservoir = reservoirs.setdefault(group, [])
+            if weights is None:
+                k = seen.get(group, 0)
+                seen[group] = k + 1
+                if k < n:
+                    reservoir.append((i, str(f)))
+                else:
+                    j = rng.randint(0, k)
+                    if j < n:
+                        reservoir[j] = (i, str(f))
+                continue
+            w = weights(f)
+            if w < 0:
+                raise ValueError('negative weight %r for %s' % (w, f))
+            if w == 0 or n < 1:
+                continue
+            key = math.log(1.0 - rng.random()) / w
+            if len(reservoir) < n:
+                heapq.heappush(reservoir, (key, i, str(f)))
+            elif key > reservoir[0][0]:
+                heapq.heapreplace(reservoir, (key, i, str(f)))
+
+        chosen = sorted(item[-2:] for reservoir in reservoirs.values()
+                        for item in reservoir)
+        tmpfn = self._tmp()
+        with open(tmpfn, 'w') as tmp:
+            for _, line in chosen:
+                tmp.write(line)
         return BedTool(tmpfn)
 
     def total_coverage(self):
@@ -3115,15 +3644,20 @@ class BedTool(object):
             setattr(self, key, value)
         return self
 
-    def as_intervalfile(self):
+    def as_intervalfile(self, index=None):
         """
         Returns an IntervalFile of this BedTool for low-level interface.
+
+        `index` is passed to IntervalFile; if None, then
+        `pybedtools.settings.interval_index` is used.
         """
         if not isinstance(self.fn, six.string_types):
             fn = self._collapse(self.fn)
         else:
             fn = self.fn
-        return IntervalFile(fn)
+        if index is None:
+            index = settings.interval_index
+        return IntervalFile(fn, index=index)
 
     def liftover(self, chainfile, unmapped=None, liftover_args=""):
         """
@@ -3258,8 +3792,16 @@ class BedTool(object):
 
     def at(self, inds):
         """
-        Returns a new BedTool with only intervals at lines `inds`
+        Returns a new BedTool with only intervals at lines `inds`, which
+        should be sorted.
+
+        With `pybedtools.settings.line_index = True`, only those lines are
+        read, using a :class:`pybedtools.cbedtools.LineIndex`, and `inds`
+        can be in any order.
         """
+        index = self._line_index()
+        if index is not None:
+            return self._lines_to_bedtool(index, inds)
         length = len(inds)
 
         def _gen():
@@ -3305,6 +3847,66 @@ class BedTool(object):
 
         return pandas.read_table(self.fn, names=_names, header=None, *args, **kwargs)
 
+    def to_arrays(self):
+        """
+        Parse into a :class:`pybedtools.arrays.IntervalArray`, a columnar
+        NumPy-backed container that avoids creating an Interval for each
+        feature.
+
+        >>> a = pybedtools.example_bedtool('a.bed')
+        >>> arr = a.to_arrays()
+        >>> print(arr.starts)
+        [  1 100 150 900]
+        """
+        if self._isbam:
+            raise ValueError("BAM not supported for converting to arrays")
+        if not isinstance(self.fn, six.string_types):
+            raise ValueError("use .saveas() to make sure self.fn is a file")
+        try:
+            from .arrays import IntervalArray
+        except ImportError:
+            raise ImportError(
+                "numpy must be installed to convert to an IntervalArray")
+        return IntervalArray(self.fn)
+
+    def lazy(self, sorted=False, merged=False):
+        """
+        Returns a :class:`pybedtools.lazy.LazyBedTool` that records chained
+        operations on this BedTool and optimizes them before running them.
+
+        Use `sorted=True` if this BedTool is already sorted by chromosome and
+        then start, as by :meth:`BedTool.sort`, and `merged=True` if none of
+        its features overlap or are book-ended, so that the planner can make
+        use of it.
+
+        >>> a = pybedtools.example_bedtool('a.bed')
+        >>> print(a.lazy(sorted=True).sort().merge().explain()) #doctest: +ELLIPSIS
+        <BedTool(.../a.bed)>
+            .merge()
+        """
+        bed3 = isinstance(self.fn, six.string_types) and not self._isbam \
+            and self.field_count() == 3
+        return LazyBedTool(self, sorted=sorted, merged=merged, bed3=bed3)
+
+    def parallel(self, processes=None, pool=None):
+        """
+        Returns a :class:`pybedtools.parallel.ParallelBedTool` that runs
+        methods such as `intersect`, `closest` or `merge` on groups of
+        chromosomes in `processes` processes (by default, one per CPU) and
+        concatenates the results.
+
+        `pool` may be a :class:`pybedtools.parallel.WorkerPool`, or an
+        executor as accepted by it, to use instead of starting new processes.
+
+        >>> a = pybedtools.example_bedtool('a.bed')
+        >>> b = pybedtools.example_bedtool('b.bed')
+        >>> x = a.parallel(processes=2).intersect(b, u=True, engine='native')
+        >>> x == a.intersect(b, u=True, engine='native')
+        True
+        """
+        from .parallel import ParallelBedTool
+        return ParallelBedTool(self, processes=processes, pool=pool)
+
     def tail(self, lines=10, as_string=False):
         """
         Like `head`, but prints last 10 lines of the file by default.
@@ -3344,93 +3946,38 @@ class BedTool(object):
             print(result)
 
 
+# Get the BEDTools help for the docstrings of the wrapped methods when it is
+# first wanted, rather than running every program at import
+for _name, _method in list(vars(BedTool).items()):
+    if getattr(_method, '_prog', None) is not None:
+        setattr(BedTool, _name, _HelpOnLookup(_method))
+del _name, _method
+
+
 class BAM(object):
-    def __init__(self, stream):
+    def __init__(self, stream, threads=None):
         """
         Wraps pysam.Samfile so that it yields pybedtools.Interval objects when
         iterated over.
 
         The pysam.Samfile can be accessed via the .pysam_bamfile attribute.
+
+        `threads` is the number of threads pysam uses to decompress the file;
+        by default, `pybedtools.settings.bam_threads`.
         """
         self.stream = stream
         if not isinstance(self.stream, six.string_types):
             raise ValueError("Only files are supported, not streams")
-        self.pysam_bamfile = pysam.Samfile(self.stream)
-
-    def _aligned_segment_to_interval(self, r):
-        if r.rname >= 0:
-            rname = self.pysam_bamfile.getrname(r.rname)
-        else:
-            rname = "*"
-
-        if r.rnext >= 0:
-            if r.rnext == r.rname:
-                rnext = "="
-            else:
-                rnext = self.pysam_bamfile.getrname(r.rnext)
-        else:
-            rnext = "*"
-
-        # SAM spec says if unavailable should be set to 0. Pysam sets to -1.
-
-        if r.pnext <= 0:
-            pnext = "0"
-        else:
-            # +1 here because cbedtools.pyx expects SAM -- which is 1-based --
-            # but pysam uses 0-based.
-            pnext = str(r.pnext + 1)
-
-        if r.cigarstring:
-            cigarstring = r.cigarstring
-        else:
-            cigarstring = "*"
-
-        # Rudimentary support.
-        # TODO: remove when refactoring to new BAM iterating
-        tags = []
-        for k, v in r.tags:
-            if isinstance(v, int):
-                t = 'i'
-            elif isinstance(v, float):
-                t = 'f'
-            else:
-                t = 'Z'
-            tags.append('{0}:{1}:{2}'.format(k, t, v))
-
-        tags = '\t'.join(tags)
+        if threads is None:
+            threads = settings.bam_threads
+        self.pysam_bamfile = pysam.Samfile(self.stream, threads=threads)
 
-        if r.seq:
-            seq = r.seq
-        else:
-            seq = "*"
+        # Reference names by ID, converted once rather than for every read
+        self._chroms = [
+            i.encode('UTF-8') for i in self.pysam_bamfile.references]
 
-        if r.qual:
-            qual = r.qual
-        else:
-            qual = "*"
-
-        fields = [
-            r.qname,
-            str(r.flag),
-            rname,
-
-            # +1 here because cbedtools.pyx expects SAM -- which is 1-based --
-            # but pysam uses 0-based.
-            str(r.pos + 1),
-            str(r.mapq),
-            cigarstring,
-            rnext,
-            pnext,
-            str(r.tlen),
-            seq,
-            qual,
-        ]
-        if tags:
-            fields.append(tags)
-
-        if None in fields:
-            raise ValueError("Found 'None' in fields: %s" % fields)
-        return create_interval_from_list(fields)
+    def _aligned_segment_to_interval(self, r):
+        return create_interval_from_segment(r, self._chroms)
 
     def __iter__(self):
         return self
@@ -3439,7 +3986,8 @@ class BAM(object):
     # tests work, the new behavior will be to yield pysam AlignedSegment
     # objects directly.
     def __next__(self):
-        return self._aligned_segment_to_interval(next(self.pysam_bamfile))
+        return create_interval_from_segment(next(self.pysam_bamfile),
+                                            self._chroms)
 
     def next(self):
         return self.__next__()
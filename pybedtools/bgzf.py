@@ -0,0 +1,241 @@
+"""
+Multi-threaded BGZF compression, with tabix indexing in the same pass.
+
+BGZF, the format read by tabix, samtools and pysam, is a series of gzip
+blocks holding at most 64 KB each.  :class:`BgzfWriter` compresses blocks in
+a pool of threads -- zlib releases the GIL while it works -- and writes them
+in order.  For BED and GFF data it can also build the tabix (or CSI) index
+from the lines as they are written, so that a sorted stream is compressed
+and indexed without being written or read again; :meth:`BedTool.tabix` uses
+it this way on the output of `bedtools sort`.
+
+>>> import pybedtools
+>>> fn = pybedtools.BedTool._tmp()
+>>> with BgzfWriter(fn, preset='bed') as writer:
+...     writer.write(open(pybedtools.example_filename('a.bed'), 'rb').read())
+>>> x = pybedtools.BedTool(fn).tabix_intervals('chr1:120-130')
+>>> print(x) #doctest: +NORMALIZE_WHITESPACE
+chr1	100	200	feature2	0	+
+<BLANKLINE>
+"""
+import collections
+import multiprocessing
+import struct
+import zlib
+from multiprocessing.pool import ThreadPool
+
+import six
+
+from .cbedtools import TabixIndexer
+
+
+# Uncompressed bytes per block; as for htslib, small enough that a block of
+# incompressible data still fits in 64 KB when stored.
+BLOCK_SIZE = 0xff00
+
+_HEADER = struct.Struct('<4BI2BH2BHH')
+_TRAILER = struct.Struct('<II')
+_MAX_CDATA = 65536 - _HEADER.size - _TRAILER.size
+
+# Empty block marking the end of a BGZF file
+_EOF = (b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+        b'\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+# Tabix (format, col_seq, col_beg, col_end) of the presets that can be
+# indexed while writing.  0x10000 flags zero-based, half-open coordinates.
+_PRESETS = {
+    'bed': (0x10000, 1, 2, 3),
+    'gff': (0, 1, 4, 5),
+}
+
+# Positions beyond this can only be indexed with CSI
+_TBI_MAX_POS = 1 << 29
+
+
+def compress_block(data, level=zlib.Z_DEFAULT_COMPRESSION):
+    """
+    Returns `data`, at most BLOCK_SIZE bytes, as a single BGZF block.
+    """
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = c.compress(data) + c.flush()
+    if len(cdata) > _MAX_CDATA:
+        c = zlib.compressobj(0, zlib.DEFLATED, -15)
+        cdata = c.compress(data) + c.flush()
+    return b''.join([
+        _HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+                     len(cdata) + _HEADER.size + _TRAILER.size - 1),
+        cdata,
+        _TRAILER.pack(zlib.crc32(data) & 0xffffffff, len(data))])
+
+
+class BgzfWriter(object):
+    """
+    Writes the BGZF file `fn`.
+
+    Constructor::
+
+        BgzfWriter(fn, threads=None, level=-1, preset=None, csi=False)
+
+    Blocks are compressed by `threads` threads (by default, one per CPU) at
+    zlib compression `level`.  With `preset` "bed" or "gff" the data must be
+    sorted by chromosome and start, as for tabix, and when the writer is
+    closed a tabix index is saved as `fn` + ".tbi" -- or, if `csi` is True,
+    a CSI index as `fn` + ".csi", which is needed for chromosomes longer than
+    2**29 bp.
+    """
+    def __init__(self, fn, threads=None, level=zlib.Z_DEFAULT_COMPRESSION,
+                 preset=None, csi=False):
+        if preset is not None and preset not in _PRESETS:
+            raise ValueError(
+                'Only "bed" and "gff" files can be indexed while '
+                'compressing, not %r' % preset)
+        self.fn = fn
+        self.level = level
+        self.preset = preset
+        self.csi = csi
+        self.threads = threads or multiprocessing.cpu_count()
+        if self.threads > 1:
+            self._pool = ThreadPool(self.threads)
+        else:
+            self._pool = None
+        self._pending = collections.deque()
+        self._fh = open(fn, 'wb')
+        self._buffer = b''
+
+        # Compressed offset of each block written, then of the EOF block
+        self._coffsets = []
+        self._caddr = 0
+
+        self._indexer = None
+        if preset is not None:
+            fmt, col_seq, col_beg, col_end = _PRESETS[preset]
+            self._indexer = TabixIndexer(col_seq, col_beg, col_end,
+                                         zero_based=bool(fmt & 0x10000))
+        # Incomplete last line, not yet indexed, and where it starts
+        self._tail = b''
+        self._tail_offset = 0
+
+    def write(self, data):
+        """
+        Writes the bytes (or text, encoded as UTF-8) `data`.
+        """
+        if isinstance(data, six.text_type):
+            data = data.encode('UTF-8')
+        if self._indexer is not None:
+            nl = data.rfind(b'\n')
+            if nl == -1:
+                self._tail += data
+            else:
+                lines = self._tail + data[:nl + 1]
+                self._indexer.add(lines, self._tail_offset)
+                self._tail_offset += len(lines)
+                self._tail = data[nl + 1:]
+
+        data = self._buffer + data
+        n = len(data) - len(data) % BLOCK_SIZE
+        view = memoryview(data)
+        for i in range(0, n, BLOCK_SIZE):
+            self._submit(view[i:i + BLOCK_SIZE].tobytes())
+        self._buffer = data[n:]
+
+    def _submit(self, block):
+        if self._pool is None:
+            self._store(compress_block(block, self.level))
+            return
+        self._pending.append(
+            self._pool.apply_async(compress_block, (block, self.level)))
+        # Don't get further ahead of the disk than the threads need
+        if len(self._pending) >= 4 * self.threads:
+            self._store(self._pending.popleft().get())
+
+    def _store(self, block):
+        self._coffsets.append(self._caddr)
+        self._fh.write(block)
+        self._caddr += len(block)
+
+    def close(self):
+        """
+        Writes the remaining data and the EOF marker, then the index if
+        requested.
+        """
+        if self._fh is None:
+            return
+        try:
+            if self._buffer:
+                self._submit(self._buffer)
+                self._buffer = b''
+            while self._pending:
+                self._store(self._pending.popleft().get())
+            self._coffsets.append(self._caddr)
+            self._fh.write(_EOF)
+        finally:
+            self._shutdown()
+        if self._indexer is not None:
+            if self._tail:
+                self._indexer.add(self._tail, self._tail_offset)
+            self._write_index()
+
+    def _shutdown(self):
+        self._fh.close()
+        self._fh = None
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._fh is not None:
+            self._shutdown()
+
+    def _write_index(self):
+        max_end = self._indexer.max_end
+        if self.csi:
+            # As many levels as needed to hold the longest chromosome
+            depth = 0
+            size = 1 << 14
+            while max_end + 256 > size:
+                depth += 1
+                size <<= 3
+        else:
+            if max_end > _TBI_MAX_POS:
+                raise ValueError(
+                    'Features end beyond position 2**29, which a tabix index '
+                    'cannot hold; use csi=True')
+            depth = 5
+
+        fmt, col_seq, col_beg, col_end = _PRESETS[self.preset]
+        refs = self._indexer.names
+        names = b''.join(name + b'\0' for name in refs)
+        conf = struct.pack('<7i', fmt, col_seq, col_beg, col_end, ord('#'),
+                           0, len(names)) + names
+        if self.csi:
+            header = [b'CSI\1', struct.pack('<3i', 14, depth, len(conf)),
+                      conf, struct.pack('<i', len(refs))]
+            index_fn = self.fn + '.csi'
+        else:
+            header = [b'TBI\1', struct.pack('<i', len(refs)), conf]
+            index_fn = self.fn + '.tbi'
+
+        with BgzfWriter(index_fn, threads=1) as writer:
+            writer.write(b''.join(header))
+            writer.write(self._indexer.index(
+                self._coffsets, BLOCK_SIZE, depth, self.csi))
+
+
+def compress(chunks, fn, threads=None, level=zlib.Z_DEFAULT_COMPRESSION,
+             preset=None, csi=False):
+    """
+    Writes the chunks of bytes (or text) from the iterable `chunks` to the
+    BGZF file `fn`, and indexes it if `preset` is given; see
+    :class:`BgzfWriter`.  Returns `fn`.
+    """
+    with BgzfWriter(fn, threads=threads, level=level, preset=preset,
+                    csi=csi) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    return fn
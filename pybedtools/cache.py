@@ -0,0 +1,181 @@
+"""
+On-disk cache of BEDTools results.
+
+When `pybedtools.settings.result_cache` is set to a directory, the output of
+each BEDTools call made by a BedTool method is saved there, keyed by the
+command line and the inputs it reads.  Calling the same method with the same
+arguments on unchanged inputs -- say, when re-running a notebook -- then
+copies the saved output instead of running BEDTools again.
+
+Input files are identified by a hash of their contents, or with
+`pybedtools.settings.result_cache_key = "mtime"`, by their paths,
+modification times and sizes.  Calls that read from a stream, or that write
+more than one output file, are not cached, and neither are calls to the
+programs that draw random numbers (shuffle, random, sample) unless a `seed`
+is given.  Once the cached files take up
+more than `pybedtools.settings.result_cache_size` bytes, the least recently
+used are removed.
+
+>>> import pybedtools
+>>> pybedtools.settings.result_cache = pybedtools.get_tempdir() + '/cache'
+>>> a = pybedtools.example_bedtool('a.bed')
+>>> b = pybedtools.example_bedtool('b.bed')
+>>> c = a.intersect(b)
+>>> c = a.intersect(b)
+>>> info = pybedtools.cache.info()
+>>> info['hits'], info['misses']
+(1, 1)
+>>> pybedtools.cache.clear()
+>>> pybedtools.settings.result_cache = None
+"""
+from __future__ import print_function
+import hashlib
+import os
+import shutil
+import tempfile
+
+from . import settings
+
+
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+# Content hashes of input files, keyed by (path, mtime, size)
+_digests = {}
+
+# Programs whose output differs from call to call unless seeded, under both
+# their old and their `bedtools <subcommand>` names
+_random_programs = set(['shuffleBed', 'shuffle', 'randomBed', 'random',
+                        'sample'])
+
+
+def _digest(fn):
+    st = os.stat(fn)
+    if settings.result_cache_key == 'mtime':
+        return '%s:%s:%s' % (os.path.abspath(fn), st.st_mtime, st.st_size)
+    signature = (os.path.abspath(fn), st.st_mtime, st.st_size)
+    try:
+        return _digests[signature]
+    except KeyError:
+        pass
+    h = hashlib.sha1()
+    with open(fn, 'rb') as fin:
+        for block in iter(lambda: fin.read(1 << 20), b''):
+            h.update(block)
+    digest = _digests[signature] = h.hexdigest()
+    return digest
+
+
+def key(cmds):
+    """
+    Returns the cache key for the BEDTools command line `cmds`, with each
+    argument that names a file replaced by its digest, or None if the result
+    should not be cached.
+    """
+    progs = [os.path.basename(str(arg)) for arg in cmds[:2]]
+    if _random_programs.intersection(progs) and '-seed' not in cmds:
+        return None
+    if settings.result_cache_key not in ('content', 'mtime'):
+        raise ValueError(
+            'result_cache_key must be "content" or "mtime", not %r'
+            % settings.result_cache_key)
+    h = hashlib.sha1()
+    h.update(str(settings._bedtools_path).encode())
+    for arg in cmds:
+        arg = str(arg)
+        if os.path.isfile(arg):
+            arg = _digest(arg)
+        h.update(arg.encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _entries():
+    """
+    (path, size, last use) of each cached result.
+    """
+    d = settings.result_cache
+    entries = []
+    if not os.path.isdir(d):
+        return entries
+    for name in os.listdir(d):
+        if name.startswith('.'):
+            continue
+        fn = os.path.join(d, name)
+        try:
+            st = os.stat(fn)
+        except OSError:
+            continue
+        entries.append((fn, st.st_size, st.st_mtime))
+    return entries
+
+
+def fetch(key, fn):
+    """
+    Copies the cached result for `key` to `fn` and returns True, or returns
+    False if there is none.
+    """
+    cached = os.path.join(settings.result_cache, key)
+    try:
+        shutil.copyfile(cached, fn)
+    except (IOError, OSError):
+        _stats['misses'] += 1
+        return False
+    # the modification time records when an entry was last used
+    os.utime(cached, None)
+    _stats['hits'] += 1
+    return True
+
+
+def store(key, fn):
+    """
+    Saves the file `fn` as the result for `key`, then removes the least
+    recently used results if the cache has grown too large.
+    """
+    d = settings.result_cache
+    if os.path.getsize(fn) > settings.result_cache_size:
+        return
+    if not os.path.isdir(d):
+        os.makedirs(d)
+
+    # copy then rename, so other processes never see a partial file
+    fd, tmp = tempfile.mkstemp(prefix='.', dir=d)
+    os.close(fd)
+    shutil.copyfile(fn, tmp)
+    os.rename(tmp, os.path.join(d, key))
+    _evict(settings.result_cache_size)
+
+
+def _evict(limit):
+    entries = sorted(_entries(), key=lambda e: e[2])
+    total = sum(e[1] for e in entries)
+    for fn, size, _ in entries:
+        if total <= limit:
+            break
+        try:
+            os.unlink(fn)
+        except OSError:
+            continue
+        total -= size
+        _stats['evictions'] += 1
+
+
+def info():
+    """
+    Returns a dict of the numbers of cache hits, misses and evictions in this
+    session, and the number of entries and total size in bytes of the cache.
+    """
+    result = dict(_stats)
+    entries = _entries() if settings.result_cache else []
+    result['entries'] = len(entries)
+    result['size'] = sum(e[1] for e in entries)
+    return result
+
+
+def clear():
+    """
+    Removes all cached results and resets the counters.
+    """
+    if settings.result_cache:
+        _evict(-1)
+    for k in _stats:
+        _stats[k] = 0
@@ -1,6 +1,7 @@
 from cpython cimport bool
 from libcpp.vector cimport vector
 from libcpp.string cimport string
+from libcpp.map cimport map as cppmap
 from cython.operator cimport dereference as deref
 
 
@@ -20,6 +21,7 @@ cdef extern from "bedFile.h":
         BED_VALID = 2
 
     ctypedef unsigned int   CHRPOS
+    ctypedef unsigned int   BIN
     ctypedef bint BOOL
 
     cdef cppclass BED:
@@ -52,11 +54,22 @@ cdef extern from "bedFile.h":
         string reportBed()
 
 
+    ctypedef vector[BED] bedVector
+    ctypedef cppmap[BIN, bedVector] binsToBeds
+    ctypedef cppmap[string, binsToBeds] masterBedMap
+
+    BIN getBin(CHRPOS start, CHRPOS end)
+    const BIN _binOffsetsExtended[]
+    const unsigned short _binLevels
+    const unsigned short _binFirstShift
+    const unsigned short _binNextShift
+
     cdef cppclass BedFile:
         BedFile(string)
         int Open()
         void Rewind()
         void Seek(unsigned long offset)
+        unsigned long Tell()
         void Close()
         BED  GetNextBed()
         void loadBedFileIntoMap()
@@ -78,11 +91,24 @@ cdef extern from "bedFile.h":
         # if forceStrand is true, require that the strands match,
         int CountOverlapsPerBin(BED bed, bool forceStrand, float overlapFraction)
         string file_type
+        masterBedMap bedMap
         bint _typeIsKnown
 
 
 cdef class Interval:
     cdef BED *_bed
     cdef object _attrs
+    cdef long _attrs_version
+    cdef object _segment
+    cdef bytes _line
+    cdef list _fields
+    cdef _unpack(Interval self)
+    cdef _modify(Interval self)
+    cdef Py_ssize_t _nfields(Interval self)
+    cdef const char *_field_ptr(Interval self, Py_ssize_t i, Py_ssize_t *size)
+    cdef object _field(Interval self, Py_ssize_t i)
+    cdef object _attr(Interval self, object key)
+    cdef object _attr_or_none(Interval self, object key)
+    cdef list _field_list(Interval self)
     cpdef append(Interval self, object value)
     cpdef deparse_attrs(Interval self)
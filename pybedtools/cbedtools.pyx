@@ -15,6 +15,8 @@
 
 from cpython.version cimport PY_MAJOR_VERSION
 from libcpp.string cimport string
+from libc.string cimport memchr, memcmp
+from cpython.dict cimport PyDict_SetItem
 
 # Python byte strings automatically coerce to/from C++ strings.
 
@@ -48,11 +50,23 @@ else:
              [2]
     Email:  aaronquinlan at gmail dot com
 """
-from cython.operator cimport dereference as deref
+from cython.operator cimport dereference as deref, preincrement as inc
+from libcpp.pair cimport pair
+from libcpp.algorithm cimport sort as cpp_sort
+cimport cython
+import os
 import sys
 import six
+import mmap
+import array
+import struct
 import subprocess
 from collections import defaultdict
+try:
+    from pickle import PickleBuffer
+except ImportError:
+    # Python < 3.8
+    PickleBuffer = None
 
 cdef dict LOOKUPS = {
     "gff":  {"chrom": 0, "start": 3, "end": 4, "stop": 4, "strand": 6},
@@ -141,15 +155,89 @@ class BedToolsFileError(Exception):
     pass
 
 
+# Returned by _scan_attrs() for attributes it can't parse exactly as
+# Attributes.__init__ would
+_UNPARSED = object()
+
+
+cdef inline bint _isspace(unsigned char c):
+    # The ASCII characters removed by str.strip()
+    return c == c' ' or c'\t' <= c <= c'\r' or 0x1c <= c <= 0x1f
+
+
+cdef object _scan_attrs(const char *s, Py_ssize_t n, const char *key,
+                        Py_ssize_t keylen, object attrs, dict quoted):
+    # Scans the GFF/GTF attributes `s`, of length `n`, as Attributes.__init__
+    # does.  If `attrs` is None, returns the value of `key` (the last, if it
+    # is repeated) or None if it is missing; otherwise stores all of them in
+    # the dict `attrs`, marking quoted values in `quoted`.  Returns _UNPARSED
+    # if a pair has no separator or starts or ends with a non-ASCII
+    # character, which might be whitespace.
+    cdef Py_ssize_t i, start, end, a, b, n_semi = 0, n_eq = 0
+    cdef const char *sep
+    cdef char field_sep
+    found = None
+
+    for i in range(n):
+        if s[i] == c';':
+            n_semi += 1
+        elif s[i] == c'=':
+            n_eq += 1
+    field_sep = c'=' if n_eq > n_semi - 1 else c' '
+
+    start = 0
+    while start < n:
+        end = start
+        while end < n and s[end] != c';':
+            end += 1
+        a = start
+        b = end
+        start = end + 1
+        while a < b and _isspace(s[a]):
+            a += 1
+        while b > a and _isspace(s[b - 1]):
+            b -= 1
+        if a == b:
+            continue
+        if <unsigned char>s[a] >= 0x80 or <unsigned char>s[b - 1] >= 0x80:
+            return _UNPARSED
+        sep = <const char *>memchr(s + a, field_sep, b - a)
+        if sep == NULL:
+            return _UNPARSED
+        i = sep - s
+        if attrs is None:
+            if i - a != keylen or memcmp(s + a, key, keylen) != 0:
+                continue
+        value = s[i + 1:b].decode('UTF-8', 'strict')
+        if attrs is None:
+            found = value.replace('"', '')
+            continue
+        field = s[a:i].decode('UTF-8', 'strict')
+        if value.count('"') == 2:
+            quoted[field] = True
+        PyDict_SetItem(attrs, field, value.replace('"', ''))
+    return found
+
+
 class Attributes(dict):
     """
     Class to map between a dict of attrs and fields[8] of a GFF Interval obj.
+
+    Changes are counted in `_version`, so that an Interval only rewrites its
+    attributes field when they were changed.
     """
+    # Class defaults, as unpickling sets items before the instance __dict__
+    _version = 0
+    _sort_keys = False
+    _sep = ';'
+    _field_sep = '='
 
     def __init__(self, attr_str=""):
+        cdef string data
         attr_str = str(attr_str)
         self._attr_str = attr_str
-        self.sort_keys = False
+        self._sort_keys = False
+        self._version = 0
 
         # in general, GFF files will have either as many '=' as ';'
         # (or ';'-1 if there's no trailing ';')
@@ -158,9 +246,9 @@ class Attributes(dict):
         n_quotes = attr_str.count('"')
 
         if n_eq > n_semi - 1:
-            self.sep, self.field_sep = (';', '=')
+            self._sep, self._field_sep = (';', '=')
         else:
-            self.sep, self.field_sep = (';', ' ')
+            self._sep, self._field_sep = (';', ' ')
 
         self._quoted = {}
 
@@ -176,11 +264,77 @@ class Attributes(dict):
         if attr_str == "":
             return
 
+        data = _cppstr(attr_str)
+        if _scan_attrs(data.c_str(), data.size(), NULL, 0, self,
+                       self._quoted) is not _UNPARSED:
+            return
+        dict.clear(self)
+        self._quoted.clear()
+
         kvs = map(str.strip, attr_str.strip().split(self.sep))
         for field, value in [kv.split(self.field_sep, 1) for kv in kvs if kv]:
             if value.count('"') == 2:
                 self._quoted[field] = True
-            self[field] = value.replace('"', '')
+            dict.__setitem__(self, field, value.replace('"', ''))
+
+    @property
+    def sort_keys(self):
+        return self._sort_keys
+
+    @sort_keys.setter
+    def sort_keys(self, value):
+        self._sort_keys = value
+        self._version += 1
+
+    @property
+    def sep(self):
+        return self._sep
+
+    @sep.setter
+    def sep(self, value):
+        self._sep = value
+        self._version += 1
+
+    @property
+    def field_sep(self):
+        return self._field_sep
+
+    @field_sep.setter
+    def field_sep(self, value):
+        self._field_sep = value
+        self._version += 1
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._version += 1
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._version += 1
+
+    def clear(self):
+        dict.clear(self)
+        self._version += 1
+
+    def pop(self, *args):
+        self._version += 1
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._version += 1
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        self._version += 1
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._version += 1
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
 
     def __str__(self):
         # stringify all items first
@@ -262,7 +416,8 @@ cdef class Interval:
         return create_interval_from_list(self.fields)
 
     def __hash__(self):
-        return hash("\t".join(self.fields))
+        self.deparse_attrs()
+        return hash("\t".join(self._field_list()))
 
     property chrom:
         """ the chromosome of the feature"""
@@ -270,6 +425,7 @@ cdef class Interval:
             return _pystr(self._bed.chrom)
 
         def __set__(self, chrom):
+            self._modify()
             chrom = _cppstr(chrom)
             self._bed.chrom = chrom
             idx = LOOKUPS[self.file_type]["chrom"]
@@ -318,6 +474,7 @@ cdef class Interval:
             return self._bed.start
 
         def __set__(self, int start):
+            self._modify()
             self._bed.start = start
             idx = LOOKUPS[self.file_type]["start"]
 
@@ -332,6 +489,7 @@ cdef class Interval:
             return self._bed.end
 
         def __set__(self, int end):
+            self._modify()
             self._bed.end = end
             idx = LOOKUPS[self.file_type]["stop"]
             self._bed.fields[idx] = _cppstr(str(end))
@@ -342,6 +500,7 @@ cdef class Interval:
             return self._bed.end
 
         def __set__(self, int end):
+            self._modify()
             idx = LOOKUPS[self.file_type]["stop"]
             self._bed.fields[idx] = _cppstr(str(end))
             self._bed.end = end
@@ -352,6 +511,7 @@ cdef class Interval:
             return _pystr(self._bed.strand)
 
         def __set__(self, strand):
+            self._modify()
             idx = LOOKUPS[self.file_type]["strand"]
             self._bed.fields[idx] = _cppstr(strand)
             self._bed.strand = _cppstr(strand)
@@ -361,6 +521,102 @@ cdef class Interval:
         def __get__(self):
             return self._bed.end - self._bed.start
 
+    # The fields are kept in one of three ways.  An Interval made by
+    # create_interval_from_segment() holds the pysam read in `_segment`, and
+    # one parsed from a line by BufferedIntervalIterator holds the line in
+    # `_line`, with `_bed.fields` left empty; fields are decoded from them
+    # when asked for.  Otherwise, and as soon as a field is changed,
+    # `_bed.fields` holds them.  Either way, `_fields` caches the decoded
+    # list until a field is changed.
+
+    cdef _unpack(self):
+        # Formats the SAM line of a pysam read
+        if self._segment is not None:
+            self._line = self._segment.to_string().encode('UTF-8')
+            self._segment = None
+
+    cdef _modify(self):
+        # Called before changing a field
+        self._unpack()
+        if self._line is not None:
+            self._bed.fields = self._line.split(b'\t')
+            self._line = None
+        self._fields = None
+
+    cdef Py_ssize_t _nfields(self):
+        self._unpack()
+        if self._fields is not None:
+            return len(self._fields)
+        if self._line is not None:
+            return self._line.count(b'\t') + 1
+        return self._bed.fields.size()
+
+    cdef const char *_field_ptr(self, Py_ssize_t i, Py_ssize_t *size):
+        # Points to the undecoded field `i` (which must be in range and
+        # non-negative), setting `size` to its length.  The pointer is only
+        # valid until a field is changed.
+        cdef const char *line
+        cdef const char *tab
+        cdef Py_ssize_t pos = 0, n
+        self._unpack()
+        if self._line is None:
+            size[0] = self._bed.fields.at(i).size()
+            return self._bed.fields.at(i).c_str()
+        line = self._line
+        n = len(self._line)
+        while i > 0:
+            tab = <const char *>memchr(line + pos, c'\t', n - pos)
+            pos = tab - line + 1
+            i -= 1
+        tab = <const char *>memchr(line + pos, c'\t', n - pos)
+        if tab != NULL:
+            n = tab - line
+        size[0] = n - pos
+        return line + pos
+
+    cdef object _field(self, Py_ssize_t i):
+        # The decoded field `i` (which must be in range and non-negative),
+        # without decoding the others
+        cdef const char *field
+        cdef Py_ssize_t n
+        if self._fields is not None:
+            return self._fields[i]
+        field = self._field_ptr(i, &n)
+        return field[:n].decode('UTF-8', 'strict')
+
+    cdef object _attr(self, key):
+        # self.attrs[key], but for a GFF Interval whose attributes haven't
+        # been parsed, finds `key` without parsing the others
+        value = self._attr_or_none(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    cdef object _attr_or_none(self, key):
+        cdef const char *field
+        cdef Py_ssize_t n
+        cdef string k
+        if self._attrs is not None \
+                or self._bed.file_type != <string>"gff" \
+                or self._nfields() < 9:
+            return self.attrs.get(key)
+        field = self._field_ptr(8, &n)
+        k = _cppstr(key)
+        value = _scan_attrs(field, n, k.c_str(), k.size(), None, None)
+        if value is _UNPARSED:
+            return self.attrs.get(key)
+        return value
+
+    cdef list _field_list(self):
+        # The cached list of decoded fields; callers mustn't change it
+        self._unpack()
+        if self._fields is None:
+            if self._line is not None:
+                self._fields = self._line.decode('UTF-8', 'strict').split('\t')
+            else:
+                self._fields = [_pystr(i) for i in self._bed.fields]
+        return self._fields
+
     cpdef deparse_attrs(self):
 
         if self._attrs is None: return
@@ -368,37 +624,40 @@ cdef class Interval:
         if self.file_type != "gff":
             raise ValueError('Interval.attrs was not None, but this was a non-GFF Interval')
 
+        # Attributes count their changes; anything else is always written
+        version = getattr(self._attrs, '_version', None)
+        if version is not None and version == self._attrs_version:
+            return
+
         s = self._attrs.__str__()
-        self._bed.fields[8] = _cppstr(s)
+        if self._field(8) != s:
+            self._modify()
+            self._bed.fields[8] = _cppstr(s)
+        self._attrs_version = -1 if version is None else version
 
     property fields:
         def __get__(self):
             self.deparse_attrs()
-            items = []
-            for i in self._bed.fields:
-                if isinstance(i, int):
-                    items.append(i)
-                else:
-                    items.append(_pystr(i))
-            return items
+            return list(self._field_list())
 
     property attrs:
         def __get__(self):
             if self._attrs is None:
                 ft = _pystr(self._bed.file_type)
                 if ft == 'gff':
-                    self._attrs = Attributes(_pystr(self._bed.fields[8]))
+                    self._attrs = Attributes(self._field(8))
                 else:
                     self._attrs = Attributes("")
             return self._attrs
 
         def __set__(self, attrs):
             self._attrs = attrs
+            self._attrs_version = -1
 
     # TODO: make this more robust.
     @property
     def count(self):
-        return int(self.fields[-1])
+        return int(self[-1])
 
     property name:
         """
@@ -419,16 +678,16 @@ cdef class Interval:
                 """
                 for key in ("ID", "Name", "gene_name", "transcript_id", \
                             "gene_id", "Parent"):
-                    if key in self.attrs:
-                        value = self.attrs[key]
+                    value = self._attr_or_none(key)
+                    if value is not None:
                         break
 
             elif ftype == <string>"vcf":
-                s = self.fields[2]
+                s = self[2]
                 if s in ("", "."):
                     value = "%s:%i" % (self.chrom, self.start)
                 else:
-                    value = _pystr(s)
+                    value = s
             elif ftype == <string>"bed":
                 value = _pystr(self._bed.name)
 
@@ -436,6 +695,7 @@ cdef class Interval:
 
         def __set__(self, value):
             cdef string ftype = self._bed.file_type
+            self._modify()
 
             if ftype == <string>"gff":
                 for key in ("ID", "Name", "gene_name", "transcript_id", \
@@ -461,6 +721,7 @@ cdef class Interval:
             return _pystr(self._bed.score)
 
         def __set__(self, value):
+            self._modify()
             value = _cppstr(value)
             self._bed.score = value
             idx = LOOKUPS[self.file_type]["score"]
@@ -492,13 +753,12 @@ cdef class Interval:
         Interval objects always print with a newline to mimic a line in a
         BED/GFF/VCF file
         """
-        items = []
-        for i in self.fields:
-            if isinstance(i, int):
-                i = str(i)
-            items.append(i)
-
-        return '\t'.join(items) + '\n'
+        self.deparse_attrs()
+        self._unpack()
+        if self._line is not None:
+            # Unchanged since it was read
+            return self._line.decode('UTF-8', 'strict') + '\n'
+        return '\t'.join(self._field_list()) + '\n'
 
     def __repr__(self):
         return "Interval(%s:%i-%i)" % (self.chrom, self.start, self.end)
@@ -516,20 +776,21 @@ cdef class Interval:
         self.deparse_attrs()
 
         if isinstance(key, (int, long)):
-            nfields = self._bed.fields.size()
+            nfields = self._nfields()
             if key >= nfields:
                 raise IndexError('field index out of range')
             elif key < 0:
                 key = nfields + key
-            return _pystr(self._bed.fields.at(key))
+                if key < 0:
+                    raise IndexError('field index out of range')
+            return self._field(key)
         elif isinstance(key, slice):
-            indices = key.indices(self._bed.fields.size())
-            return [_pystr(self._bed.fields.at(i)) for i in range(*indices)]
+            return self._field_list()[key]
 
         elif isinstance(key, str):
             if ftype == "gff":
                 try:
-                    return self.attrs[key]
+                    return self._attr(key)
                 except KeyError:
                     pass
             # We don't have to convert using _pystr() because the __get__
@@ -537,6 +798,7 @@ cdef class Interval:
             return getattr(self, key)
 
     def __setitem__(self, object key, object value):
+        self._modify()
         if isinstance(key, (int, long)):
             nfields = self._bed.fields.size()
             if key >= nfields:
@@ -553,6 +815,7 @@ cdef class Interval:
             setattr(self, key, value)
 
     cpdef append(self, object value):
+        self._modify()
         self._bed.fields.push_back(_cppstr(value))
 
     def __nonzero__(self):
@@ -616,9 +879,9 @@ cpdef Interval create_interval_from_list(list fields):
         and isdigit(fields[3])
         and (fields[5] not in ['.', '+', '-'])
     ):
-        # TODO: what should the stop position be?  Here, it's just the start
-        # plus the length of the sequence, but perhaps this should eventually
-        # do CIGAR string parsing.
+        # The stop position is the end of the alignment on the reference,
+        # from the CIGAR string; without one, the start plus the length of
+        # the sequence.
         if int(fields[1]) & 0x04:
             # handle unmapped reads
             chrom = _cppstr("*")
@@ -627,7 +890,10 @@ cpdef Interval create_interval_from_list(list fields):
         else:
             chrom = _cppstr(fields[2])
             start = int(fields[3]) - 1
-            stop = int(fields[3]) + len(fields[9]) - 1
+            ref_length = _cigar_reference_length(_cppstr(fields[5]))
+            if ref_length < 0:
+                ref_length = len(fields[9])
+            stop = start + ref_length
         name = _cppstr(fields[0])
         score = _cppstr(fields[1])
         if int(fields[1]) & 0x10:
@@ -642,9 +908,9 @@ cpdef Interval create_interval_from_list(list fields):
             chrom,
             start,
             stop,
-            strand,
             name,
             score,
+            strand,
             list_to_vector(fields))
         pyb.file_type = _cppstr('sam')
 
@@ -698,6 +964,85 @@ cpdef Interval create_interval_from_list(list fields):
     pyb._bed.fields = list_to_vector(orig_fields)
     return pyb
 
+cdef long _cigar_reference_length(string cigar):
+    """
+    Number of reference bases covered by the CIGAR string `cigar`, or -1 if
+    it is "*".
+    """
+    cdef long n = 0, length = 0
+    cdef size_t i
+    cdef char c
+    if cigar.size() == 0 or cigar[0] == c'*':
+        return -1
+    for i in range(cigar.size()):
+        c = cigar[i]
+        if c'0' <= c <= c'9':
+            n = n * 10 + (c - c'0')
+            continue
+        if c == c'M' or c == c'D' or c == c'N' or c == c'=' or c == c'X':
+            length += n
+        n = 0
+    return length
+
+
+cpdef Interval create_interval_from_segment(object segment, list chroms=None):
+    """
+    Create a SAM Interval from a pysam AlignedSegment.
+
+    Constructor::
+
+        create_interval_from_segment(segment, chroms=None)
+
+    The chrom, start, end, name, score (the flag) and strand are taken
+    directly from the read, with the end of the alignment worked out from its
+    CIGAR.  The SAM fields are only formatted (by pysam) when they are first
+    needed, e.g. by `Interval.fields` or `str()`.
+
+    `chroms`, if given, is the list of reference names of the read's file as
+    bytes, indexed by reference ID, so that they needn't be looked up for
+    every read.
+
+        >>> import pysam, pybedtools
+        >>> bam = pysam.AlignmentFile(pybedtools.example_filename('gdc.bam'))
+        >>> feature = create_interval_from_segment(next(bam))
+        >>> feature
+        Interval(chr2L:10-15)
+        >>> feature[:6]
+        ['None', '0', 'chr2L', '11', '255', '5M']
+
+    """
+    cdef Interval pyb = Interval.__new__(Interval)
+    cdef int flag = segment.flag
+    cdef long start, stop
+    if flag & 0x04:
+        # unmapped reads, as for SAM lines
+        chrom = b'*'
+        start = 0
+        stop = 0
+    else:
+        if chroms is None:
+            chrom = _cppstr(segment.reference_name)
+        else:
+            chrom = chroms[segment.reference_id]
+        start = segment.reference_start
+        end = segment.reference_end
+        if end is None:
+            stop = start + segment.query_length
+        else:
+            stop = end
+    if flag & 0x10:
+        strand = b'-'
+    else:
+        strand = b'+'
+    pyb._bed = new BED(chrom, start, stop, strand)
+    name = segment.query_name
+    pyb._bed.name = _cppstr(name if name is not None else '*')
+    pyb._bed.score = _cppstr(str(flag))
+    pyb._bed.file_type = b'sam'
+    pyb._segment = segment
+    return pyb
+
+
 cdef vector[string] list_to_vector(list li):
     cdef vector[string] s
     cdef int i
@@ -787,27 +1132,1113 @@ cdef class IntervalIterator:
         return create_interval_from_list(fields)
 
 
+# Used by the C-level line parser below. Lines are classified with the same
+# rules, in the same order, as create_interval_from_list().
+cdef enum:
+    _LINE_BED = 1
+    _LINE_VCF = 2
+    _LINE_GFF = 3
+    _LINE_OTHER = 4
+
+# Largest value that fits in a CHRPOS
+cdef unsigned long long _MAX_CHRPOS = 4294967295
+
+
+cdef inline bint _is_digits(const char *s, size_t n):
+    cdef size_t i
+    if n == 0:
+        return False
+    for i in range(n):
+        if s[i] < c'0' or s[i] > c'9':
+            return False
+    return True
+
+
+cdef inline bint _to_chrpos(const char *s, size_t n, unsigned long long *out):
+    # Assumes _is_digits() is true; returns False if the value doesn't fit.
+    cdef size_t i
+    cdef unsigned long long v = 0
+    if n > 10:
+        return False
+    for i in range(n):
+        v = v * 10 + <unsigned long long>(s[i] - c'0')
+    if v > _MAX_CHRPOS:
+        return False
+    out[0] = v
+    return True
+
+
+cdef inline bint _is_skipped_line(const char *s, size_t n):
+    # Same header/blank lines that IntervalIterator skips
+    cdef size_t i
+    if n > 0 and (s[0] == c'@' or s[0] == c'#'):
+        return True
+    if n >= 5 and memcmp(s, b"track", 5) == 0:
+        return True
+    if n >= 7 and memcmp(s, b"browser", 7) == 0:
+        return True
+    for i in range(n):
+        if s[i] not in b' \t\r\n\x0b\x0c':
+            return False
+    return True
+
+
+cdef Interval _interval_from_line(const char *line, size_t n):
+    """
+    C-level equivalent of create_interval_from_list(line.split('\t')) for
+    BED, VCF and GFF lines.
+
+    Returns None for SAM lines and for anything create_interval_from_list()
+    would reject or handle specially, so the caller can fall back to it and
+    get identical results (or errors).
+    """
+    cdef vector[size_t] starts, lens
+    cdef size_t pos = 0, nf, i
+    cdef const char *tab
+    cdef unsigned long long start, end
+    cdef int kind
+    cdef vector[string] other
+    cdef string dot = b"."
+    cdef Interval pyb
+
+    while True:
+        tab = <const char *>memchr(line + pos, c'\t', n - pos)
+        starts.push_back(pos)
+        if tab == NULL:
+            lens.push_back(n - pos)
+            break
+        lens.push_back(tab - (line + pos))
+        pos = tab - line + 1
+    nf = starts.size()
+
+    # Fewer fields than create_interval_from_list() indexes into; let it
+    # raise the error.
+    if nf < 3:
+        return None
+
+    if (nf >= 11
+            and _is_digits(line + starts[1], lens[1])
+            and _is_digits(line + starts[3], lens[3])
+            and not (lens[5] == 1 and line[starts[5]] in b'.+-')):
+        # SAM
+        return None
+    elif (_is_digits(line + starts[1], lens[1])
+            and _is_digits(line + starts[2], lens[2])):
+        kind = _LINE_BED
+        if not (_to_chrpos(line + starts[1], lens[1], &start)
+                and _to_chrpos(line + starts[2], lens[2], &end)):
+            return None
+    elif nf < 4:
+        return None
+    elif (_is_digits(line + starts[1], lens[1])
+            and not _is_digits(line + starts[3], lens[3]) and nf >= 8):
+        kind = _LINE_VCF
+        if not _to_chrpos(line + starts[1], lens[1], &start):
+            return None
+        end = start + 1
+        if end > _MAX_CHRPOS:
+            return None
+    elif (nf >= 9
+            and _is_digits(line + starts[3], lens[3])
+            and _is_digits(line + starts[4], lens[4])):
+        kind = _LINE_GFF
+        if not (_to_chrpos(line + starts[3], lens[3], &start)
+                and _to_chrpos(line + starts[4], lens[4], &end)):
+            return None
+        if start == 0:
+            return None
+        start -= 1
+    else:
+        return None
+
+    if start > end:
+        return None
+
+    # Only the fields held in the BED struct are copied; the others are
+    # decoded from the line when needed (see Interval._field()).
+    pyb = Interval.__new__(Interval)
+    if kind == _LINE_BED:
+        pyb._bed = new BED(
+            string(line, lens[0]), start, end,
+            string(line + starts[3], lens[3]) if nf > 3 else dot,
+            string(line + starts[4], lens[4]) if nf > 4 else dot,
+            string(line + starts[5], lens[5]) if nf > 5 else dot,
+            other)
+        pyb._bed.file_type = b"bed"
+    elif kind == _LINE_VCF:
+        pyb._bed = new BED(
+            string(line, lens[0]), start, end,
+            string(line + starts[2], lens[2]),
+            string(line + starts[5], lens[5]), dot, other)
+        pyb._bed.file_type = b"vcf"
+    else:
+        pyb._bed = new BED(
+            string(line, lens[0]), start, end,
+            string(line + starts[2], lens[2]),
+            string(line + starts[5], lens[5]),
+            string(line + starts[6], lens[6]), other)
+        pyb._bed.file_type = b"gff"
+    pyb._line = line[:n]
+    return pyb
+
+
+cdef class BufferedIntervalIterator:
+    """
+    Iterates over the Intervals in a file-like object, which should be opened
+    in binary mode.
+
+    Constructor::
+
+        BufferedIntervalIterator(stream, blocksize=1048576)
+
+    Compared to IntervalIterator, the stream is read in blocks of
+    `blocksize` bytes and lines are split into fields in C, avoiding the
+    per-line Python string handling.  BED, GFF and VCF lines are converted to
+    Intervals directly; other lines (e.g., SAM) go through
+    create_interval_from_list(), so the resulting Intervals are identical to
+    those from IntervalIterator.
+
+    >>> fn = pybedtools.example_filename('a.bed')
+    >>> for i in BufferedIntervalIterator(open(fn, 'rb')):
+    ...     print(i.name)
+    feature1
+    feature2
+    feature3
+    feature4
+
+    """
+    cdef object stream
+    cdef bytes _buf
+    cdef Py_ssize_t _pos
+    cdef Py_ssize_t blocksize
+    cdef bint _eof
+
+    def __init__(self, stream, blocksize=2 ** 20):
+        self.stream = stream
+        self.blocksize = blocksize
+        self._buf = b""
+        self._pos = 0
+        self._eof = False
+
+    def __iter__(self):
+        return self
+
+    cdef _fill(self):
+        data = self.stream.read(self.blocksize)
+        if not data:
+            self._eof = True
+            return
+        if isinstance(data, unicode):
+            data = (<unicode>data).encode('UTF-8')
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+
+    def __next__(self):
+        cdef const char *buf
+        cdef const char *nl
+        cdef Py_ssize_t size, start, end
+        cdef Interval interval
+
+        while True:
+            size = len(self._buf)
+            if self._pos < size:
+                buf = self._buf
+                nl = <const char *>memchr(buf + self._pos, c'\n',
+                                          size - self._pos)
+                if nl != NULL or self._eof:
+                    start = self._pos
+                    end = (nl - buf) if nl != NULL else size
+                    self._pos = end + 1
+                    while end > start and buf[end - 1] == c'\r':
+                        end -= 1
+                    if _is_skipped_line(buf + start, end - start):
+                        continue
+                    interval = _interval_from_line(buf + start, end - start)
+                    if interval is None:
+                        fields = buf[start:end].decode('UTF-8').split('\t')
+                        interval = create_interval_from_list(fields)
+                    return interval
+            elif self._eof:
+                try:
+                    self.stream.close()
+                except AttributeError:
+                    pass
+                raise StopIteration
+            self._fill()
+
+
+
+cdef Interval _batch_interval(const char *line, Py_ssize_t n):
+    cdef Interval interval = _interval_from_line(line, n)
+    if interval is None:
+        interval = create_interval_from_list(
+            line[:n].decode('UTF-8').split('\t'))
+    return interval
+
+
+def _unpickle_batch(buffer):
+    cdef IntervalBatch batch = IntervalBatch.__new__(IntervalBatch)
+    batch._set_buffer(buffer)
+    return batch
+
+
+cdef class IntervalBatch:
+    """
+    A sequence of Intervals held as their lines in a single buffer, for
+    sending many Intervals to or from other processes at once.
+
+    Constructor::
+
+        IntervalBatch(intervals=())
+
+    Pickling a list of Intervals pickles each one's fields, and unpickling
+    it calls create_interval_from_list() for each.  An IntervalBatch pickles
+    as one bytes buffer instead -- out-of-band with pickle protocol 5 and a
+    `buffer_callback` -- and each Interval is only parsed again, in C, when
+    it is accessed.  As with pickling an Interval, only its fields are kept.
+
+    >>> import pickle
+    >>> a = pybedtools.example_bedtool('a.bed')
+    >>> batch = pickle.loads(pickle.dumps(IntervalBatch(a)))
+    >>> len(batch)
+    4
+    >>> print(batch[-1]) #doctest: +NORMALIZE_WHITESPACE
+    chr1	900	950	feature4	0	+
+    <BLANKLINE>
+    >>> [i.name for i in batch]
+    ['feature1', 'feature2', 'feature3', 'feature4']
+
+    """
+    cdef object _buffer
+    cdef const unsigned char[:] _data
+    cdef Py_ssize_t _size
+    # Start of each line, then the end of the buffer; filled on first use
+    cdef vector[Py_ssize_t] _starts
+    cdef bint _indexed
+
+    def __init__(self, intervals=()):
+        cdef Interval interval
+        lines = []
+        for interval in intervals:
+            interval.deparse_attrs()
+            interval._unpack()
+            if interval._line is not None:
+                lines.append(interval._line)
+            else:
+                lines.append(b'\t'.join(interval._bed.fields))
+            lines.append(b'\n')
+        self._set_buffer(b''.join(lines))
+
+    cdef _set_buffer(self, buffer):
+        self._buffer = buffer
+        self._size = len(memoryview(buffer))
+        if self._size:
+            self._data = buffer
+        self._starts.clear()
+        self._indexed = False
+
+    cdef _index(self):
+        cdef const char *buf
+        cdef const char *nl
+        cdef Py_ssize_t start = 0
+        if self._indexed:
+            return
+        if self._size:
+            buf = <const char *>&self._data[0]
+        while start < self._size:
+            self._starts.push_back(start)
+            nl = <const char *>memchr(buf + start, c'\n', self._size - start)
+            start = (nl - buf + 1) if nl != NULL else self._size
+        self._starts.push_back(self._size)
+        self._indexed = True
+
+    cdef Interval _get(self, Py_ssize_t i):
+        cdef Py_ssize_t start = self._starts[i], end = self._starts[i + 1]
+        if self._data[end - 1] == c'\n':
+            end -= 1
+        return _batch_interval(<const char *>&self._data[start], end - start)
+
+    def __len__(self):
+        self._index()
+        return self._starts.size() - 1
+
+    def __getitem__(self, key):
+        cdef Py_ssize_t i, n
+        self._index()
+        n = self._starts.size() - 1
+        if isinstance(key, slice):
+            return [self._get(i) for i in range(*key.indices(n))]
+        i = key
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError('IntervalBatch index out of range')
+        return self._get(i)
+
+    def __iter__(self):
+        cdef const char *buf
+        cdef const char *nl
+        cdef Py_ssize_t start = 0, end
+        if self._size:
+            buf = <const char *>&self._data[0]
+        while start < self._size:
+            nl = <const char *>memchr(buf + start, c'\n', self._size - start)
+            end = (nl - buf) if nl != NULL else self._size
+            yield _batch_interval(buf + start, end - start)
+            start = end + 1
+
+    def __reduce_ex__(self, protocol):
+        if protocol >= 5 and PickleBuffer is not None:
+            return _unpickle_batch, (PickleBuffer(self._buffer),)
+        return _unpickle_batch, (bytes(self._buffer),)
+
+    def __repr__(self):
+        return '<IntervalBatch of %s Intervals (%s bytes)>' % (
+            len(self), self._size)
+
+
+def count_feature_lines(stream, Py_ssize_t blocksize=2 ** 20):
+    """
+    Returns the number of lines in the file-like object `stream` (opened in
+    binary mode) that iterating over it would yield as features, skipping
+    the same header, track, browser and blank lines as
+    BufferedIntervalIterator -- but without creating any Intervals.
+
+    >>> fn = pybedtools.example_filename('a.bed')
+    >>> count_feature_lines(open(fn, 'rb'))
+    4
+    """
+    cdef const char *buf
+    cdef const char *nl
+    cdef Py_ssize_t size, start, end
+    cdef long long count = 0
+    cdef bytes block
+    rest = b''
+    while True:
+        data = stream.read(blocksize)
+        if isinstance(data, unicode):
+            data = (<unicode>data).encode('UTF-8')
+        if not data:
+            break
+        block = rest + data
+        buf = block
+        size = len(block)
+        start = 0
+        while True:
+            nl = <const char *>memchr(buf + start, c'\n', size - start)
+            if nl == NULL:
+                break
+            end = nl - buf
+            if not _is_skipped_line(buf + start, end - start):
+                count += 1
+            start = end + 1
+        rest = block[start:]
+    if rest and not _is_skipped_line(rest, len(rest)):
+        count += 1
+    try:
+        stream.close()
+    except AttributeError:
+        pass
+    return count
+
+# On-disk index of the features in an interval file, used by IntervalFile
+# queries instead of loading the whole file into BedFile.bedMap.
+#
+# The layout (little-endian) is a header, a chromosome table, and then these
+# arrays, each aligned to 8 bytes:
+#
+#   bins     uint32 x n_bins        sorted bin numbers, grouped by chrom
+#   first    uint64 x (n_bins + 1)  index of each bin's first record
+#   starts   uint32 x n_records     feature start
+#   ends     uint32 x n_records     feature end
+#   offsets  uint64 x n_records     byte offset of the line in the file
+#   strands  uint8  x n_records     strand code (see _strand_code())
+#
+# Records are sorted by chrom, then bin, then position in the file, which
+# is the order BedFile.FindOverlapsPerBin() visits them in.
+_INDEX_MAGIC = b'PBTIDX01'
+_INDEX_HEADER = struct.Struct('<8sQqQQQ')
+_INDEX_CHROM = struct.Struct('<HQQ')
+ctypedef unsigned long long _offset_t
+ctypedef pair[_offset_t, size_t] _index_key
+
+
+def _file_signature(fn):
+    """
+    (size, mtime in ns) of `fn`, used to tell if an index is out of date.
+    """
+    st = os.stat(fn)
+    return st.st_size, int(getattr(st, 'st_mtime_ns', st.st_mtime * 1e9))
+
+
+cdef inline int _strand_code(string strand):
+    if strand.size() == 0:
+        return 0
+    if strand.size() == 1:
+        if strand[0] == c'+':
+            return 1
+        if strand[0] == c'-':
+            return 2
+        if strand[0] == c'.':
+            return 3
+    return -1
+
+
+def _index_array(view, pos, typecode, size, n):
+    pos += -pos % 8
+    return view[pos:pos + size * n].cast(typecode), pos + size * n
+
+
+def _write_index_array(fout, arr):
+    fout.write(b'\0' * (-fout.tell() % 8))
+    if hasattr(arr, 'tobytes'):
+        fout.write(arr.tobytes())
+    else:
+        fout.write(arr.tostring())
+
+
+cdef class IntervalIndex:
+    """
+    A read-only, memory-mapped index of an interval file, as written by
+    :meth:`IntervalFile.build_index`.
+
+    Constructor::
+
+        IntervalIndex(index_fn, fn)
+
+    Raises ValueError if `index_fn` is not an index or is out of date with
+    respect to the interval file `fn`.  Since the index is memory-mapped, it
+    is cheap to open and its pages are shared between processes.
+    """
+    cdef object _mm
+    cdef dict _chroms
+    cdef const unsigned int[:] _bins
+    cdef const unsigned long long[:] _first
+    cdef const unsigned int[:] _starts
+    cdef const unsigned int[:] _ends
+    cdef const unsigned long long[:] _offsets
+    cdef const unsigned char[:] _strands
+    cdef readonly object fn
+
+    def __init__(self, index_fn, fn):
+        self.fn = index_fn
+        with open(index_fn, 'rb') as fh:
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < _INDEX_HEADER.size:
+            raise ValueError('%s is not an interval index' % index_fn)
+        (magic, size, mtime, n_chroms, n_bins,
+         n_records) = _INDEX_HEADER.unpack_from(self._mm, 0)
+        if magic != _INDEX_MAGIC:
+            raise ValueError('%s is not an interval index' % index_fn)
+        if (size, mtime) != _file_signature(fn):
+            raise ValueError('%s is out of date' % index_fn)
+
+        pos = _INDEX_HEADER.size
+        self._chroms = {}
+        for i in range(n_chroms):
+            namelen, lo, hi = _INDEX_CHROM.unpack_from(self._mm, pos)
+            pos += _INDEX_CHROM.size
+            self._chroms[self._mm[pos:pos + namelen]] = (lo, hi)
+            pos += namelen
+
+        view = memoryview(self._mm)
+        self._bins, pos = _index_array(view, pos, 'I', 4, n_bins)
+        self._first, pos = _index_array(view, pos, 'Q', 8, n_bins + 1)
+        self._starts, pos = _index_array(view, pos, 'I', 4, n_records)
+        self._ends, pos = _index_array(view, pos, 'I', 4, n_records)
+        self._offsets, pos = _index_array(view, pos, 'Q', 8, n_records)
+        self._strands, pos = _index_array(view, pos, 'B', 1, n_records)
+
+    def __len__(self):
+        return self._starts.shape[0]
+
+    @cython.cdivision(True)
+    cdef int query(self, BED *bed, bint same_strand, float overlapFraction,
+                   int mode, vector[size_t] *hits):
+        """
+        Mirrors BedFile::FindOverlapsPerBin() and friends.  `mode` is 0 to
+        add matching record indexes to `hits` (returning the number of
+        hits), 1 to return 1 on the first hit, or 2 to just count hits.
+        """
+        cdef size_t lo, hi, k, r, a, b, mid
+        cdef BIN startBin, endBin, first, last
+        cdef int i, count = 0, maxStart, minEnd, overlap, qstrand
+        cdef float size, ofrac
+
+        try:
+            lo, hi = self._chroms[<bytes>bed.chrom]
+        except KeyError:
+            return 0
+        qstrand = _strand_code(bed.strand)
+
+        startBin = bed.start >> _binFirstShift
+        endBin = (bed.end - 1) >> _binFirstShift
+        for i in range(_binLevels):
+            first = startBin + _binOffsetsExtended[i]
+            last = endBin + _binOffsetsExtended[i]
+
+            # binary search for the first bin >= first
+            a, b = lo, hi
+            while a < b:
+                mid = (a + b) // 2
+                if self._bins[mid] < first:
+                    a = mid + 1
+                else:
+                    b = mid
+            k = a
+            while k < hi and self._bins[k] <= last:
+                for r in range(self._first[k], self._first[k + 1]):
+                    if same_strand and self._strands[r] != qstrand:
+                        continue
+                    size = <float>bed.end - bed.start
+                    maxStart = max(bed.start, self._starts[r])
+                    minEnd = min(bed.end, self._ends[r])
+                    overlap = minEnd - maxStart
+                    ofrac = overlap / size
+                    if ((ofrac >= overlapFraction)
+                            or ((size == 0) and (overlap == 0))):
+                        if mode == 1:
+                            return 1
+                        if mode == 0:
+                            hits.push_back(r)
+                        count += 1
+                k += 1
+            startBin >>= _binNextShift
+            endBin >>= _binNextShift
+        return count
+
+
+# On-disk index of the byte offset of each feature line of an interval file,
+# used to read the i-th feature without reading the lines before it.  The
+# layout (little-endian) is a header and then an array, aligned to 8 bytes:
+#
+#   offsets  uint64 x n_lines   byte offset of each feature line
+#
+# Header, track, browser and blank lines, which are skipped when iterating,
+# are not counted.
+_LINE_INDEX_MAGIC = b'PBTLIN01'
+_LINE_INDEX_HEADER = struct.Struct('<8sQqQ')
+
+
+cdef class LineIndex:
+    """
+    Random access to the features of an interval file by their position in
+    the file.
+
+    Constructor::
+
+        LineIndex(fn, index_fn=None, save=True)
+
+    The byte offset of each feature line is read from `index_fn` (by
+    default, the filename plus ".pbtlines"), which is memory-mapped.  If it
+    is missing or out of date it is built with a single pass over the file
+    and, if `save` is True and the directory is writable, saved for next
+    time.  Lines are read from a memory map of the file, so getting a
+    feature takes the same time wherever it is in the file.
+
+    Raises ValueError for gzipped files.
+
+    >>> fn = pybedtools.example_filename('a.bed')
+    >>> index = LineIndex(fn, save=False)
+    >>> len(index)
+    4
+    >>> print(index[-2]) #doctest: +NORMALIZE_WHITESPACE
+    chr1	150	500	feature3	0	-
+    <BLANKLINE>
+    """
+    cdef object _mm
+    cdef object _index_mm
+    cdef const unsigned char[:] _data
+    cdef const unsigned long long[:] _offsets
+    cdef Py_ssize_t _size
+    cdef readonly object fn
+    cdef readonly object index_fn
+    cdef readonly object signature
+
+    def __init__(self, fn, index_fn=None, save=True):
+        self.fn = fn
+        self.index_fn = index_fn or fn + '.pbtlines'
+        with open(fn, 'rb') as fh:
+            if fh.read(2) == b'\x1f\x8b':
+                raise ValueError(
+                    "Gzipped files can't be indexed: %s" % fn)
+            self.signature = _file_signature(fn)
+            self._size = self.signature[0]
+            if self._size:
+                self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+                self._data = self._mm
+        try:
+            self._offsets = self._open_index()
+        except (IOError, OSError, ValueError):
+            offsets = self._scan()
+            if save:
+                try:
+                    self._save(offsets)
+                except (IOError, OSError):
+                    pass
+            self._offsets = offsets
+
+    def _open_index(self):
+        with open(self.index_fn, 'rb') as fh:
+            self._index_mm = mmap.mmap(fh.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+        if len(self._index_mm) < _LINE_INDEX_HEADER.size:
+            raise ValueError('%s is not a line index' % self.index_fn)
+        magic, size, mtime, n = _LINE_INDEX_HEADER.unpack_from(
+            self._index_mm, 0)
+        if magic != _LINE_INDEX_MAGIC:
+            raise ValueError('%s is not a line index' % self.index_fn)
+        if (size, mtime) != self.signature:
+            raise ValueError('%s is out of date' % self.index_fn)
+        return _index_array(memoryview(self._index_mm),
+                            _LINE_INDEX_HEADER.size, 'Q', 8, n)[0]
+
+    cdef _scan(self):
+        """
+        Byte offsets of the feature lines, as an array.
+        """
+        cdef const char *buf
+        cdef const char *nl
+        cdef Py_ssize_t start = 0, end, stripped, i
+        cdef vector[unsigned long long] offsets
+        cdef unsigned long long[:] view
+        if self._size:
+            buf = <const char *>&self._data[0]
+        while start < self._size:
+            nl = <const char *>memchr(buf + start, c'\n', self._size - start)
+            end = (nl - buf) if nl != NULL else self._size
+            stripped = end
+            while stripped > start and buf[stripped - 1] == c'\r':
+                stripped -= 1
+            if not _is_skipped_line(buf + start, stripped - start):
+                offsets.push_back(start)
+            start = end + 1
+        result = array.array('Q', [0]) * offsets.size()
+        if offsets.size():
+            view = result
+            for i in range(<Py_ssize_t>offsets.size()):
+                view[i] = offsets[i]
+        return result
+
+    def _save(self, offsets):
+        tmp = '%s.%s.tmp' % (self.index_fn, os.getpid())
+        try:
+            with open(tmp, 'wb') as fout:
+                fout.write(_LINE_INDEX_HEADER.pack(
+                    _LINE_INDEX_MAGIC, self.signature[0], self.signature[1],
+                    len(offsets)))
+                _write_index_array(fout, offsets)
+            os.rename(tmp, self.index_fn)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def __len__(self):
+        return self._offsets.shape[0]
+
+    cdef Py_ssize_t _check(self, Py_ssize_t i) except -1:
+        cdef Py_ssize_t n = self._offsets.shape[0]
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError('LineIndex index out of range')
+        return i
+
+    def line(self, Py_ssize_t i):
+        """
+        Returns feature line `i` as bytes, without the line ending.
+        """
+        cdef const char *buf
+        cdef const char *nl
+        cdef Py_ssize_t start, end
+        i = self._check(i)
+        buf = <const char *>&self._data[0]
+        start = self._offsets[i]
+        nl = <const char *>memchr(buf + start, c'\n', self._size - start)
+        end = (nl - buf) if nl != NULL else self._size
+        while end > start and buf[end - 1] == c'\r':
+            end -= 1
+        return buf[start:end]
+
+    def __getitem__(self, Py_ssize_t i):
+        cdef Interval interval
+        line = self.line(i)
+        interval = _interval_from_line(line, len(line))
+        if interval is None:
+            interval = create_interval_from_list(
+                line.decode('UTF-8').split('\t'))
+        return interval
+
+
+# Tabix binning: the smallest bins span 2**14 bp, and each level up is 8
+# times larger.
+cdef int _TABIX_MIN_SHIFT = 14
+
+# Linear index entry for a window that no line overlaps
+cdef unsigned long long _TABIX_NO_OFFSET = 0xffffffffffffffffULL
+
+
+cdef inline bint _tabix_pos(const char *s, Py_ssize_t n, long long *out):
+    cdef Py_ssize_t i
+    cdef long long v = 0
+    if n == 0 or n > 18:
+        return False
+    for i in range(n):
+        if s[i] < c'0' or s[i] > c'9':
+            return False
+        v = v * 10 + (s[i] - c'0')
+    out[0] = v
+    return True
+
+
+cdef inline unsigned long long _voffset(vector[unsigned long long] &co,
+                                        unsigned long long block_size,
+                                        unsigned long long u):
+    # Virtual offset of position `u` of the uncompressed data: the file
+    # offset of its block, shifted 16 bits left, plus its offset within it.
+    return (co[u // block_size] << 16) | (u % block_size)
+
+
+cdef struct _TabixChunk:
+    # level above the smallest bins in the top 8 bits, then the index of the
+    # bin within its level
+    unsigned long long key
+    unsigned long long bin
+    unsigned long long beg
+    unsigned long long end
+
+
+cdef bint _tabix_chunk_lt(const _TabixChunk &a, const _TabixChunk &b):
+    if a.bin != b.bin:
+        return a.bin < b.bin
+    return a.beg < b.beg
+
+
+cdef inline void _put32(string &out, unsigned int v):
+    cdef int i
+    for i in range(4):
+        out.push_back(<char>((v >> (8 * i)) & 0xff))
+
+
+cdef inline void _put64(string &out, unsigned long long v):
+    cdef int i
+    for i in range(8):
+        out.push_back(<char>((v >> (8 * i)) & 0xff))
+
+
+cdef class _TabixRef:
+    cdef bytes name
+    cdef vector[_TabixChunk] chunks
+    cdef vector[unsigned long long] linear
+    cdef unsigned long long first, last, count
+
+
+cdef class TabixIndexer:
+    """
+    Builds a tabix or CSI index of a sorted BED or GFF stream from the
+    positions of its lines in the uncompressed data; used by
+    :class:`pybedtools.bgzf.BgzfWriter` to index a file as it is
+    compressed.
+
+    Constructor::
+
+        TabixIndexer(col_seq=1, col_beg=2, col_end=3, zero_based=True)
+
+    `col_seq`, `col_beg` and `col_end` are the 1-based columns of the
+    chromosome, start and end; `zero_based` is True for BED-style
+    coordinates and False for GFF-style ones.
+
+    Pass the data to :meth:`add` in order, in pieces that end at line
+    breaks, then call :meth:`index`.  Header, track and blank lines are
+    skipped.  Raises ValueError if a line can't be parsed or the lines
+    aren't sorted by chromosome and start.
+    """
+    cdef int col_seq, col_beg, col_end
+    cdef bint zero_based
+    cdef _TabixRef _ref
+    cdef set _seen
+    cdef list _refs
+    cdef long long _last_beg
+    cdef Py_ssize_t _lineno
+    cdef readonly long long max_end
+
+    def __init__(self, int col_seq=1, int col_beg=2, int col_end=3,
+                 bint zero_based=True):
+        self.col_seq = col_seq
+        self.col_beg = col_beg
+        self.col_end = col_end
+        self.zero_based = zero_based
+        self._ref = None
+        self._seen = set()
+        self._refs = []
+        self._lineno = 0
+        self.max_end = 0
+
+    @property
+    def names(self):
+        """
+        Chromosome names, in order.
+        """
+        cdef _TabixRef ref
+        return [ref.name for ref in self._refs]
+
+    cdef _new_ref(self, bytes name):
+        if name in self._seen:
+            raise ValueError(
+                'Line %s: features on %s are not contiguous -- the lines '
+                'must be sorted by chromosome and start'
+                % (self._lineno, name.decode('UTF-8', 'replace')))
+        self._seen.add(name)
+        self._ref = _TabixRef()
+        self._ref.name = name
+        self._refs.append(self._ref)
+        self._last_beg = 0
+
+    cdef _record(self, long long beg, long long end,
+                 unsigned long long u0, unsigned long long u1):
+        cdef _TabixRef ref = self._ref
+        cdef _TabixChunk chunk
+        cdef int shift = _TABIX_MIN_SHIFT
+        cdef unsigned long long level = 0, key
+        cdef long long w, w0, w1
+        if beg < self._last_beg:
+            raise ValueError(
+                'Line %s: start %s is less than that of the line before -- '
+                'the lines must be sorted by chromosome and start'
+                % (self._lineno, beg))
+        self._last_beg = beg
+        if end <= beg:
+            end = beg + 1
+        if end > self.max_end:
+            self.max_end = end
+
+        # The bin number depends on the number of levels, known only at the
+        # end, so identify the bin by its level and index for now.
+        while (beg >> shift) != ((end - 1) >> shift):
+            shift += 3
+            level += 1
+        key = (level << 56) | <unsigned long long>(beg >> shift)
+        if ref.chunks.size() and ref.chunks.back().key == key:
+            ref.chunks.back().end = u1
+        else:
+            chunk.key = key
+            chunk.beg = u0
+            chunk.end = u1
+            ref.chunks.push_back(chunk)
+
+        # Linear index: position of the first line overlapping each 16 kb
+        # window.  Lines are sorted by start, so only windows past the end
+        # are new.
+        w0 = beg >> _TABIX_MIN_SHIFT
+        w1 = (end - 1) >> _TABIX_MIN_SHIFT
+        w = ref.linear.size()
+        while w <= w1:
+            ref.linear.push_back(u0 if w >= w0 else _TABIX_NO_OFFSET)
+            w += 1
+
+        if ref.count == 0:
+            ref.first = u0
+        ref.last = u1
+        ref.count += 1
+
+    def add(self, data, unsigned long long offset):
+        """
+        Indexes the lines in the bytestring `data`, which starts at position
+        `offset` of the uncompressed stream.  A final line without a line
+        break is indexed as ending at the end of `data`.
+        """
+        cdef const char *buf = data
+        cdef const char *nl
+        cdef Py_ssize_t size = len(data)
+        cdef Py_ssize_t start = 0, end, stripped, i, col
+        cdef Py_ssize_t fstart, seq_s = 0, seq_e = 0, beg_s = 0, beg_e = 0
+        cdef Py_ssize_t end_s = 0, end_e = 0
+        cdef int last_col = max(self.col_seq, self.col_beg, self.col_end)
+        cdef long long beg, stop
+        cdef bint complete
+        while start < size:
+            nl = <const char *>memchr(buf + start, c'\n', size - start)
+            end = (nl - buf) if nl != NULL else size
+            self._lineno += 1
+            stripped = end
+            while stripped > start and buf[stripped - 1] == c'\r':
+                stripped -= 1
+            if _is_skipped_line(buf + start, stripped - start):
+                start = end + 1
+                continue
+
+            col = 1
+            complete = False
+            fstart = start
+            for i in range(start, stripped + 1):
+                if i < stripped and buf[i] != c'\t':
+                    continue
+                if col == self.col_seq:
+                    seq_s, seq_e = fstart, i
+                if col == self.col_beg:
+                    beg_s, beg_e = fstart, i
+                if col == self.col_end:
+                    end_s, end_e = fstart, i
+                if col == last_col:
+                    complete = True
+                    break
+                col += 1
+                fstart = i + 1
+            if not complete or \
+                    not _tabix_pos(buf + beg_s, beg_e - beg_s, &beg) or \
+                    not _tabix_pos(buf + end_s, end_e - end_s, &stop):
+                raise ValueError(
+                    'Line %s could not be parsed for the tabix index: %r'
+                    % (self._lineno, buf[start:stripped]))
+            if not self.zero_based and beg > 0:
+                beg -= 1
+
+            if self._ref is None or \
+                    len(self._ref.name) != seq_e - seq_s or \
+                    memcmp(<const char *>self._ref.name, buf + seq_s,
+                           seq_e - seq_s) != 0:
+                self._new_ref(buf[seq_s:seq_e])
+            self._record(beg, stop, offset + start,
+                         offset + min(end + 1, size))
+            start = end + 1
+
+    def index(self, coffsets, unsigned long long block_size, int depth,
+              bint csi=False):
+        """
+        Returns the bins (and, for tabix, the linear index) of each
+        chromosome in the binary index format, given `depth` levels of bins
+        below the root, the size of each BGZF block's uncompressed data, and
+        the file offset of each block followed by that of the EOF block.
+        """
+        cdef vector[unsigned long long] co = coffsets
+        cdef string out
+        cdef _TabixRef ref
+        for ref in self._refs:
+            self._ref_index(out, ref, co, block_size, depth, csi)
+        return out
+
+    cdef _ref_index(self, string &out, _TabixRef ref,
+                    vector[unsigned long long] &co,
+                    unsigned long long block_size, int depth, bint csi):
+        cdef vector[_TabixChunk] chunks = ref.chunks
+        cdef vector[_TabixChunk] merged
+        cdef vector[unsigned long long] linear = ref.linear
+        cdef unsigned long long following = ref.first, level, i, window
+        cdef unsigned long long loffset
+        cdef vector[unsigned long long] level_start
+        cdef size_t j, k, n, n_bins = 0
+        cdef Py_ssize_t w
+
+        # Windows that no line overlaps get the next window's offset; no
+        # line overlapping a later window starts before it.
+        for w in range(<Py_ssize_t>linear.size() - 1, -1, -1):
+            if linear[w] == _TABIX_NO_OFFSET:
+                linear[w] = following
+            else:
+                following = linear[w]
+        for j in range(linear.size()):
+            linear[j] = _voffset(co, block_size, linear[j])
+
+        # First bin number of each level, from the root down
+        for j in range(depth + 2):
+            level_start.push_back(((1ULL << (3 * j)) - 1) // 7)
+        for j in range(chunks.size()):
+            level = chunks[j].key >> 56
+            i = chunks[j].key & ((1ULL << 56) - 1)
+            chunks[j].bin = 0 if level >= <unsigned long long>depth \
+                else level_start[depth - level] + i
+            chunks[j].beg = _voffset(co, block_size, chunks[j].beg)
+            chunks[j].end = _voffset(co, block_size, chunks[j].end)
+        cpp_sort(chunks.begin(), chunks.end(), _tabix_chunk_lt)
+        for j in range(chunks.size()):
+            if j == 0 or chunks[j].bin != chunks[j - 1].bin:
+                n_bins += 1
+
+        _put32(out, n_bins + 1)
+        j = 0
+        while j < chunks.size():
+            # Merge chunks that start in the block where the one before ends
+            merged.clear()
+            merged.push_back(chunks[j])
+            k = j + 1
+            while k < chunks.size() and chunks[k].bin == chunks[j].bin:
+                if merged.back().end >> 16 >= chunks[k].beg >> 16:
+                    if chunks[k].end > merged.back().end:
+                        merged.back().end = chunks[k].end
+                else:
+                    merged.push_back(chunks[k])
+                k += 1
+
+            _put32(out, chunks[j].bin)
+            if csi:
+                level = chunks[j].key >> 56
+                i = chunks[j].key & ((1ULL << 56) - 1)
+                window = 0 if level >= <unsigned long long>depth \
+                    else i << (3 * level)
+                loffset = linear[window] if window < linear.size() else 0
+                _put64(out, loffset)
+            _put32(out, merged.size())
+            for n in range(merged.size()):
+                _put64(out, merged[n].beg)
+                _put64(out, merged[n].end)
+            j = k
+
+        # Pseudo-bin holding the extent and number of the lines
+        _put32(out, level_start[depth + 1] + 1)
+        if csi:
+            _put64(out, 0)
+        _put32(out, 2)
+        _put64(out, _voffset(co, block_size, ref.first))
+        _put64(out, _voffset(co, block_size, ref.last))
+        _put64(out, ref.count)
+        _put64(out, 0)
+
+        if not csi:
+            _put32(out, linear.size())
+            for j in range(linear.size()):
+                _put64(out, linear[j])
+
 
 cdef class IntervalFile:
     cdef BedFile *intervalFile_ptr
+    cdef BedFile *_index_reader
     cdef bint _loaded
     cdef bint _open
     cdef string _fn
+    cdef object _index_fn
+    cdef IntervalIndex _index
     """
     An IntervalFile provides low-level access to the BEDTools API.
 
     >>> fn = pybedtools.example_filename('a.bed')
     >>> intervalfile = pybedtools.IntervalFile(fn)
 
+    If `index` is True, the first query uses a ".pbtidx" index file next to
+    the file (building it if it is missing or out of date) rather than
+    loading the whole file into memory.  `index` can also be the filename of
+    the index to use.  Gzipped files, and files whose features can't be
+    indexed, are loaded into memory as usual.
+
     """
-    def __init__(self, intervalFile):
+    def __init__(self, intervalFile, index=False):
         self.intervalFile_ptr = new BedFile(_cppstr(intervalFile))
+        self._index_reader = NULL
         self._loaded = 0
         self._open = 0
         self._fn = _cppstr(intervalFile)
+        if index is True:
+            self._index_fn = self.fn + '.pbtidx'
+        elif index:
+            self._index_fn = index
+        else:
+            self._index_fn = None
+        self._index = None
 
     def __dealloc__(self):
         del self.intervalFile_ptr
+        if self._index_reader != NULL:
+            self._index_reader.Close()
+            del self._index_reader
 
     def __iter__(self):
         return self
@@ -859,9 +2290,349 @@ cdef class IntervalFile:
         """
         if self._loaded:
             return
-        self.intervalFile_ptr.loadBedFileIntoMap()
+        if self._index_fn is not None:
+            self._index = self._open_index()
+        if self._index is None:
+            self.intervalFile_ptr.loadBedFileIntoMap()
         self._loaded = 1
 
+    @property
+    def indexed(self):
+        """
+        True if queries are answered from an on-disk index.
+        """
+        self.loadIntoMap()
+        return self._index is not None
+
+    def _open_index(self):
+        try:
+            return IntervalIndex(self._index_fn, self.fn)
+        except (IOError, OSError, ValueError):
+            pass
+        try:
+            self.build_index(self._index_fn)
+            return IntervalIndex(self._index_fn, self.fn)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def build_index(self, index_fn=None):
+        """
+        Write an index of the features in this file to `index_fn` (by
+        default, the filename plus ".pbtidx"), and return its filename.
+
+        The index holds each feature's bin, coordinates, strand and byte
+        offset, so that later queries only need to read the lines that are
+        hits.  It is written to a temp file and renamed into place, so
+        processes building the same index concurrently don't collide.
+
+        Raises ValueError for gzipped files and for features whose strand is
+        not one of "+", "-", "." or empty.
+        """
+        cdef BedFile *reader
+        cdef BED b
+        cdef string last_chrom
+        cdef size_t n = 0, r, i, nrec
+        cdef unsigned long long offset, key, prev_key = 0
+        cdef int code, cid = -1
+        cdef vector[CHRPOS] starts, ends
+        cdef vector[unsigned long long] offsets
+        cdef vector[unsigned char] strands
+        cdef vector[_index_key] keys
+        cdef vector[BIN] bins
+        cdef vector[unsigned long long] firsts
+        cdef unsigned int[:] v_starts, v_ends
+        cdef unsigned long long[:] v_offsets
+        cdef unsigned char[:] v_strands
+
+        if index_fn is None:
+            index_fn = self.fn + '.pbtidx'
+        with open(self.fn, 'rb') as fh:
+            if fh.read(2) == b'\x1f\x8b':
+                raise ValueError(
+                    "Gzipped files can't be indexed: %s" % self.fn)
+        signature = _file_signature(self.fn)
+
+        chrom_ids = {}
+        chroms = []
+        reader = new BedFile(self._fn)
+        try:
+            if reader.Open() == -1:
+                raise BedToolsFileError("Error opening file")
+            while True:
+                offset = reader.Tell()
+                b = reader.GetNextBed()
+                if b.status == BED_INVALID:
+                    break
+                if b.status != BED_VALID:
+                    continue
+                if n == 0 or b.chrom != last_chrom:
+                    last_chrom = b.chrom
+                    chrom = <bytes>b.chrom
+                    if chrom not in chrom_ids:
+                        chrom_ids[chrom] = len(chroms)
+                        chroms.append(chrom)
+                    cid = chrom_ids[chrom]
+                code = _strand_code(b.strand)
+                if code < 0:
+                    raise ValueError(
+                        "Strand %r can't be stored in an index"
+                        % _pystr(b.strand))
+                keys.push_back(_index_key(
+                    (<unsigned long long>cid << 32) | getBin(b.start, b.end),
+                    n))
+                starts.push_back(b.start)
+                ends.push_back(b.end)
+                offsets.push_back(offset)
+                strands.push_back(code)
+                n += 1
+            reader.Close()
+        finally:
+            del reader
+
+        cpp_sort(keys.begin(), keys.end())
+
+        nrec = keys.size()
+        a_starts = array.array('I', [0]) * nrec
+        a_ends = array.array('I', [0]) * nrec
+        a_offsets = array.array('Q', [0]) * nrec
+        a_strands = array.array('B', [0]) * nrec
+        v_starts = a_starts
+        v_ends = a_ends
+        v_offsets = a_offsets
+        v_strands = a_strands
+        ranges = [[0, 0] for _ in chroms]
+        for r in range(nrec):
+            key = keys[r].first
+            i = keys[r].second
+            if r == 0 or key != prev_key:
+                if r == 0 or (key >> 32) != (prev_key >> 32):
+                    ranges[key >> 32][0] = bins.size()
+                bins.push_back(<BIN>(key & 0xffffffff))
+                firsts.push_back(r)
+                ranges[key >> 32][1] = bins.size()
+                prev_key = key
+            v_starts[r] = starts[i]
+            v_ends[r] = ends[i]
+            v_offsets[r] = offsets[i]
+            v_strands[r] = strands[i]
+        firsts.push_back(nrec)
+
+        if _file_signature(self.fn) != signature:
+            raise ValueError("%s changed while being indexed" % self.fn)
+
+        tmp = '%s.%s.tmp' % (index_fn, os.getpid())
+        try:
+            with open(tmp, 'wb') as fout:
+                fout.write(_INDEX_HEADER.pack(
+                    _INDEX_MAGIC, signature[0], signature[1], len(chroms),
+                    bins.size(), nrec))
+                for chrom, (lo, hi) in zip(chroms, ranges):
+                    fout.write(_INDEX_CHROM.pack(len(chrom), lo, hi))
+                    fout.write(chrom)
+                for arr in (array.array('I', bins), array.array('Q', firsts),
+                            a_starts, a_ends, a_offsets, a_strands):
+                    _write_index_array(fout, arr)
+            os.rename(tmp, index_fn)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        return index_fn
+
+    cdef list _index_hits(self, BED *bed, bint same_strand, float overlap):
+        cdef vector[size_t] hits
+        cdef size_t r
+        cdef BED b
+        cdef list result = []
+        self._index.query(bed, same_strand, overlap, 0, &hits)
+        if hits.size() == 0:
+            return result
+
+        # A separate reader, so that lines can be fetched by offset without
+        # disturbing iteration over this IntervalFile.
+        if self._index_reader == NULL:
+            self._index_reader = new BedFile(self._fn)
+            if self._index_reader.Open() == -1:
+                del self._index_reader
+                self._index_reader = NULL
+                raise BedToolsFileError("Error opening file")
+        for r in hits:
+            self._index_reader.Seek(self._index._offsets[r])
+            b = self._index_reader.GetNextBed()
+            b.o_start = max(bed.start, b.start)
+            b.o_end = min(bed.end, b.end)
+            result.append(create_interval(b))
+        return result
+
+    cdef _hits_many(self, intervals, bint same_strand, float overlap,
+                    bint sorted, int mode):
+        """
+        Shared implementation of the *_hits_many() methods.  `mode` is 0 for
+        all hits, 1 for any hits and 2 for counts, as in
+        IntervalIndex.query().
+        """
+        cdef BED q
+        cdef BED *qp
+        cdef BED b
+        cdef vector[BED] vec_b
+        cdef vector[BED *] sweep_hits
+        cdef _OverlapSweep sweep = None
+        cdef size_t i
+        cdef int n
+
+        self.loadIntoMap()
+        if sorted and self._index is None and overlap >= 0:
+            sweep = _OverlapSweep(self)
+
+        if mode == 0:
+            offsets = array.array('Q', [0])
+            hits = []
+        else:
+            counts = array.array('L')
+
+        if hasattr(intervals, 'chrom_codes'):
+            # An IntervalArray; avoid creating Intervals for the queries.
+            chroms = [_cppstr(c) for c in intervals.chroms]
+            intervals = zip(
+                [chroms[c] for c in intervals.chrom_codes.tolist()],
+                intervals.starts.tolist(), intervals.ends.tolist(),
+                intervals.strands.tolist())
+
+        for item in intervals:
+            if isinstance(item, Interval):
+                qp = (<Interval>item)._bed
+            else:
+                if len(item) == 3:
+                    chrom, start, end = item
+                    strand = '.'
+                else:
+                    chrom, start, end, strand = item
+                q.chrom = _cppstr(chrom)
+                q.start = start
+                q.end = end
+                q.strand = _cppstr(strand)
+                qp = &q
+
+            n = -2
+            if sweep is not None:
+                if mode == 0:
+                    sweep_hits.clear()
+                    n = sweep.query(qp, same_strand, overlap, 0, &sweep_hits)
+                    for i in range(sweep_hits.size()):
+                        b = deref(sweep_hits[i])
+                        b.o_start = max(qp.start, b.start)
+                        b.o_end = min(qp.end, b.end)
+                        hits.append(create_interval(b))
+                else:
+                    n = sweep.query(qp, same_strand, overlap, mode, NULL)
+
+            if mode == 0:
+                if n != -2:
+                    # answered by the sweep
+                    pass
+                elif self._index is not None:
+                    hits.extend(self._index_hits(qp, same_strand, overlap))
+                else:
+                    if not same_strand:
+                        vec_b = self.intervalFile_ptr.FindOverlapsPerBin(
+                            deref(qp), overlap)
+                    else:
+                        vec_b = self.intervalFile_ptr.FindOverlapsPerBin(
+                            deref(qp), same_strand, overlap)
+                    hits.extend(bed_vec2list(vec_b))
+                offsets.append(len(hits))
+            else:
+                if n != -2:
+                    pass
+                elif self._index is not None:
+                    n = self._index.query(qp, same_strand, overlap, mode,
+                                          NULL)
+                elif mode == 1:
+                    if not same_strand:
+                        n = self.intervalFile_ptr.FindAnyOverlapsPerBin(
+                            deref(qp), overlap)
+                    else:
+                        n = self.intervalFile_ptr.FindAnyOverlapsPerBin(
+                            deref(qp), same_strand, overlap)
+                else:
+                    if not same_strand:
+                        n = self.intervalFile_ptr.CountOverlapsPerBin(
+                            deref(qp), overlap)
+                    else:
+                        n = self.intervalFile_ptr.CountOverlapsPerBin(
+                            deref(qp), same_strand, overlap)
+                counts.append(n)
+
+        if mode == 0:
+            return offsets, hits
+        return counts
+
+    def all_hits_many(self, intervals, bool same_strand=False,
+                      float overlap=0.0, bool sorted=False):
+        """
+        :Signature: `IntervalFile.all_hits_many(intervals, same_strand=False, overlap=0.0, sorted=False)`
+
+        Like :meth:`all_hits`, but for many query intervals at once.
+
+        `intervals` can be any iterable of Interval objects (including
+        a BedTool), an iterable of (chrom, start, end[, strand]) tuples, or an
+        :class:`pybedtools.arrays.IntervalArray`.
+
+        Returns a tuple of (`offsets`, `hits`), where `hits` is a flat list of
+        Intervals and the hits for the i-th query are
+        ``hits[offsets[i]:offsets[i + 1]]``.  Hits are identical, and in the
+        same order, to those from calling :meth:`all_hits` for each query.
+
+        If `sorted` is True, the queries must be sorted by chromosome and then
+        start position (as with `sort -k1,1 -k2,2n`), and they are answered by
+        sweeping across the features of this file rather than searching bins
+        for every query.  ValueError is raised if they turn out not to be
+        sorted.
+
+        >>> fn = pybedtools.example_filename('a.bed')
+        >>> intervalfile = pybedtools.IntervalFile(fn)
+        >>> queries = [pybedtools.Interval('chr1', 1, 120),
+        ...            pybedtools.Interval('chr1', 920, 1000)]
+        >>> offsets, hits = intervalfile.all_hits_many(queries, sorted=True)
+        >>> list(offsets)
+        [0, 2, 3]
+        >>> hits[offsets[1]:offsets[2]]
+        [Interval(chr1:900-950)]
+
+        """
+        return self._hits_many(intervals, same_strand, overlap, sorted, 0)
+
+    def any_hits_many(self, intervals, bool same_strand=False,
+                      float overlap=0.0, bool sorted=False):
+        """
+        :Signature: `IntervalFile.any_hits_many(intervals, same_strand=False, overlap=0.0, sorted=False)`
+
+        Like :meth:`any_hits`, but for many query intervals at once.  Returns
+        an `array.array` with one 0 or 1 per query.
+
+        See :meth:`all_hits_many` for the supported inputs and `sorted`.
+        """
+        return self._hits_many(intervals, same_strand, overlap, sorted, 1)
+
+    def count_hits_many(self, intervals, bool same_strand=False,
+                        float overlap=0.0, bool sorted=False):
+        """
+        :Signature: `IntervalFile.count_hits_many(intervals, same_strand=False, overlap=0.0, sorted=False)`
+
+        Like :meth:`count_hits`, but for many query intervals at once.
+        Returns an `array.array` with the number of hits for each query.
+
+        See :meth:`all_hits_many` for the supported inputs and `sorted`.
+
+        >>> fn = pybedtools.example_filename('a.bed')
+        >>> intervalfile = pybedtools.IntervalFile(fn)
+        >>> queries = [pybedtools.Interval('chr1', 1, 120),
+        ...            pybedtools.Interval('chr1', 920, 1000)]
+        >>> list(intervalfile.count_hits_many(queries))
+        [2, 1]
+
+        """
+        return self._hits_many(intervals, same_strand, overlap, sorted, 2)
+
     def rewind(self):
         """
         Jump to the beginning of the file.
@@ -911,6 +2682,9 @@ cdef class IntervalFile:
         cdef vector[BED] vec_b
         self.loadIntoMap()
 
+        if self._index is not None:
+            return self._index_hits(interval._bed, same_strand, overlap)
+
         if same_strand == False:
             vec_b = self.intervalFile_ptr.FindOverlapsPerBin(deref(interval._bed), overlap)
             try:
@@ -956,6 +2730,10 @@ cdef class IntervalFile:
         found = 0
         self.loadIntoMap()
 
+        if self._index is not None:
+            return self._index.query(interval._bed, same_strand, overlap, 1,
+                                     NULL)
+
         if same_strand == False:
             found = self.intervalFile_ptr.FindAnyOverlapsPerBin(deref(interval._bed), overlap)
         else:
@@ -993,7 +2771,211 @@ cdef class IntervalFile:
         """
         self.loadIntoMap()
 
+        if self._index is not None:
+            return self._index.query(interval._bed, same_strand, overlap, 2,
+                                     NULL)
+
         if same_strand == False:
             return self.intervalFile_ptr.CountOverlapsPerBin(deref(interval._bed), overlap)
         else:
             return self.intervalFile_ptr.CountOverlapsPerBin(deref(interval._bed), same_strand, overlap)
+
+
+# Bookkeeping for each feature of the chromosome being swept by
+# _OverlapSweep.
+cdef struct _SweepFeature:
+    CHRPOS start
+    CHRPOS end
+    BIN bin
+    int level
+    _offset_t rank
+    BED *bed
+
+
+cdef inline int _bin_level(BIN b):
+    cdef int i
+    for i in range(_binLevels):
+        if b >= _binOffsetsExtended[i]:
+            return i
+    return _binLevels - 1
+
+
+cdef class _OverlapSweep:
+    """
+    Answers overlap queries, sorted by chromosome and start, by sweeping
+    across the in-memory features of an IntervalFile.
+
+    Hits are the same, in the same order, as BedFile::FindOverlapsPerBin()
+    and friends: a feature is only considered if its bin is one the bin
+    search would visit (which matters for book-ended features), and hits are
+    ordered by bin level, then bin, then position in the file.
+    """
+    cdef IntervalFile ivf
+    cdef bint started
+    cdef string chrom
+    cdef CHRPOS last_start
+    cdef set seen
+    cdef vector[_SweepFeature] features
+    cdef size_t next_feature
+    cdef vector[size_t] active
+
+    def __init__(self, IntervalFile ivf):
+        self.ivf = ivf
+        self.started = False
+        self.seen = set()
+
+    cdef _load(self, string chrom):
+        cdef masterBedMap.iterator it
+        cdef binsToBeds.iterator bit
+        cdef bedVector *vec
+        cdef vector[_SweepFeature] unsorted
+        cdef vector[pair[CHRPOS, size_t]] order
+        cdef _SweepFeature f
+        cdef size_t k, t = 0, n
+
+        self.features.clear()
+        self.active.clear()
+        self.next_feature = 0
+        it = self.ivf.intervalFile_ptr.bedMap.find(chrom)
+        if it == self.ivf.intervalFile_ptr.bedMap.end():
+            return
+
+        n = 0
+        bit = deref(it).second.begin()
+        while bit != deref(it).second.end():
+            n += deref(bit).second.size()
+            inc(bit)
+
+        # The map is ordered by bin, so within a level the traversal order
+        # is the order the bin search visits features in.
+        bit = deref(it).second.begin()
+        while bit != deref(it).second.end():
+            vec = &deref(bit).second
+            for k in range(vec.size()):
+                f.bed = &deref(vec)[k]
+                f.start = f.bed.start
+                f.end = f.bed.end
+                f.bin = deref(bit).first
+                f.level = _bin_level(f.bin)
+                f.rank = f.level * n + t
+                t += 1
+                order.push_back(pair[CHRPOS, size_t](f.start, unsorted.size()))
+                unsorted.push_back(f)
+            inc(bit)
+
+        cpp_sort(order.begin(), order.end())
+        self.features.reserve(unsorted.size())
+        for k in range(order.size()):
+            self.features.push_back(unsorted[order[k].second])
+
+    @cython.cdivision(True)
+    cdef int query(self, BED *q, bint same_strand, float overlapFraction,
+                   int mode, vector[BED *] *hits) except -1:
+        """
+        Like IntervalIndex.query(), but `hits` receives pointers to the hits.
+        Returns -2 if the query has to be answered by BedFile instead.
+        """
+        cdef size_t i, j
+        cdef _SweepFeature *f
+        cdef int count = 0, maxStart, minEnd, overlap, shift
+        cdef float size, ofrac
+        cdef vector[_index_key] found
+
+        if not self.started or q.chrom != self.chrom:
+            chrom = <bytes>q.chrom
+            if chrom in self.seen:
+                raise ValueError(
+                    "Queries are not sorted: %s appears again after other "
+                    "chromosomes" % _pystr(q.chrom))
+            self.seen.add(chrom)
+            self.chrom = q.chrom
+            self.started = True
+            self._load(q.chrom)
+        elif q.start < self.last_start:
+            raise ValueError(
+                "Queries are not sorted: %s:%s comes after %s:%s"
+                % (_pystr(q.chrom), q.start, _pystr(q.chrom),
+                   self.last_start))
+        self.last_start = q.start
+
+        # For zero-length queries at position 0 the bin search wraps around
+        # (end - 1 underflows); leave those to BedFile.
+        if q.end == 0:
+            return -2
+
+        while (self.next_feature < self.features.size()
+               and self.features[self.next_feature].start <= q.end):
+            self.active.push_back(self.next_feature)
+            self.next_feature += 1
+
+        # Features ending before this query starts can't be hits for this
+        # or any later query.
+        j = 0
+        for i in range(self.active.size()):
+            if self.features[self.active[i]].end >= q.start:
+                self.active[j] = self.active[i]
+                j += 1
+        self.active.resize(j)
+
+        size = <float>q.end - q.start
+        for i in range(self.active.size()):
+            f = &self.features[self.active[i]]
+            if f.start > q.end:
+                continue
+            if same_strand and q.strand != f.bed.strand:
+                continue
+            shift = _binFirstShift + _binNextShift * f.level
+            if (f.bin < <BIN>((<unsigned long long>q.start) >> shift)
+                    + _binOffsetsExtended[f.level]
+                    or f.bin > <BIN>((<unsigned long long><CHRPOS>(q.end - 1))
+                                     >> shift)
+                    + _binOffsetsExtended[f.level]):
+                continue
+            maxStart = max(q.start, f.start)
+            minEnd = min(q.end, f.end)
+            overlap = minEnd - maxStart
+            ofrac = overlap / size
+            if (ofrac >= overlapFraction) or ((size == 0) and (overlap == 0)):
+                if mode == 1:
+                    return 1
+                if mode == 0:
+                    found.push_back(
+                        _index_key(f.rank, i))
+                count += 1
+
+        if mode == 0:
+            cpp_sort(found.begin(), found.end())
+            for i in range(found.size()):
+                hits.push_back(self.features[self.active[found[i].second]].bed)
+        return count
+
+
+cdef struct _SortItem:
+    long long key
+    size_t index
+
+
+cdef bint _sort_item_lt(const _SortItem &a, const _SortItem &b):
+    return a.key < b.key
+
+
+def _std_sort_order(keys):
+    """
+    Returns the indices of `keys` (a sequence of integers) in the order
+    std::sort() puts them in.
+
+    std::sort() is not stable, so BEDTools programs that sort with it leave
+    features with equal keys in an order that depends on the algorithm; for
+    identical output the native engine (see pybedtools.native) sorts with
+    the same algorithm.
+    """
+    cdef vector[_SortItem] items
+    cdef _SortItem item
+    cdef size_t i
+    items.reserve(len(keys))
+    for i, key in enumerate(keys):
+        item.key = key
+        item.index = i
+        items.push_back(item)
+    cpp_sort(items.begin(), items.end(), _sort_item_lt)
+    return [items[i].index for i in range(items.size())]
@@ -244,7 +244,7 @@ cpdef gff2bed(Interval feature, name_field=None):
     else:
         try:
             if isinstance(name_field, basestring):
-                name = feature.attrs[name_field]
+                name = feature._attr(name_field)
             if isinstance(name_field, int):
                 name = feature[name_field]
         except (NameError, KeyError):
@@ -3,9 +3,152 @@ Provides access to example files and keeps track of all temp files created
 during a Python session.
 """
 import os
+import weakref
+from collections import OrderedDict
+
+from . import settings
 
 TEMPFILES = []
 
+# Tempfiles that BedTools can take ownership of, mapped to weak references to
+# the live BedTools using them (keyed by id, since BedTools aren't
+# hashable).  When the last of them is garbage-collected the file is deleted
+# (with settings.tempfile_refcount), or else moved to _unused, oldest first,
+# to be deleted when settings.tempfile_quota is exceeded.
+_owners = {}
+_unused = OrderedDict()
+
+# Size of each tempfile when it was last measured -- when a BedTool takes it
+# over and when the last one lets it go -- and their total, so that checking
+# the quota doesn't stat every tempfile.
+_sizes = {}
+_held = 0
+
+# Tempfiles are only deleted by the process that created them, not by worker
+# processes that were given copies of the BedTools using them.
+_creator = {}
+_stats = {'deleted': 0, 'bytes_deleted': 0}
+
+
+def register_tempfile(fn):
+    """
+    Registers the new tempfile `fn`, to be deleted by
+    :func:`pybedtools.cleanup` or, once BedTools have used it and none of
+    them remain, according to `settings.tempfile_refcount` and
+    `settings.tempfile_quota`.
+    """
+    TEMPFILES.append(fn)
+    _owners[fn] = {}
+    _creator[fn] = os.getpid()
+    _measure(fn)
+    if settings.tempfile_quota is not None:
+        _enforce_quota()
+
+
+def _measure(fn):
+    """
+    Updates the recorded size of tempfile `fn` and the running total.
+    """
+    global _held
+    try:
+        size = os.path.getsize(fn)
+    except OSError:
+        size = 0
+    _held += size - _sizes.get(fn, 0)
+    _sizes[fn] = size
+
+
+def track(fn, bedtool):
+    """
+    Records that `bedtool` uses `fn`, if it is a registered tempfile.
+    """
+    try:
+        owners = _owners[fn]
+    except (KeyError, TypeError):
+        return
+    if _creator.get(fn) != os.getpid():
+        return
+    _unused.pop(fn, None)
+    _measure(fn)
+    ref = weakref.ref(bedtool, lambda ref: _release(fn, ref))
+    owners[id(ref)] = ref
+
+
+def _release(fn, ref):
+    try:
+        owners = _owners[fn]
+    except (KeyError, TypeError):
+        # interpreter shutdown, or the file is already gone
+        return
+    owners.pop(id(ref), None)
+    if owners:
+        return
+    _measure(fn)
+    if settings.tempfile_refcount:
+        _delete(fn)
+    else:
+        _unused[fn] = None
+        if settings.tempfile_quota is not None:
+            _enforce_quota()
+
+
+def _delete(fn):
+    global _held
+    _owners.pop(fn, None)
+    _unused.pop(fn, None)
+    _creator.pop(fn, None)
+    if settings.KEEP_TEMPFILES:
+        return
+    _held -= _sizes.pop(fn, 0)
+    try:
+        size = os.path.getsize(fn)
+        os.unlink(fn)
+    except OSError:
+        return
+    try:
+        TEMPFILES.remove(fn)
+    except ValueError:
+        pass
+    _stats['deleted'] += 1
+    _stats['bytes_deleted'] += size
+
+
+def _bytes_held():
+    total = 0
+    for fn in TEMPFILES:
+        try:
+            total += os.path.getsize(fn)
+        except OSError:
+            pass
+    return total
+
+
+def _enforce_quota():
+    """
+    Deletes unused tempfiles, least recently used first, until the tempfiles
+    fit in settings.tempfile_quota bytes (or there are no unused ones left).
+    """
+    while _held > settings.tempfile_quota and _unused:
+        _delete(next(iter(_unused)))
+
+
+def tempfile_info():
+    """
+    Returns a dict describing the tempfiles of this session: the number of
+    `files` and the `bytes` they hold; how many of them are `in_use` by live
+    BedTools and how many are `unused`; and how many files (and bytes) have
+    been `deleted` because they were no longer used.
+    """
+    existing = [fn for fn in TEMPFILES if os.path.exists(fn)]
+    return {
+        'files': len(existing),
+        'bytes': _bytes_held(),
+        'in_use': sum(1 for fn in existing if _owners.get(fn)),
+        'unused': sum(1 for fn in _unused if os.path.exists(fn)),
+        'deleted': _stats['deleted'],
+        'bytes_deleted': _stats['bytes_deleted'],
+    }
+
 
 def data_dir():
     """
@@ -9,6 +9,7 @@ import string
 import glob
 import struct
 import atexit
+import weakref
 import six
 import pysam
 from six.moves import urllib
@@ -21,7 +22,18 @@ from .cbedtools import create_interval_from_list
 
 BUFSIZE = 1
 
+# BedTools by tag, for find_tagged().  With settings.tempfile_refcount or
+# settings.tempfile_quota, BedTools are tagged in _weak_tags instead, so that
+# they (and their tempfiles) can be garbage-collected.
 _tags = {}
+_weak_tags = weakref.WeakValueDictionary()
+
+
+def _add_tag(tag, bedtool):
+    if settings.tempfile_refcount or settings.tempfile_quota is not None:
+        _weak_tags[tag] = bedtool
+    else:
+        _tags[tag] = bedtool
 
 
 def set_bedtools_path(path=""):
@@ -96,6 +108,20 @@ def _check_for_bedtools(program_to_check='intersectBed', force_check=False):
                               "it's on the path. %s" % add_msg)
 
 
+def _find_executable(cmd):
+    """
+    True if `cmd` is the path of an executable file, or the name of one on
+    the PATH.
+    """
+    if os.path.dirname(cmd):
+        return os.path.isfile(cmd) and os.access(cmd, os.X_OK)
+    for path in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        fn = os.path.join(path, cmd)
+        if os.path.isfile(fn) and os.access(fn, os.X_OK):
+            return True
+    return False
+
+
 def _check_for_R():
     try:
         p = subprocess.Popen(
@@ -170,7 +196,7 @@ def find_tagged(tag):
     Returns the bedtool object with tagged with *tag*.  Useful for tracking
     down bedtools you made previously.
     """
-    for key, item in _tags.items():
+    for key, item in list(_tags.items()) + list(_weak_tags.items()):
         try:
             if item._tag == tag:
                 return item
@@ -254,6 +280,98 @@ def _version_2_15_plus_names(prog_name):
     return [os.path.join(settings._bedtools_path, 'bedtools'), prog_name]
 
 
+class PipeOutput(object):
+    """
+    The stdout of a running BEDTools process, as returned by call_bedtools()
+    when there is no output file.
+
+    Iterating yields the lines of output (decoded to str unless *decode* is
+    False).  As long as nothing has been read yet, the pipe itself can
+    instead be handed to the next BEDTools process with take_pipe(), so that
+    chained streaming calls like::
+
+        a.intersect(b, stream=True).merge(stream=True).saveas()
+
+    are connected by OS pipes and the data never pass through Python.
+    """
+    def __init__(self, process, cmds, decode=True, upstream=None):
+        self.process = process
+        self.cmds = cmds
+        self.decode = decode
+
+        # PipeOutput of the process feeding this one's stdin, if any
+        self.upstream = upstream
+        self._lines = None
+        self._waited = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._lines is None:
+            if self.process.stdout is None:
+                raise ValueError(
+                    'Output of "%s" has already been sent to another process'
+                    % subprocess.list2cmdline(self.cmds))
+            self._lines = iter(self.process.stdout)
+        if self._waited:
+            raise StopIteration
+        try:
+            line = next(self._lines)
+        except StopIteration:
+            # reap the processes, and report any that failed
+            self.wait()
+            raise
+        if self.decode:
+            return line.decode('UTF-8')
+        return line
+
+    next = __next__
+
+    @property
+    def started(self):
+        """
+        True once lines have been read from the pipe.
+        """
+        return self._lines is not None
+
+    def take_pipe(self):
+        """
+        Returns the unread stdout pipe, which the caller is then responsible
+        for closing, or None if reading has already started.
+        """
+        if self._lines is not None or self.process.stdout is None:
+            return None
+        pipe = self.process.stdout
+        self.process.stdout = None
+        return pipe
+
+    def close(self):
+        if self.process.stdout is not None:
+            self.process.stdout.close()
+
+    def wait(self):
+        """
+        Waits for this process and the processes feeding it to exit, raising
+        BEDToolsError if any of them failed.  Should only be called once the
+        output has been read or taken.
+        """
+        if self._waited:
+            return
+        self._waited = True
+        if self.upstream is not None:
+            self.upstream.wait()
+        self.close()
+        stderr = self.process.communicate()[1]
+        # A negative return code means the process was killed by a signal --
+        # typically SIGPIPE because a downstream process didn't need all of
+        # its output -- which is not an error.
+        if self.process.returncode > 0:
+            if isinstance(stderr, bytes):
+                stderr = stderr.decode('UTF_8')
+            raise BEDToolsError(subprocess.list2cmdline(self.cmds), stderr)
+
+
 def call_bedtools(cmds, tmpfn=None, stdin=None, check_stderr=None, decode_output=True, encode_input=True):
     """
     Use subprocess.Popen to call BEDTools and catch any errors.
@@ -273,10 +391,21 @@ def call_bedtools(cmds, tmpfn=None, stdin=None, check_stderr=None, decode_output
 
     *decode_output* should be set to False when you are iterating over a BAM
     file, where the data represent binary rather than text data.
+
+    If *stdin* is the unread PipeOutput of an earlier call, its pipe is
+    connected directly to this process's stdin.  If *tmpfn* is None, the
+    output is returned as a PipeOutput.
     """
     input_is_stream = stdin is not None
     output_is_stream = tmpfn is None
 
+    pipe = None
+    upstream = None
+    if isinstance(stdin, PipeOutput):
+        pipe = stdin.take_pipe()
+        if pipe is not None:
+            upstream = stdin
+
     _orig_cmds = cmds[:]
     cmds = []
     cmds.extend(_version_2_15_plus_names(_orig_cmds[0]))
@@ -293,22 +422,25 @@ def call_bedtools(cmds, tmpfn=None, stdin=None, check_stderr=None, decode_output
             p = subprocess.Popen(cmds,
                                  stdout=subprocess.PIPE,
                                  stderr=subprocess.PIPE,
-                                 stdin=subprocess.PIPE,
+                                 stdin=(pipe if pipe is not None
+                                        else subprocess.PIPE),
                                  bufsize=BUFSIZE)
-            if encode_input:
-                for line in stdin:
-                    p.stdin.write(line.encode())
+            if pipe is not None:
+                # The new process has its own copy of the pipe
+                pipe.close()
             else:
-                for line in stdin:
-                    p.stdin.write(line)
+                if encode_input:
+                    for line in stdin:
+                        p.stdin.write(line.encode())
+                else:
+                    for line in stdin:
+                        p.stdin.write(line)
 
-            # This is important to prevent deadlocks
-            p.stdin.close()
+                # This is important to prevent deadlocks
+                p.stdin.close()
 
-            if decode_output:
-                output = (i.decode('UTF-8') for i in p.stdout)
-            else:
-                output = (i for i in p.stdout)
+            output = PipeOutput(p, cmds, decode=decode_output,
+                                upstream=upstream)
 
             stderr = None
 
@@ -322,9 +454,14 @@ def call_bedtools(cmds, tmpfn=None, stdin=None, check_stderr=None, decode_output
             p = subprocess.Popen(cmds,
                                  stdout=outfile,
                                  stderr=subprocess.PIPE,
-                                 stdin=subprocess.PIPE,
+                                 stdin=(pipe if pipe is not None
+                                        else subprocess.PIPE),
                                  bufsize=BUFSIZE)
-            if hasattr(stdin, 'read'):
+            if pipe is not None:
+                pipe.close()
+                stdout, stderr = p.communicate()
+                upstream.wait()
+            elif hasattr(stdin, 'read'):
                 stdout, stderr = p.communicate(stdin.read())
             else:
                 for item in stdin:
@@ -344,10 +481,7 @@ def call_bedtools(cmds, tmpfn=None, stdin=None, check_stderr=None, decode_output
                                  stdout=subprocess.PIPE,
                                  stderr=subprocess.PIPE,
                                  bufsize=BUFSIZE)
-            if decode_output:
-                output = (i.decode('UTF-8') for i in p.stdout)
-            else:
-                output = (i for i in p.stdout)
+            output = PipeOutput(p, cmds, decode=decode_output)
             stderr = None
 
         # file-to-file
@@ -0,0 +1,313 @@
+"""
+Lazy evaluation of chained BedTool operations.
+
+:meth:`BedTool.lazy` returns a :class:`LazyBedTool`, which records calls to
+BedTool methods instead of running them.  When the result is needed -- when
+iterating, or calling `len()`, `str()`, :meth:`LazyBedTool.saveas` or
+:meth:`LazyBedTool.compute` -- the recorded operations are first rewritten:
+
+* filters are moved ahead of sorts and of intersections that only select
+  features (`u=True` or `v=True`), so that fewer features are sorted or
+  intersected;
+
+* sorts of data that are already sorted, and merges of data that are already
+  merged, are dropped;
+
+* intersections of two inputs that are known to be sorted use
+  `sorted=True`, the memory-efficient "chromsweep" algorithm of BEDTools;
+
+and are then run, with the output of each BEDTools program streamed directly
+into the next one.
+
+>>> import pybedtools
+>>> a = pybedtools.example_bedtool('a.bed')
+>>> b = pybedtools.example_bedtool('b.bed')
+>>> x = a.lazy().sort().merge().sort()\\
+...     .intersect(b.lazy().sort(), u=True)\\
+...     .filter(lambda f: f.start > 100)
+>>> print(x.explain()) #doctest: +ELLIPSIS
+<BedTool(.../a.bed)>
+    .sort()
+    .merge()
+    .filter(<lambda>)
+    .intersect(<BedTool(.../b.bed)>.sort(), sorted=True, u=True)
+>>> print(x) #doctest: +NORMALIZE_WHITESPACE
+chr1    900 950
+<BLANKLINE>
+
+Methods that aren't recorded (for example, :meth:`BedTool.count`) run the
+recorded operations and are then called on the result.
+"""
+
+from __future__ import print_function, division
+import six
+import pybedtools
+
+
+# Methods of BedTool that are recorded; those that wrap BEDTools programs
+# stream their output when followed by another step.
+_bedtools_methods = set([
+    'sort', 'merge', 'intersect', 'subtract', 'window', 'closest', 'slop',
+    'flank', 'shift', 'complement', 'coverage', 'map', 'annotate', 'cluster',
+    'groupby'])
+_python_methods = set(['filter', 'each', 'cut'])
+
+# Arguments that don't change the result of an operation
+_neutral_args = set(['engine'])
+
+# Intersection arguments whose output starts with the fields of `a`,
+# unchanged and in input order
+_intersect_keeps_a = set(['u', 'v', 'c', 'wa', 'wb', 'wo', 'wao', 'loj'])
+
+
+class _Properties(object):
+    """
+    What is known about the features output by a step.
+
+    `sorted`: sorted by chromosome and then start, as by BedTool.sort()
+    `merged`: no two features overlap or are book-ended
+    `bed3`: only chrom, start and end fields
+    """
+    def __init__(self, sorted=False, merged=False, bed3=False):
+        self.sorted = sorted
+        self.merged = merged
+        self.bed3 = bed3
+
+    def copy(self):
+        return _Properties(self.sorted, self.merged, self.bed3)
+
+
+class _Step(object):
+    """
+    A recorded call, `method(*args, **kwargs)`.
+    """
+    def __init__(self, method, args, kwargs):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+
+    def flags(self):
+        """
+        Names of the arguments that change the result of the call.
+        """
+        return set(k for k, v in self.kwargs.items()
+                   if k not in _neutral_args and v is not False
+                   and v is not None)
+
+    def selects_rows(self):
+        """
+        True if the step only drops some of its input features, leaving the
+        others unchanged and in order -- so a filter may be applied first.
+        """
+        if self.method == 'intersect':
+            return bool(self.flags() & set(['u', 'v'])) and \
+                not self.flags() & (_intersect_keeps_a - set(['u', 'v']))
+        if self.method == 'subtract':
+            return 'A' in self.flags()
+        return self.method in ('sort', 'filter')
+
+    def __repr__(self):
+        args = [_describe(a) for a in self.args]
+        args.extend('%s=%s' % (k, _describe(v))
+                    for k, v in sorted(self.kwargs.items()))
+        return '.%s(%s)' % (self.method, ', '.join(args))
+
+
+def _describe(obj):
+    if isinstance(obj, LazyBedTool):
+        return obj.explain(oneline=True)
+    if callable(obj) and hasattr(obj, '__name__'):
+        return obj.__name__
+    return repr(obj)
+
+
+def _properties(step, props):
+    """
+    Properties of the output of `step`, given the properties `props` of its
+    input.
+    """
+    flags = step.flags()
+    if step.method == 'sort':
+        # sorting by size, or in the chromosome order of a genome file,
+        # doesn't give the order of BedTool.sort()
+        if flags:
+            return _Properties(merged=props.merged, bed3=props.bed3)
+        return _Properties(True, props.merged, props.bed3)
+    if step.method == 'merge':
+        # BEDTools requires sorted input, so the output is sorted too.  A
+        # negative `d` leaves features that overlap by less than -d unmerged.
+        merged = not flags & set(['s', 'S']) and \
+            int(step.kwargs.get('d') or 0) >= 0
+        return _Properties(True, merged, not flags & set(['s', 'S', 'c']))
+    if step.method == 'filter' or step.selects_rows():
+        return props.copy()
+    if step.method == 'intersect' and flags & _intersect_keeps_a:
+        return _Properties(sorted=props.sorted)
+    return _Properties()
+
+
+class LazyBedTool(object):
+    """
+    A chain of BedTool operations that runs only when its result is needed.
+
+    Create one with :meth:`BedTool.lazy`.  Recorded methods return a new
+    LazyBedTool; use :meth:`compute` to get the resulting
+    :class:`BedTool`, and :meth:`explain` to see the operations that will be
+    run.
+    """
+    def __init__(self, source, parent=None, step=None, sorted=False,
+                 merged=False, bed3=False):
+        self.source = source
+        self.parent = parent
+        self.step = step
+        self._result = None
+        if parent is None:
+            self.properties = _Properties(sorted, merged, bed3)
+        else:
+            self.properties = _properties(step, parent.properties)
+
+    @property
+    def sorted(self):
+        return self.properties.sorted
+
+    @property
+    def merged(self):
+        return self.properties.merged
+
+    @property
+    def bed3(self):
+        return self.properties.bed3
+
+    def _record(self, method):
+        def record(*args, **kwargs):
+            return LazyBedTool(self.source, self, _Step(method, args, kwargs))
+        record.__name__ = method
+        return record
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if attr in _bedtools_methods or attr in _python_methods:
+            return self._record(attr)
+        return getattr(self.compute(), attr)
+
+    def _steps(self):
+        steps = []
+        node = self
+        while node.parent is not None:
+            steps.append(node.step)
+            node = node.parent
+        return node.properties, steps[::-1]
+
+    def plan(self):
+        """
+        Returns the properties of the source and the optimized list of steps
+        that will be run.
+        """
+        source_props, steps = self._steps()
+
+        # Move filters ahead of steps that only select rows.
+        steps = list(steps)
+        for i in range(len(steps)):
+            j = i
+            while steps[j].method == 'filter' and j > 0 \
+                    and steps[j - 1].selects_rows() \
+                    and steps[j - 1].method != 'filter':
+                steps[j - 1], steps[j] = steps[j], steps[j - 1]
+                j -= 1
+
+        # Drop redundant steps and use the chromsweep algorithm where
+        # possible.
+        planned = []
+        props = source_props
+        for step in steps:
+            flags = step.flags()
+            if step.method == 'sort' and props.sorted and not flags:
+                continue
+            if step.method == 'merge' and not flags and props.sorted \
+                    and props.merged and props.bed3:
+                continue
+            if step.method == 'intersect' and 'sorted' not in step.kwargs \
+                    and props.sorted:
+                other_props = _other_properties(step)
+                if other_props is not None and other_props.sorted:
+                    kwargs = dict(step.kwargs)
+                    kwargs['sorted'] = True
+                    step = _Step(step.method, step.args, kwargs)
+            planned.append(step)
+            props = _properties(step, props)
+        return source_props, planned
+
+    def explain(self, oneline=False):
+        """
+        Describes the operations that will be run, after optimization.
+        """
+        sep = '' if oneline else '\n    '
+        return sep.join([repr(self.source)] +
+                        [repr(step) for step in self.plan()[1]])
+
+    def compute(self):
+        """
+        Runs the recorded operations and returns the resulting BedTool.
+
+        The result is saved, so calling compute() again, or using this
+        LazyBedTool as an input to another one, doesn't run them again.
+        """
+        if self._result is not None:
+            return self._result
+        steps = self.plan()[1]
+        result = self.source
+        for i, step in enumerate(steps):
+            args = [_computed(a) for a in step.args]
+            kwargs = dict((k, _computed(v)) for k, v in step.kwargs.items())
+            if i < len(steps) - 1:
+                if step.method in _bedtools_methods \
+                        or step.method == 'cut':
+                    kwargs.setdefault('stream', True)
+            result = getattr(result, step.method)(*args, **kwargs)
+        # A streaming result (from filter() or each(), say) can only be
+        # read once, so save it before keeping it
+        if isinstance(result, pybedtools.BedTool) \
+                and not isinstance(result.fn, six.string_types):
+            result = result.saveas()
+        self._result = result
+        return result
+
+    def saveas(self, *args, **kwargs):
+        """
+        Runs the recorded operations and saves the result; see
+        :meth:`BedTool.saveas`.
+        """
+        return self.compute().saveas(*args, **kwargs)
+
+    def __iter__(self):
+        return iter(self.compute())
+
+    def __len__(self):
+        return len(self.compute())
+
+    def __str__(self):
+        return str(self.compute())
+
+    def __repr__(self):
+        return '<LazyBedTool(%s)>' % self.explain(oneline=True)
+
+
+def _other_properties(step):
+    """
+    Properties of the first argument of `step` (the `b` of intersect, for
+    example), or None if it isn't a LazyBedTool.
+    """
+    if step.args:
+        other = step.args[0]
+    else:
+        other = step.kwargs.get('b')
+    if isinstance(other, LazyBedTool):
+        return other.properties
+    return None
+
+
+def _computed(obj):
+    if isinstance(obj, LazyBedTool):
+        return obj.compute()
+    return obj
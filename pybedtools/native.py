@@ -0,0 +1,593 @@
+"""
+In-process implementations of some BEDTools programs.
+
+Each BedTool method wrapping a BEDTools program normally writes its inputs to
+files, runs the program in a subprocess and parses its text output.  For
+many small operations the subprocess dominates the run time, so the methods
+listed here can instead be run in-process with ``engine='native'`` (or for
+all calls, with ``pybedtools.settings.engine = 'native'``).
+
+The native versions are built on :class:`IntervalFile` and produce the same
+output as the BEDTools programs for the arguments they support.  Each
+function accepts the keyword arguments of the corresponding BedTool method
+and returns a new BedTool, or `NotImplemented` if it was given an argument
+it doesn't support, in which case the BEDTools program is called as usual.
+
+>>> import pybedtools
+>>> a = pybedtools.example_bedtool('a.bed')
+>>> b = pybedtools.example_bedtool('b.bed')
+>>> print(a.intersect(b, u=True, engine='native')) #doctest: +NORMALIZE_WHITESPACE
+chr1	100	200	feature2	0	+
+chr1	150	500	feature3	0	-
+chr1	900	950	feature4	0	+
+<BLANKLINE>
+"""
+from __future__ import print_function, division
+from itertools import islice
+import gzip
+import heapq
+import os
+import six
+
+from .cbedtools import (IntervalFile, create_interval_from_list,
+                        _std_sort_order)
+from . import helpers
+
+
+# Number of features of `a` that are queried against `b` at a time
+_chunksize = 100000
+
+# Number of features sorted in memory at a time; larger inputs are sorted in
+# runs of this size, saved to tempfiles and merged.
+_sort_chunksize = 2000000
+
+# Arguments, per program, that the native version understands.  Anything
+# else sends the call to BEDTools.  ("bed" only affects BAM input, which is
+# always sent to BEDTools, and "nonamecheck" only silences a warning.)
+_intersect_args = set([
+    'a', 'b', 'u', 'v', 'c', 'wa', 'wb', 'wo', 'wao', 'loj', 'f', 'F', 'r',
+    'e', 's', 'S', 'sorted', 'bed', 'nonamecheck', 'stream', 'output'])
+_sort_args = set([
+    'i', 'sizeA', 'sizeD', 'chrThenSizeA', 'chrThenSizeD', 'header', 'stream',
+    'output'])
+_merge_args = set(['i', 's', 'd', 'c', 'o', 'delim', 'stream', 'output'])
+_complement_args = set(['i', 'g', 'genome', 'stream', 'output'])
+
+# Operations supported for merge's `o` argument
+_merge_ops = set([
+    'sum', 'min', 'max', 'mean', 'count', 'count_distinct', 'distinct',
+    'collapse', 'first', 'last'])
+
+
+def _unsupported(kwargs, supported):
+    """
+    True if any argument in `kwargs` is not in `supported`; False-valued
+    flags are ignored, as they are not passed to BEDTools either.
+    """
+    for key, value in kwargs.items():
+        if key not in supported and value is not False:
+            return True
+    return False
+
+
+def _as_bedtool(obj):
+    """
+    Converts the value of an `a`-style argument to a BedTool, or returns None
+    if it is something the native engine can't read.
+
+    Only BED and GFF files are supported: BEDTools takes the extent of a VCF
+    feature from its REF allele, and of a SAM feature from its CIGAR string,
+    while an Interval is always 1bp long.  Features from streams are used
+    as they are.
+    """
+    from .bedtool import BedTool
+    if not isinstance(obj, BedTool):
+        obj = BedTool(obj)
+    if obj._isbam or obj.remote:
+        return None
+    if isinstance(obj.fn, six.string_types):
+        if helpers.isBAM(obj.fn) or obj.file_type not in ('bed', 'gff',
+                                                           'empty'):
+            return None
+    return obj
+
+
+def _as_file_bedtool(obj):
+    """
+    Converts the value of a `b`-style argument to a BedTool for a file that
+    IntervalFile can read (saving streams to a tempfile first), or returns
+    None if it is something the native engine can't read.
+    """
+    from .bedtool import BedTool
+    if isinstance(obj, (list, tuple)) and obj \
+            and isinstance(obj[0], six.string_types):
+        # possibly several filenames, which get their own output columns
+        return None
+    obj = _as_bedtool(obj)
+    if obj is None:
+        return None
+    if not isinstance(obj.fn, six.string_types):
+        obj = obj.saveas()
+    return obj
+
+
+def _null_fields(bt):
+    """
+    Fields printed for a missing feature from `bt`, as BEDTools does for
+    "-wao" and "-loj".
+    """
+    file_type = bt.file_type
+    if file_type == 'empty':
+        return ['.', '-1', '-1']
+    n = bt.field_count(n=1)
+    if file_type == 'gff':
+        fields = ['.', '.', '.', '-1', '-1', '.', '.', '.', '.']
+    elif n == 12:
+        fields = ['.', '-1', '-1', '.', '-1', '.', '-1', '-1', '.', '0', '.',
+                  '.']
+    else:
+        fields = ['.', '-1', '-1', '.', '-1', '.'][:n] + ['.'] * (n - 6)
+    return fields
+
+
+def _output(bedtool, lines, kwargs):
+    """
+    Wraps `lines` of output in a new BedTool, either as a stream or saved to
+    a file, according to the `stream` and `output` arguments.
+    """
+    from .bedtool import BedTool
+    if kwargs.get('stream'):
+        return BedTool(lines)
+    fn = kwargs.get('output') or bedtool._tmp()
+    with open(fn, 'w') as fout:
+        fout.writelines(lines)
+    return BedTool(fn)
+
+
+def intersect(bedtool, **kwargs):
+    """
+    Native version of :meth:`BedTool.intersect`.
+
+    Supports a single `b` and the `u`, `v`, `c`, `wa`, `wb`, `wo`, `wao`,
+    `loj`, `f`, `F`, `r`, `e`, `s`, `S` and `sorted` arguments.  As in
+    BEDTools, hits are reported in the order they are found by a binned
+    search of `b`, and zero-length features are treated as spanning the base
+    on either side when looking for overlaps.
+    """
+    if _unsupported(kwargs, _intersect_args) or 'b' not in kwargs:
+        return NotImplemented
+    a = _as_bedtool(kwargs.get('a', bedtool))
+    b = _as_file_bedtool(kwargs['b'])
+    if a is None or b is None:
+        return NotImplemented
+    return _output(bedtool, _intersect_lines(a, b, kwargs), kwargs)
+
+
+def _intersect_lines(a, b_bedtool, kwargs):
+    u = kwargs.get('u', False)
+    v = kwargs.get('v', False)
+    c = kwargs.get('c', False)
+    wo = kwargs.get('wo', False)
+    wao = kwargs.get('wao', False)
+    loj = kwargs.get('loj', False)
+    full_a = kwargs.get('wa', False) or wo or wao or loj
+    write_b = kwargs.get('wb', False) or wo or wao or loj
+    write_overlap = wo or wao
+    nulls = None
+    if wao or loj:
+        nulls = _null_fields(b_bedtool)
+
+    # -f and -F default to 1bp of overlap, as in BEDTools
+    frac_a = float(kwargs.get('f', 1e-9))
+    frac_b = float(kwargs.get('F', 1e-9))
+    reciprocal = kwargs.get('r', False)
+    either = kwargs.get('e', False)
+    if reciprocal:
+        frac_b = frac_a
+    same_strand = kwargs.get('s', False)
+    diff_strand = kwargs.get('S', False)
+
+    b = IntervalFile(b_bedtool.fn)
+    a_iter = iter(a)
+    while True:
+        features = list(islice(a_iter, _chunksize))
+        if not features:
+            break
+        queries = []
+        for i in features:
+            # widened so that the binned search also finds book-ended and
+            # zero-length features, which are then checked below.  Every
+            # query is widened by the same amount, enough for a zero-length
+            # `i`, so that sorted input gives sorted queries.
+            queries.append((i.chrom, max(i.start - 2, 0), i.end + 2))
+        offsets, hits = b.all_hits_many(
+            queries, sorted=bool(kwargs.get('sorted', False)))
+
+        for j, i in enumerate(features):
+            found = _filter_hits(i, hits[offsets[j]:offsets[j + 1]],
+                                 same_strand, diff_strand, frac_a, frac_b,
+                                 either)
+            for line in _format_hits(i, found, u, v, c, full_a, write_b,
+                                     write_overlap, nulls):
+                yield line
+
+
+def _filter_hits(i, hits, same_strand, diff_strand, frac_a, frac_b, either):
+    """
+    Hits from a binned search that overlap `i` by BEDTools' criteria.
+    """
+    a_start, a_end = i.start, i.end
+    if a_start == a_end:
+        a_start, a_end = a_start - 1, a_end + 1
+    a_len = a_end - a_start
+    a_strand = i.strand
+
+    found = []
+    for h in hits:
+        b_start, b_end = h.start, h.end
+        if b_start == b_end:
+            b_start, b_end = b_start - 1, b_end + 1
+        overlap = min(a_end, b_end) - max(a_start, b_start)
+        if overlap <= 0:
+            continue
+        if same_strand or diff_strand:
+            b_strand = h.strand
+            if a_strand not in ('+', '-') or b_strand not in ('+', '-'):
+                continue
+            if same_strand and a_strand != b_strand:
+                continue
+            if diff_strand and a_strand == b_strand:
+                continue
+        ok_a = overlap / a_len >= frac_a
+        ok_b = overlap / (b_end - b_start) >= frac_b
+        if (ok_a or ok_b) if either else (ok_a and ok_b):
+            found.append(h)
+    return found
+
+
+def _format_hits(i, found, u, v, c, full_a, write_b, write_overlap, nulls):
+    """
+    Output lines for feature `i` of `a` and the features of `b` it overlaps.
+    """
+    if u:
+        if found:
+            yield '\t'.join(i.fields) + '\n'
+        return
+    if v:
+        if not found:
+            yield '\t'.join(i.fields) + '\n'
+        return
+    if c:
+        yield '\t'.join(i.fields + [str(len(found))]) + '\n'
+        return
+
+    if not found:
+        if nulls is not None:
+            fields = i.fields + nulls
+            if write_overlap:
+                fields.append('0')
+            yield '\t'.join(fields) + '\n'
+        return
+
+    for h in found:
+        if full_a:
+            fields = i.fields
+        else:
+            trimmed = create_interval_from_list(list(i.fields))
+            trimmed.start = max(i.start, h.start)
+            trimmed.end = min(i.end, h.end)
+            fields = trimmed.fields
+        if write_b:
+            fields = fields + h.fields
+        if write_overlap:
+            fields = fields + [
+                str(max(min(i.end, h.end) - max(i.start, h.start), 0))]
+        yield '\t'.join(fields) + '\n'
+
+
+def sort(bedtool, **kwargs):
+    """
+    Native version of :meth:`BedTool.sort`.
+
+    Supports the default sort (by chromosome, then start) and the `sizeA`,
+    `sizeD`, `chrThenSizeA`, `chrThenSizeD` and `header` arguments.  Like
+    BEDTools, features with equal keys are left in the order std::sort()
+    puts them in.  Inputs of more than `_sort_chunksize` features are sorted
+    in runs that are saved to tempfiles and merged; across runs, features
+    with equal keys stay in input order.
+    """
+    if _unsupported(kwargs, _sort_args):
+        return NotImplemented
+    modes = [m for m in ('sizeA', 'sizeD', 'chrThenSizeA', 'chrThenSizeD')
+             if kwargs.get(m)]
+    if len(modes) > 1:
+        return NotImplemented
+    mode = modes[0] if modes else None
+    i = _as_bedtool(kwargs.get('i', bedtool))
+    if i is None:
+        return NotImplemented
+
+    lines = _sort_lines(i, mode, bedtool)
+    if kwargs.get('header'):
+        lines = _with_header(i, lines)
+    return _output(bedtool, lines, kwargs)
+
+
+def _with_header(bt, lines):
+    """
+    Header lines at the top of `bt`'s file, followed by `lines`.
+    """
+    if isinstance(bt.fn, six.string_types):
+        if helpers.isGZIP(bt.fn):
+            fin = gzip.open(bt.fn, 'rt')
+        else:
+            fin = open(bt.fn)
+        with fin:
+            for line in fin:
+                if not line.startswith(('#', 'track', 'browser')):
+                    break
+                yield line
+    for line in lines:
+        yield line
+
+
+def _sort_key(mode, chrom, start, end):
+    """
+    Key for merging sorted runs.
+    """
+    if mode is None:
+        return (chrom, start)
+    size = end - start
+    if mode == 'sizeA':
+        return (size,)
+    if mode == 'sizeD':
+        return (-size,)
+    if mode == 'chrThenSizeA':
+        return (chrom, size)
+    return (chrom, -size)
+
+
+def _sort_chunk(features, mode):
+    """
+    Sorts a list of Intervals as BEDTools does.
+
+    BEDTools loads features into per-chromosome lists (chromosomes ordered as
+    strings), sorts each by start and then, for the size-based modes, sorts
+    again by size -- within each chromosome for the "chrThen" modes, or
+    across the concatenated lists otherwise.
+    """
+    by_chrom = {}
+    for f in features:
+        by_chrom.setdefault(f.chrom, []).append(f)
+    ordered = []
+    for chrom in sorted(by_chrom):
+        fs = by_chrom[chrom]
+        fs = [fs[k] for k in _std_sort_order([f.start for f in fs])]
+        if mode in ('chrThenSizeA', 'chrThenSizeD'):
+            sign = 1 if mode == 'chrThenSizeA' else -1
+            fs = [fs[k] for k in _std_sort_order(
+                [sign * (f.end - f.start) for f in fs])]
+        ordered.extend(fs)
+    if mode in ('sizeA', 'sizeD'):
+        sign = 1 if mode == 'sizeA' else -1
+        ordered = [ordered[k] for k in _std_sort_order(
+            [sign * (f.end - f.start) for f in ordered])]
+    return ordered
+
+
+def _sort_lines(bt, mode, bedtool):
+    features = iter(bt)
+    chunk = list(islice(features, _sort_chunksize))
+    runs = []
+    while chunk:
+        chunk = _sort_chunk(chunk, mode)
+        following = list(islice(features, _sort_chunksize))
+        if not runs and not following:
+            # everything fit in memory
+            for f in chunk:
+                yield '\t'.join(f.fields) + '\n'
+            return
+        fn = bedtool._tmp()
+        with open(fn, 'w') as fout:
+            for f in chunk:
+                fout.write('\t'.join(f.fields) + '\n')
+        runs.append(fn)
+        chunk = following
+
+    def keyed(n, fn):
+        from .bedtool import BedTool
+        for k, f in enumerate(BedTool(fn)):
+            yield (_sort_key(mode, f.chrom, f.start, f.end), n, k,
+                   '\t'.join(f.fields) + '\n')
+
+    try:
+        for item in heapq.merge(*[keyed(n, fn) for n, fn in enumerate(runs)]):
+            yield item[-1]
+    finally:
+        for fn in runs:
+            os.unlink(fn)
+
+
+def merge(bedtool, **kwargs):
+    """
+    Native version of :meth:`BedTool.merge`.
+
+    Supports the `s`, `d`, `c`, `o` and `delim` arguments, with the
+    operations in `_merge_ops`.  As with BEDTools, input must be sorted by
+    chromosome and then start; overlapping and book-ended features (or, with
+    `d`, features up to `d` bp apart) are merged.  Numbers computed by `o`
+    are printed with 5 significant digits, as BEDTools does by default.
+    """
+    if _unsupported(kwargs, _merge_args):
+        return NotImplemented
+    columns, ops = _merge_columns(kwargs)
+    if columns is None:
+        return NotImplemented
+    i = _as_bedtool(kwargs.get('i', bedtool))
+    if i is None:
+        return NotImplemented
+    lines = _merge_lines(i, int(kwargs.get('d', 0)),
+                         bool(kwargs.get('s', False)), columns, ops,
+                         kwargs.get('delim', ','))
+    return _output(bedtool, lines, kwargs)
+
+
+def _as_list(value):
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value]
+    return str(value).split(',')
+
+
+def _merge_columns(kwargs):
+    """
+    Parses the `c` and `o` arguments into lists of 0-based column indexes and
+    operation names, or returns (None, None) if they aren't supported.
+    """
+    if 'c' not in kwargs:
+        if 'o' in kwargs:
+            return None, None
+        return [], []
+    columns = [int(c) - 1 for c in _as_list(kwargs['c'])]
+    ops = _as_list(kwargs.get('o', 'sum'))
+    if len(ops) == 1:
+        ops = ops * len(columns)
+    if len(ops) != len(columns) or not set(ops).issubset(_merge_ops):
+        return None, None
+    return columns, ops
+
+
+def _format_number(x):
+    return '%.5g' % x
+
+
+def _apply_op(op, values, delim):
+    if op == 'count':
+        return str(len(values))
+    if op == 'collapse':
+        return delim.join(values)
+    if op == 'distinct':
+        return delim.join(sorted(set(values)))
+    if op == 'count_distinct':
+        return str(len(set(values)))
+    if op == 'first':
+        return values[0]
+    if op == 'last':
+        return values[-1]
+    try:
+        numbers = [float(v) for v in values]
+    except ValueError:
+        raise helpers.BEDToolsError(
+            'mergeBed', 'Non-numeric value in %r for operation "%s"'
+            % (values, op))
+    if op == 'sum':
+        return _format_number(sum(numbers))
+    if op == 'min':
+        return _format_number(min(numbers))
+    if op == 'max':
+        return _format_number(max(numbers))
+    return _format_number(sum(numbers) / len(numbers))
+
+
+def _merge_lines(bt, d, strand_specific, columns, ops, delim):
+    # Clusters still being extended, keyed by strand (or None); each is
+    # [index of first feature, start, end, list of values per column,
+    # strand].
+    clusters = {}
+    done = []
+    chrom = None
+    seen = set()
+    last_start = None
+
+    def report(cluster):
+        n, start, end, values, strand = cluster
+        fields = [chrom, str(start), str(end)]
+        if strand_specific:
+            fields.append(strand)
+        for op, vals in zip(ops, values):
+            fields.append(_apply_op(op, vals, delim))
+        return (n, '\t'.join(fields) + '\n')
+
+    for n, f in enumerate(bt):
+        if f.chrom != chrom:
+            for cluster in clusters.values():
+                done.append(report(cluster))
+            for line in sorted(done):
+                yield line[1]
+            done = []
+            clusters = {}
+            if f.chrom in seen:
+                raise helpers.BEDToolsError(
+                    'mergeBed', 'Input is not sorted by chromosome: %s '
+                    'appears again after other chromosomes' % f.chrom)
+            seen.add(f.chrom)
+            chrom = f.chrom
+        elif f.start < last_start:
+            raise helpers.BEDToolsError(
+                'mergeBed', 'Input is not sorted by start: %s:%s comes after '
+                '%s:%s' % (chrom, f.start, chrom, last_start))
+        last_start = f.start
+
+        key = f.strand if strand_specific else None
+        cluster = clusters.get(key)
+        if cluster is not None and f.start > cluster[2] + d:
+            done.append(report(cluster))
+            cluster = None
+        if cluster is None:
+            cluster = clusters[key] = [n, f.start, f.end,
+                                       [[] for _ in columns], f.strand]
+        elif f.end > cluster[2]:
+            cluster[2] = f.end
+        fields = f.fields
+        for vals, c in zip(cluster[3], columns):
+            vals.append(fields[c])
+
+        # Clusters are reported in the order of their first features, so
+        # hold finished ones back until no earlier cluster is still open.
+        if done:
+            first_open = min(c[0] for c in clusters.values())
+            done.sort()
+            while done and done[0][0] < first_open:
+                yield done.pop(0)[1]
+
+    for cluster in clusters.values():
+        done.append(report(cluster))
+    for line in sorted(done):
+        yield line[1]
+
+
+def complement(bedtool, **kwargs):
+    """
+    Native version of :meth:`BedTool.complement`.
+
+    Reports the regions of each chromosome in the genome file, in the order
+    of that file, that are not covered by any feature.
+    """
+    if _unsupported(kwargs, _complement_args):
+        return NotImplemented
+    i = _as_bedtool(kwargs.get('i', bedtool))
+    if i is None:
+        return NotImplemented
+    kwargs = bedtool.check_genome(**kwargs)
+    return _output(bedtool, _complement_lines(i, kwargs['g']), kwargs)
+
+
+def _complement_lines(bt, genome_fn):
+    chromsizes = []
+    with open(genome_fn) as fin:
+        for line in fin:
+            fields = line.split()
+            if len(fields) >= 2:
+                chromsizes.append((fields[0], int(fields[1])))
+
+    features = {}
+    for f in bt:
+        features.setdefault(f.chrom, []).append((f.start, f.end))
+
+    for chrom, size in chromsizes:
+        pos = 0
+        for start, end in sorted(features.get(chrom, [])):
+            if start > pos:
+                yield '%s\t%d\t%d\n' % (chrom, pos, start)
+            pos = max(pos, end)
+        if pos < size:
+            yield '%s\t%d\t%d\n' % (chrom, pos, size)
@@ -1,6 +1,16 @@
 import sys
+import os
+import math
+import gzip
+import heapq
+import shutil
+import collections
 import multiprocessing
+import tempfile
+import six
+from six.moves import cPickle as pickle
 from . import helpers
+from .cbedtools import Interval, IntervalBatch
 import pybedtools
 
 
@@ -40,11 +50,181 @@ def _parallel_wrap(orig_bedtool, shuffle_kwargs, genome_fn, method,
         return result
 
 
+def _with_seed(i, kwargs, seed):
+    """
+    Returns `kwargs` for `_parallel_wrap`, using iteration `i` as the shuffle
+    seed if `seed` is True.
+    """
+    if not seed:
+        return kwargs
+    kwargs = dict(kwargs)
+    kwargs['shuffle_kwargs'] = dict(kwargs['shuffle_kwargs'], seed=i)
+    return kwargs
+
+
+class _Batched(object):
+    """
+    A list of Intervals returned by a worker, sent as an IntervalBatch.
+    """
+    __slots__ = ('batch',)
+
+    def __init__(self, batch):
+        self.batch = batch
+
+
+def _to_batch(result):
+    """
+    Returns `result`, if it is a list of Intervals, in a form that is sent
+    back from a worker process as a single buffer; see IntervalBatch.
+    """
+    if isinstance(result, list) and result \
+            and all(isinstance(i, Interval) for i in result):
+        return _Batched(IntervalBatch(result))
+    return result
+
+
+def _from_batch(result):
+    """
+    Reverses :func:`_to_batch` on the results received from a worker.
+    """
+    if isinstance(result, _Batched):
+        return list(result.batch)
+    return result
+
+
+def _call_batched(func, args, kwargs):
+    return _to_batch(func(*args, **kwargs))
+
+
+# Inputs of the most recent job run in this (worker) process, so that they
+# are only loaded once per worker: (job file, kwargs for _parallel_wrap)
+_worker_job = (None, None)
+
+
+def _run_chunk(job_fn, start, stop, seed):
+    """
+    Runs iterations `start` to `stop` of the job saved in `job_fn` by
+    WorkerPool.run(), returning a list of the results.
+    """
+    global _worker_job
+    if _worker_job[0] != job_fn:
+        with open(job_fn, 'rb') as fin:
+            _worker_job = (job_fn, pickle.load(fin))
+    kwargs = _worker_job[1]
+    return [_to_batch(_parallel_wrap(**_with_seed(i, kwargs, seed)))
+            for i in range(start, stop)]
+
+
+def _call(task):
+    func, args = task
+    return func(*args)
+
+
+class WorkerPool(object):
+    """
+    Reusable pool of processes for running many iterations of the same job,
+    as done by :func:`parallel_apply`.
+
+    The inputs of a job (the BedTool, method arguments and so on) are pickled
+    once to a file that each worker loads once, instead of being sent with
+    every iteration, and iterations are dispatched in chunks.  Results that
+    are lists of Intervals are sent back as an
+    :class:`pybedtools.cbedtools.IntervalBatch`.
+
+    `processes` is the number of worker processes to start.  Alternatively,
+    pass an existing `executor` -- a `concurrent.futures` executor (such as
+    ProcessPoolExecutor, or one provided by a job scheduler) or
+    a multiprocessing.Pool -- which will be used instead, and not shut down
+    by :meth:`close`.  Workers need to be able to read files written to
+    :func:`pybedtools.get_tempdir`.
+
+    For example, to run two permutation tests with the same workers::
+
+        with WorkerPool(processes=8) as pool:
+            x = list(parallel_apply(a, 'intersect', method_args=(b,),
+                                    genome='hg19', pool=pool))
+            y = list(parallel_apply(a, 'jaccard', method_args=(b,),
+                                    genome='hg19', sort=True, pool=pool))
+    """
+    def __init__(self, processes=None, executor=None):
+        if executor is not None:
+            self.executor = executor
+            self._owned = False
+            self.processes = processes or getattr(
+                executor, '_max_workers', None) or getattr(
+                    executor, '_processes', None) or multiprocessing.cpu_count()
+        else:
+            self.processes = processes or multiprocessing.cpu_count()
+            self.executor = multiprocessing.Pool(self.processes)
+            self._owned = True
+
+    def run(self, kwargs, iterations, seed=False, chunksize=None,
+            ordered=True):
+        """
+        Generator of the results of calling `_parallel_wrap(**kwargs)`
+        `iterations` times, using each iteration's index as the shuffle seed
+        if `seed` is True.
+
+        Iterations are sent to workers `chunksize` at a time (by default,
+        about four chunks per worker).  Results are yielded as each chunk
+        finishes, in order of iteration unless `ordered` is False.
+        """
+        if chunksize is None:
+            chunksize = int(math.ceil(iterations / (4.0 * self.processes)))
+        chunksize = max(1, chunksize)
+
+        fd, job_fn = tempfile.mkstemp(
+            prefix=pybedtools.settings.tempfile_prefix,
+            suffix=pybedtools.settings.tempfile_suffix,
+            dir=pybedtools.get_tempdir())
+        try:
+            with os.fdopen(fd, 'wb') as fout:
+                pickle.dump(kwargs, fout, protocol=pickle.HIGHEST_PROTOCOL)
+            tasks = [(job_fn, start, min(start + chunksize, iterations), seed)
+                     for start in range(0, iterations, chunksize)]
+            for chunk in self._dispatch(_run_chunk, tasks, ordered):
+                for result in chunk:
+                    yield _from_batch(result)
+        finally:
+            os.unlink(job_fn)
+
+    def _dispatch(self, func, tasks, ordered):
+        """
+        Generator of the results of `func(*task)` for each of `tasks`, run
+        by the workers.
+        """
+        if hasattr(self.executor, 'submit'):
+            futures = [self.executor.submit(func, *task) for task in tasks]
+            if not ordered:
+                from concurrent.futures import as_completed
+                futures = as_completed(futures)
+            return (f.result() for f in futures)
+        tasks = [(func, task) for task in tasks]
+        if ordered:
+            return self.executor.imap(_call, tasks)
+        return self.executor.imap_unordered(_call, tasks)
+
+    def close(self):
+        """
+        Shuts down the worker processes, if this pool started them.
+        """
+        if self._owned:
+            self.executor.close()
+            self.executor.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 def parallel_apply(orig_bedtool, method, genome=None, genome_fn=None,
                    method_args=None, method_kwargs=None, shuffle_kwargs=None,
                    shuffle=True, reduce_func=None, processes=1, sort=False,
                    _orig_pool=None, iterations=1000, debug=False,
-                   report_iterations=False):
+                   report_iterations=False, pool=None, chunksize=None,
+                   ordered=True):
     """
     Call an arbitrary BedTool method many times in parallel.
 
@@ -158,6 +338,20 @@ def parallel_apply(orig_bedtool, method, genome=None, genome_fn=None,
         If provided, uses `_orig_pool` instead of creating one.  In this case,
         `processes` will be ignored.
 
+    pool : WorkerPool or executor
+        A :class:`WorkerPool`, `concurrent.futures` executor or
+        multiprocessing.Pool to run the iterations with, so that several
+        calls can share the same worker processes.  In this case,
+        `processes` will be ignored.
+
+    chunksize : int
+        Number of iterations sent to a worker at a time; by default, about
+        four chunks are sent to each worker.
+
+    ordered : bool
+        If False, results are yielded as soon as they are ready rather than
+        in order of iteration.
+
     debug : bool
         If True, then use the current iteration index as the seed to shuffle.
 
@@ -194,27 +388,372 @@ def parallel_apply(orig_bedtool, method, genome=None, genome_fn=None,
         sort=sort,
     )
 
-    def add_seed(i, kwargs):
-        if debug and shuffle:
-            kwargs['shuffle_kwargs']['seed'] = i
-        return kwargs
+    seed = debug and shuffle
 
-    if processes == 1:
+    if pool is None:
+        pool = _orig_pool
+    if processes == 1 and pool is None:
         for it in range(iterations):
-            yield _parallel_wrap(**add_seed(it, _parallel_wrap_kwargs))
-        raise StopIteration
+            yield _parallel_wrap(**_with_seed(it, _parallel_wrap_kwargs, seed))
+        return
 
-    if _orig_pool:
-        p = _orig_pool
+    if pool is None:
+        pool = WorkerPool(processes)
+        owned = True
     else:
-        p = multiprocessing.Pool(processes)
-
-    results = [
-        p.apply_async(_parallel_wrap, (), add_seed(it, _parallel_wrap_kwargs))
-        for it in range(iterations)]
-    for i, r in enumerate(results):
-        yield r.get()
-        if report_iterations:
-            sys.stderr.write('%s\r' % i)
-            sys.stderr.flush()
-    raise StopIteration
+        if not isinstance(pool, WorkerPool):
+            pool = WorkerPool(executor=pool)
+        owned = False
+
+    try:
+        results = pool.run(_parallel_wrap_kwargs, iterations, seed=seed,
+                           chunksize=chunksize, ordered=ordered)
+        for i, result in enumerate(results):
+            yield result
+            if report_iterations:
+                sys.stderr.write('%s\r' % i)
+                sys.stderr.flush()
+    finally:
+        if owned:
+            pool.close()
+
+
+# BedTool methods that can be run on each chromosome separately, with the
+# arguments that make their output depend on the whole genome at once
+_sharded_methods = {
+    'intersect': set(),
+    'subtract': set(),
+    'window': set(),
+    'closest': set(),
+    'coverage': set(['hist']),
+    'map': set(),
+    'merge': set(),
+    'genome_coverage': set(['ibam']),
+}
+
+# genome_coverage only reports each chromosome separately in these modes;
+# otherwise it adds genome-wide totals
+_genomecov_per_chrom = set(['bg', 'bga', 'd', 'dz'])
+
+_header_prefixes = (b'#', b'track', b'browser')
+
+# Number of per-chromosome files kept open while splitting a file
+_max_open = 256
+
+_BLOCKSIZE = 2 ** 20
+
+
+class _ChromFiles(object):
+    """
+    Files in `outdir` holding the lines of each chromosome, in order of first
+    appearance.
+    """
+    def __init__(self, outdir, prefix):
+        self.outdir = outdir
+        self.prefix = prefix
+        self.order = []
+        self.files = {}
+        self.sizes = {}
+        self._handles = {}
+
+    def write(self, chrom, data):
+        fout = self._handles.get(chrom)
+        if fout is None:
+            if chrom in self.files:
+                mode = 'ab'
+            else:
+                mode = 'wb'
+                self.order.append(chrom)
+                self.files[chrom] = os.path.join(
+                    self.outdir, '%s.%s' % (self.prefix, len(self.order)))
+                self.sizes[chrom] = 0
+            if len(self._handles) >= _max_open:
+                self.close()
+            fout = self._handles[chrom] = open(self.files[chrom], mode)
+        fout.write(data)
+        self.sizes[chrom] += len(data)
+
+    def close(self):
+        for fout in self._handles.values():
+            fout.close()
+        self._handles = {}
+
+
+def _split_by_chrom(fn, outdir, prefix):
+    """
+    Writes the lines of `fn` (optionally gzipped) on each chromosome to
+    a separate file in `outdir`, dropping header lines, and returns the
+    :class:`_ChromFiles`.
+    """
+    opener = gzip.open if helpers.isGZIP(fn) else open
+    chroms = _ChromFiles(outdir, prefix)
+    try:
+        with opener(fn, 'rb') as fin:
+            for block in iter(lambda: fin.read(_BLOCKSIZE), b''):
+                block += fin.readline()
+                if not block.endswith(b'\n'):
+                    block += b'\n'
+
+                # In sorted files, whole blocks are usually on one
+                # chromosome
+                tab = block.find(b'\t')
+                chrom = block[:tab]
+                if tab > 0 and not chrom.startswith(_header_prefixes) and \
+                        block.count(b'\n' + chrom + b'\t') \
+                        == block.count(b'\n') - 1:
+                    chroms.write(chrom, block)
+                    continue
+
+                for line in block.splitlines(True):
+                    if line.startswith(_header_prefixes) or not line.strip():
+                        continue
+                    chroms.write(line.split(b'\t', 1)[0], line)
+    finally:
+        chroms.close()
+    return chroms
+
+
+def _concat(fns, fn):
+    with open(fn, 'wb') as fout:
+        for i in fns:
+            with open(i, 'rb') as fin:
+                shutil.copyfileobj(fin, fout)
+    return fn
+
+
+def _run_shard(method, kwargs, a_files, others, genome_lines, workdir, name):
+    """
+    Runs `method` on the lines in `a_files`, with each kwarg in `others` set
+    to the concatenation of a list of files (or to a filename, used as is),
+    and `g` set to a genome file of `genome_lines` if given.  Returns the
+    names and files of the chromosomes in the output.
+    """
+    kwargs = dict(kwargs)
+    base = os.path.join(workdir, name)
+    a = pybedtools.BedTool(_concat(a_files, base + '.a'))
+    for key, (sources, multiple) in others.items():
+        fns = []
+        for i, source in enumerate(sources):
+            if not isinstance(source, six.string_types):
+                source = _concat(source, '%s.%s%s' % (base, key, i))
+            fns.append(source)
+        kwargs[key] = fns if multiple else fns[0]
+    if genome_lines is not None:
+        with open(base + '.genome', 'w') as fout:
+            fout.writelines(genome_lines)
+        kwargs['g'] = base + '.genome'
+    result = getattr(a, method)(**kwargs)
+    out = _split_by_chrom(result.fn, workdir, name + '.out')
+    helpers.close_or_delete(result)
+    return [(chrom, out.files[chrom]) for chrom in out.order]
+
+
+def _pack(chroms, weights, n):
+    """
+    Groups `chroms` into at most `n` shards of similar total weight, each
+    listing its chromosomes in their original order.
+    """
+    n = max(1, min(n, len(chroms)))
+    shards = [(0, i, []) for i in range(n)]
+    heapq.heapify(shards)
+    for chrom in sorted(chroms, key=lambda c: -weights[c]):
+        load, i, members = heapq.heappop(shards)
+        members.append(chrom)
+        heapq.heappush(shards, (load + weights[chrom], i, members))
+    rank = dict((chrom, i) for i, chrom in enumerate(chroms))
+    return [(load, sorted(members, key=rank.get))
+            for load, _, members in shards if members]
+
+
+class ParallelBedTool(object):
+    """
+    Runs BEDTools programs on each chromosome separately, in parallel.
+
+    Create one with :meth:`BedTool.parallel`.  Calling one of the methods
+    that works per chromosome -- :meth:`BedTool.intersect`, `subtract`,
+    `window`, `closest`, `coverage`, `map`, `merge` and `genome_coverage`
+    -- splits this BedTool and the other inputs by chromosome, runs the
+    program on groups of chromosomes in a pool of processes, and returns
+    a BedTool of the results with the chromosomes in their original order.
+    The groups are balanced by the amount of data on each chromosome.
+
+    Arguments that need the whole genome at once, such as
+    `coverage(hist=True)` and `genome_coverage()` without `bg`, `bga`, `d`
+    or `dz`, as well as BAM inputs and all other methods, run as usual on
+    the whole BedTool.  Chromosomes without any features in `b` are run
+    against all of `b`, so that BEDTools reports them exactly as it would
+    for the whole file (for example, the empty fields of `closest` or
+    `intersect(loj=True)`).
+    """
+    def __init__(self, bedtool, processes=None, pool=None):
+        self.bedtool = bedtool
+        self.processes = processes
+        self.pool = pool
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if attr in _sharded_methods:
+            def run(*args, **kwargs):
+                return self._run(attr, args, kwargs)
+            run.__name__ = attr
+            run.__doc__ = getattr(pybedtools.BedTool, attr).__doc__
+            return run
+        return getattr(self.bedtool, attr)
+
+    def __repr__(self):
+        return '<ParallelBedTool(%s)>' % self.bedtool.fn
+
+    def _shardable(self, method, kwargs):
+        if self.bedtool._isbam:
+            return False
+        flags = set(k for k, v in kwargs.items()
+                    if v is not False and v is not None)
+        if flags & _sharded_methods[method]:
+            return False
+        if method == 'genome_coverage' and \
+                not flags & _genomecov_per_chrom:
+            return False
+        return True
+
+    def _run(self, method, args, kwargs):
+        bt = self.bedtool
+        if args:
+            assert len(args) == 1
+            kwargs = dict(kwargs, b=args[0])
+        if not self._shardable(method, kwargs):
+            return getattr(bt, method)(**kwargs)
+        if not isinstance(bt.fn, six.string_types):
+            bt = bt.saveas()
+
+        # Save streaming inputs, so that they can be read again if the
+        # method is run as usual after all
+        others = {}
+        if 'b' in kwargs:
+            b = kwargs['b']
+            multiple = isinstance(b, (list, tuple))
+            bs = []
+            for i in (b if multiple else [b]):
+                if not isinstance(i, pybedtools.BedTool):
+                    i = pybedtools.BedTool(i)
+                if not isinstance(i.fn, six.string_types):
+                    i = i.saveas()
+                bs.append(i)
+            fns = [i.fn for i in bs]
+            kwargs = dict(kwargs, b=fns if multiple else fns[0])
+            if any(i._isbam for i in bs):
+                return getattr(bt, method)(**kwargs)
+            others['b'] = (fns, multiple)
+
+        genome = None
+        if method == 'genome_coverage':
+            kwargs = bt.check_genome(**kwargs)
+            with open(kwargs['g']) as fin:
+                genome = [line for line in fin if line.strip()]
+
+        shard_kwargs = dict((k, v) for k, v in kwargs.items()
+                            if k not in ('b', 'g', 'output', 'stream'))
+        if method != 'genome_coverage' and 'g' in kwargs:
+            shard_kwargs['g'] = kwargs['g']
+        workdir = tempfile.mkdtemp(
+            prefix=pybedtools.settings.tempfile_prefix,
+            dir=pybedtools.get_tempdir())
+        try:
+            result = self._run_shards(method, shard_kwargs, bt, others,
+                                      genome, workdir, kwargs.get('output'))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        if result is None:
+            return getattr(bt, method)(**kwargs)
+        return result
+
+    def _run_shards(self, method, kwargs, bt, others, genome, workdir,
+                    output):
+        """
+        Splits the inputs, runs the shards and concatenates their output;
+        returns None if the inputs can't be split by chromosome.
+        """
+        a = _split_by_chrom(bt.fn, workdir, 'a')
+        weights = dict(a.sizes)
+        split_others = {}
+        for key, (fns, multiple) in others.items():
+            split_others[key] = [
+                _split_by_chrom(fn, workdir, '%s%s' % (key, i))
+                for i, fn in enumerate(fns)]
+            for parts in split_others[key]:
+                for chrom, size in parts.sizes.items():
+                    if chrom in weights:
+                        weights[chrom] += size
+
+        order = a.order
+        if genome is not None:
+            # Chromosomes are reported in the order of the genome file,
+            # including those without features
+            lines = collections.OrderedDict(
+                (line.split()[0].encode(), line) for line in genome)
+            if set(a.order) - set(lines):
+                return None
+            order = list(lines)
+            per_base = kwargs.get('d') or kwargs.get('dz')
+            for chrom in order:
+                weights[chrom] = weights.get(chrom, 0)
+                if per_base:
+                    weights[chrom] += int(lines[chrom].split()[1])
+
+        # Chromosomes missing from one of the other inputs are run against
+        # all of that input
+        orphans = set(c for c in order if any(
+            c not in parts.files
+            for key in split_others for parts in split_others[key]))
+
+        pool = self._pool()
+        try:
+            n = 4 * pool.processes
+            total = float(sum(weights[c] for c in order)) or 1
+            shards = _pack([c for c in order if c not in orphans],
+                           weights, n)
+            shards += _pack([c for c in order if c in orphans], weights,
+                            int(n * sum(weights[c] for c in orphans) / total))
+
+            tasks = []
+            for load, chroms in sorted(shards, reverse=True):
+                shard_others = {}
+                for key, (fns, multiple) in others.items():
+                    if chroms[0] in orphans:
+                        sources = fns
+                    else:
+                        sources = [[parts.files[c] for c in chroms]
+                                   for parts in split_others[key]]
+                    shard_others[key] = (sources, multiple)
+                genome_lines = None
+                if genome is not None:
+                    genome_lines = [lines[c] for c in chroms]
+                tasks.append((method, kwargs,
+                              [a.files[c] for c in chroms if c in a.files],
+                              shard_others, genome_lines, workdir,
+                              'shard%s' % len(tasks)))
+
+            outputs = collections.defaultdict(list)
+            for result in pool._dispatch(_run_shard, tasks, ordered=False):
+                for chrom, fn in result:
+                    outputs[chrom].append(fn)
+        finally:
+            if pool is not self.pool:
+                pool.close()
+
+        if output is None:
+            output = pybedtools.BedTool._tmp()
+        extra = [c for c in outputs if c not in set(order)]
+        with open(output, 'wb') as fout:
+            for chrom in order + extra:
+                for fn in outputs.get(chrom, []):
+                    with open(fn, 'rb') as fin:
+                        shutil.copyfileobj(fin, fout)
+        return pybedtools.BedTool(output)
+
+    def _pool(self):
+        if isinstance(self.pool, WorkerPool):
+            return self.pool
+        if self.pool is not None:
+            return WorkerPool(self.processes, executor=self.pool)
+        return WorkerPool(self.processes)
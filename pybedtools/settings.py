@@ -12,6 +12,62 @@ _R_installed = False
 _v_2_15_plus = False
 
 KEEP_TEMPFILES = False
+
+# If True, a tempfile created for a BedTool is deleted as soon as no BedTool
+# using it remains, rather than by pybedtools.cleanup() at exit.
+tempfile_refcount = False
+
+# Maximum total size in bytes of this session's tempfiles.  Once exceeded,
+# tempfiles no longer used by any BedTool are deleted, least recently used
+# first.  None means no limit.
+tempfile_quota = None
+
+# If True, BedTool.all_hits(), any_hits() and count_hits() answer queries
+# from a ".pbtidx" index file next to the BedTool's file (building it on first
+# use) instead of loading the file into memory in every process.  See
+# IntervalFile.build_index().
+interval_index = False
+
+# If True, indexing a file-based BedTool (`bt[i]`, `bt[i:j]`), BedTool.at()
+# and BedTool.random_subset() seek straight to the lines they need, using the
+# byte offset of each feature line saved in a ".pbtlines" file next to the
+# BedTool's file (built on first use), instead of reading the file from the
+# start.  See pybedtools.cbedtools.LineIndex.
+line_index = False
+
+# Maximum number of idle open tabix handles kept per file by
+# BedTool.tabix_intervals() and BedTool.tabix_intervals_many(), for reuse by
+# later queries (see pybedtools.tabix).
+tabix_handles = 8
+
+# Number of threads pysam uses to decompress a BAM file while iterating over
+# it as Intervals (see pybedtools.bedtool.BAM).
+bam_threads = 1
+
+# BedTool.intersect() and BedTool.coverage() read only the reads of an indexed
+# BAM input that overlap the features of the other input, if there are at
+# most this many features (see pybedtools.bamindex.restrict).  0 disables it.
+bam_pushdown_regions = 10000
+
+# Default for the `engine` kwarg of BedTool methods.  "native" runs methods
+# that have an in-process implementation (see pybedtools.native) without
+# calling BEDTools; other methods, and unsupported arguments, still call
+# BEDTools.
+engine = 'bedtools'
+
+# Directory in which to cache the output of BEDTools calls, so that running
+# the same command on unchanged inputs again reuses the earlier result (see
+# pybedtools.cache).  None disables the cache.
+result_cache = None
+
+# Maximum total size in bytes of the cached results; the least recently used
+# are removed first.
+result_cache_size = 2 ** 30
+
+# How input files are identified in cache keys: "content" hashes their
+# contents, so that identical tempfiles match; "mtime" uses their paths,
+# modification times and sizes, which is faster for large inputs.
+result_cache_key = 'content'
 _DEBUG = True
 
 # Check calls against these names to only allow calls to known BEDTools
@@ -24,3 +24,157 @@ def random_intersection_bp(x, y, genome_fn, shuffle_kwargs, intersect_kwargs):
     result = sum(len(i) for i in zz)
     helpers.close_or_delete(z, zz)
     return result
+
+
+# Arguments of BedTool.shuffle that Shuffler understands
+_shuffle_args = set(['incl', 'excl', 'chrom', 'noOverlapping', 'seed',
+                     'maxTries', 'g', 'genome'])
+
+
+def _shuffler(x, genome_fn, shuffle_kwargs):
+    """
+    Returns a pybedtools.arrays.Shuffler for `x`, or None if NumPy isn't
+    installed or `shuffle_kwargs` includes arguments it doesn't support.
+    """
+    for key, value in shuffle_kwargs.items():
+        if key not in _shuffle_args and value is not False:
+            return None
+    try:
+        from .arrays import Shuffler
+    except ImportError:
+        return None
+    kwargs = dict(shuffle_kwargs)
+    g = kwargs.pop('g', None)
+    assembly = kwargs.pop('genome', None)
+    return Shuffler(x, g or assembly or genome_fn, **kwargs)
+
+
+def _intersect_flags(intersect_kwargs, bp=False):
+    """
+    The set of intersect flags, out of `u` and `v`, that `intersect_kwargs`
+    gives; or None if it uses any others.
+    """
+    flags = set(k for k, v in intersect_kwargs.items()
+                if v is not False and k not in ('sorted', 'stream'))
+    if not flags <= set(['u', 'v']) or flags == set(['u', 'v']) \
+            or (bp and 'v' in flags):
+        return None
+    return flags
+
+
+def _statistic(name, counter, flags, starts, ends):
+    """
+    Values of statistic `name` for each row of intervals [starts, ends),
+    compared with the features of OverlapCounter `counter`: the number of
+    intersections ("count"), the bp they cover ("bp") or the Jaccard
+    statistic ("jaccard").
+    """
+    if name == 'jaccard':
+        return counter.jaccard(starts, ends)['jaccard']
+    counts = counter.counts(starts, ends)
+    if name == 'bp':
+        if 'u' in flags:
+            return ((counts > 0) * (ends - starts)).sum(axis=1)
+        return counter.bp(starts, ends).sum(axis=1)
+    if name != 'count':
+        raise ValueError('unknown statistic %r' % name)
+    if 'u' in flags:
+        return (counts > 0).sum(axis=1)
+    if 'v' in flags:
+        return (counts == 0).sum(axis=1)
+    return counts.sum(axis=1)
+
+
+def random_statistics(x, y, genome_fn, iterations, shuffle_kwargs,
+                      intersect_kwargs, statistics=('count',)):
+    """
+    Compares `x` and `y`, then `iterations` shuffled versions of `x` and
+    `y`, in-process: `x` and `y` are each read once, and the shufflings are
+    drawn in batches by pybedtools.arrays.Shuffler and compared with `y`
+    without writing them to files.
+
+    `statistics` are any of "count", the number of features (or with
+    `intersect_kwargs` of `{'u': True}` or `{'v': True}`, the number of
+    features of `x`) that `x.intersect(y, **intersect_kwargs)` would report;
+    "bp", the total length of those features; and "jaccard", as reported by
+    `x.jaccard(y)`.
+
+    Returns a dictionary with the numbers of features in `x` ("self") and
+    `y` ("other"), and dictionaries of the "actual" value and the randomized
+    "distribution" of each statistic; or NotImplemented if NumPy isn't
+    installed or the arguments need shuffleBed and intersectBed.  Only the
+    `u` and `v` arguments of intersect are supported (and `sorted`, which
+    doesn't change the result).
+    """
+    flags = _intersect_flags(intersect_kwargs, 'bp' in statistics)
+    if flags is None:
+        return NotImplemented
+    shuffler = _shuffler(x, genome_fn, shuffle_kwargs)
+    if shuffler is None:
+        return NotImplemented
+    import numpy as np
+    from .arrays import _as_intervalarray
+    y = _as_intervalarray(y)
+    counter = shuffler.counter(y)
+    actual = dict(
+        (name, _statistic(name, counter, flags, shuffler.starts[None],
+                          shuffler.ends[None])[0].item())
+        for name in statistics)
+    distribution = dict((name, []) for name in statistics)
+    for starts, ends in shuffler.shuffle(iterations):
+        for name in statistics:
+            distribution[name].append(
+                _statistic(name, counter, flags, starts, ends))
+    return {
+        'self': len(shuffler.features),
+        'other': len(y),
+        'actual': actual,
+        'distribution': dict(
+            (name, np.concatenate(values) if values else np.zeros(0))
+            for name, values in distribution.items()),
+    }
+
+
+def random_intersections(x, y, genome_fn, iterations, shuffle_kwargs,
+                         intersect_kwargs, bp=False):
+    """
+    In-process, vectorized equivalent of calling random_intersection (or
+    random_intersection_bp, if `bp` is True) `iterations` times; see
+    random_statistics.
+
+    Returns a list of the results, or NotImplemented if NumPy isn't installed
+    or the arguments need shuffleBed and intersectBed.
+    """
+    name = 'bp' if bp else 'count'
+    result = random_statistics(x, y, genome_fn, iterations, shuffle_kwargs,
+                               intersect_kwargs, statistics=(name,))
+    if result is NotImplemented:
+        return result
+    return [int(i) for i in result['distribution'][name]]
+
+
+def random_jaccards(x, y, genome_fn, iterations, shuffle_kwargs,
+                    jaccard_kwargs):
+    """
+    In-process, vectorized equivalent of calling random_jaccard `iterations`
+    times.  Returns a list of dictionaries like those of BedTool.jaccard, or
+    NotImplemented if NumPy isn't installed or the arguments need
+    shuffleBed and jaccard.
+    """
+    if any(v is not False for v in jaccard_kwargs.values()):
+        return NotImplemented
+    shuffler = _shuffler(x, genome_fn, shuffle_kwargs)
+    if shuffler is None:
+        return NotImplemented
+    counter = shuffler.counter(y)
+    results = []
+    for starts, ends in shuffler.shuffle(iterations):
+        stats = counter.jaccard(starts, ends)
+        for i in range(len(stats['jaccard'])):
+            results.append({
+                'intersection': int(stats['intersection'][i]),
+                'union-intersection': int(stats['union-intersection'][i]),
+                'jaccard': float(stats['jaccard'][i]),
+                'n_intersections': int(stats['n_intersections'][i]),
+            })
+    return results
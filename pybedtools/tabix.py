@@ -0,0 +1,159 @@
+"""
+Pool of open tabix handles, used by :meth:`BedTool.tabix_intervals` and
+:meth:`BedTool.tabix_intervals_many`.
+
+Opening a tabix file reads its index, which for a small region query takes
+longer than the query itself.  Instead of closing it afterwards, each handle
+is kept open and reused by later queries of the same file.  Any thread may
+use the pool, but a handle is only ever used by one thread at a time; up to
+`pybedtools.settings.tabix_handles` idle handles are kept per file.  Handles
+for a file that has changed since they were opened are closed rather than
+reused, and a child process started by `fork` opens its own.
+
+:func:`info` reports how many handles were opened and reused, and
+:func:`close_all` closes the idle ones.
+"""
+import atexit
+import os
+import threading
+from contextlib import contextmanager
+
+import pysam
+
+from . import settings
+from . import helpers
+from .cbedtools import Interval, _file_signature
+
+
+_lock = threading.Lock()
+
+# Idle handles, keyed by absolute path: (signature, [pysam.TabixFile, ...])
+_idle = {}
+
+# Process that opened the handles in `_idle`
+_pid = os.getpid()
+
+_stats = {'opened': 0, 'reused': 0}
+
+
+def _index_fn(path):
+    index = path + '.tbi'
+    if not os.path.exists(index) and os.path.exists(path + '.csi'):
+        index = path + '.csi'
+    return index
+
+
+def _signature(path):
+    return _file_signature(path), _file_signature(_index_fn(path))
+
+
+def region(interval_or_string):
+    """
+    Returns the (chrom, start, end) arguments of pysam.TabixFile.fetch() for
+    an Interval, or for a string in "chrom:start-stop" format or naming a
+    whole chromosome.
+    """
+    if isinstance(interval_or_string, Interval):
+        interval = interval_or_string
+        return interval.chrom, interval.start, interval.stop
+
+    # Parse string directly instead of relying on Interval, in order to
+    # permit full chromosome fetching
+    match = helpers.coord_re.search(interval_or_string)
+    if match is None:
+        return str(interval_or_string), None, None
+    chrom, start, end = match.group(1, 2, 3)
+    return str(chrom), int(start), int(end)
+
+
+def _take(path, signature):
+    global _pid
+    stale = []
+    tbx = None
+    with _lock:
+        if _pid != os.getpid():
+            # Handles opened by the parent share their file offsets with it,
+            # so leave them alone.
+            _idle.clear()
+            _pid = os.getpid()
+        entry = _idle.get(path)
+        if entry is not None:
+            if entry[0] != signature:
+                stale = entry[1]
+                del _idle[path]
+            elif entry[1]:
+                tbx = entry[1].pop()
+                _stats['reused'] += 1
+        if tbx is None:
+            _stats['opened'] += 1
+    for h in stale:
+        h.close()
+    if tbx is None:
+        tbx = pysam.TabixFile(path, index=_index_fn(path))
+    return tbx
+
+
+def _give_back(path, signature, tbx):
+    with _lock:
+        if _pid == os.getpid():
+            entry = _idle.setdefault(path, (signature, []))
+            if entry[0] == signature \
+                    and len(entry[1]) < settings.tabix_handles:
+                entry[1].append(tbx)
+                return
+    tbx.close()
+
+
+@contextmanager
+def handle(fn):
+    """
+    Context manager providing an open pysam.TabixFile for `fn`, taken from
+    the pool (or newly opened) and returned to it afterwards.
+    """
+    path = os.path.abspath(fn)
+    signature = _signature(path)
+    tbx = _take(path, signature)
+    try:
+        yield tbx
+    finally:
+        # each fetch() seeks afresh, so a handle left mid-read (or after an
+        # unknown chromosome) can still be reused
+        _give_back(path, signature, tbx)
+
+
+def fetch(fn, regions):
+    """
+    Returns a list with, for each of `regions` (anything accepted by
+    :func:`region`), the list of lines in the tabixed file `fn` that overlap
+    it, without trailing newlines.  One handle is used for all regions.
+    """
+    regions = [region(i) for i in regions]
+    with handle(fn) as tbx:
+        return [list(tbx.fetch(*i)) for i in regions]
+
+
+def info():
+    """
+    Returns a dict of the numbers of handles opened and reused in this
+    session, and the number of idle handles currently held open.
+    """
+    with _lock:
+        result = dict(_stats)
+        result['idle'] = sum(len(i[1]) for i in _idle.values())
+    return result
+
+
+def close_all():
+    """
+    Closes all idle handles and resets the counters.
+    """
+    with _lock:
+        handles = [h for i in _idle.values() for h in i[1]]
+        _idle.clear()
+        for k in _stats:
+            _stats[k] = 0
+    for h in handles:
+        h.close()
+
+
+atexit.register(close_all)
@@ -80,6 +80,40 @@ def test_interval_index():
     print(iv[4:-3])
     assert iv[4:-3] == ['805', '.']
 
+
+def test_interval_lazy_fields():
+    # Intervals read from a file keep the line and decode fields on demand;
+    # they should behave just like those made from a list
+    for fn in ('a.bed', 'd.gff', 'v.vcf'):
+        for iv in pybedtools.example_bedtool(fn):
+            other = pybedtools.create_interval_from_list(iv.fields)
+            assert iv.fields == other.fields
+            assert str(iv) == str(other)
+            assert hash(iv) == hash(other)
+            assert iv.name == other.name
+            assert iv[-1] == other[-1]
+            assert iv[1:-1] == other[1:-1]
+            assert_raises(IndexError, iv.__getitem__, -len(iv.fields) - 1)
+
+    # the list returned by fields is a copy
+    iv = pybedtools.example_bedtool('a.bed')[0]
+    fields = iv.fields
+    fields[3] = 'changed'
+    assert iv.fields[3] == 'feature1'
+
+    # changes are reflected in fields and when written
+    iv.start = 5
+    iv.name = 'renamed'
+    iv.append('extra')
+    assert iv.fields == ['chr1', '5', '100', 'renamed', '0', '+', 'extra']
+    assert iv[1] == '5'
+    assert str(iv) == 'chr1\t5\t100\trenamed\t0\t+\textra\n'
+
+    iv = pybedtools.example_bedtool('d.gff')[0]
+    iv.attrs['ID'] = 'changed'
+    assert 'ID=changed' in iv[8]
+    assert 'ID=changed' in str(iv)
+
 def test_tuple_creation():
     # everything as a string
     t = [
@@ -153,6 +187,108 @@ def test_tabix_intervals():
     # permit fetching of a contig without a specified region
     assert len(a.tabix_intervals('chr1')) == 1
 
+
+def test_tabix_handle_pool():
+    fn = pybedtools.BedTool._tmp()
+    with open(fn, 'w') as fout:
+        for i in range(100):
+            fout.write('chr1\t%s\t%s\tf%s\n' % (i * 10, i * 10 + 5, i))
+    a = pybedtools.BedTool(pysam.tabix_index(fn, preset='bed', force=True))
+    pybedtools.BedTool.TEMPFILES.extend([a.fn, a.fn + '.tbi'])
+    pybedtools.tabix.close_all()
+
+    assert str(a.tabix_intervals('chr1:12-31')) == fix("""
+    chr1	10	15	f1
+    chr1	20	25	f2
+    chr1	30	35	f3""")
+    x = a.tabix_intervals('chr1:12-31', stream=True)
+    assert not isinstance(x.fn, six.string_types)
+    assert [f.name for f in x] == ['f1', 'f2', 'f3']
+    info = pybedtools.tabix.info()
+    assert (info['opened'], info['reused'], info['idle']) == (1, 1, 1)
+
+    regions = ['chr1:%s-%s' % (i, i + 50) for i in range(0, 1000, 37)]
+    expected = [len(a.tabix_intervals(r)) for r in regions]
+    assert [len(x) for x in a.tabix_intervals_many(regions)] == expected
+    assert len(a.tabix_intervals_many(['chr1'], stream=True)[0]) == 100
+    assert_raises(ValueError, a.tabix_intervals, 'chr2:1-10')
+
+    # threads share the pool, each using its own handle
+    errors = []
+
+    def query():
+        try:
+            for r, n in zip(regions, expected):
+                assert len(a.tabix_intervals(r, stream=True)) == n
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=query) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert pybedtools.tabix.info()['idle'] <= pybedtools.settings.tabix_handles
+
+    try:
+        import numpy as np
+    except ImportError:
+        return
+    arrs = a.tabix_intervals_many(['chr1:12-31', 'chr1:5000-6000'],
+                                  arrays=True)
+    assert list(arrs[0].starts) == [10, 20, 30]
+    assert list(arrs[0].column(3)) == ['f1', 'f2', 'f3']
+    assert len(arrs[1]) == 0
+    pybedtools.tabix.close_all()
+
+
+def test_bgzf_index():
+    lines = ['# header\n']
+    for chrom in ['chr1', 'chr2', 'chr10']:
+        for i in range(5000):
+            lines.append('%s\t%s\t%s\tf%s\n'
+                         % (chrom, i * 1000, i * 1000 + (i % 7) * 4000, i))
+    fn = pybedtools.BedTool._tmp()
+    with open(fn, 'w') as fout:
+        fout.writelines(lines)
+
+    # reference, indexed by pysam after compressing
+    ref = pybedtools.BedTool._tmp()
+    with open(ref, 'w') as fout:
+        fout.writelines(lines)
+    ref = pysam.TabixFile(pysam.tabix_index(ref, preset='bed', force=True))
+
+    a = pybedtools.BedTool(fn)
+    t = a.tabix(in_place=False, is_sorted=True, threads=3)
+    assert t._tabixed()
+    with gzip.open(t.fn, 'rt') as fin:
+        assert fin.read() == ''.join(lines)
+    c = a.tabix(in_place=False, is_sorted=True, csi=True)
+    assert c._tabixed() and os.path.exists(c.fn + '.csi')
+    for chrom, start, end in [('chr1', 0, 10), ('chr2', 123456, 234567),
+                              ('chr10', 4990000, 6000000), ('chr1', 0, None)]:
+        expected = list(ref.fetch(chrom, start, end))
+        for x in (t, c):
+            region = chrom if end is None else '%s:%s-%s' % (chrom, start, end)
+            assert [str(f).rstrip('\n') for f in x.tabix_intervals(region)] \
+                == expected
+
+    g = pybedtools.example_bedtool('d.gff').saveas()
+    gt = g.sort(engine='native').tabix(in_place=False, is_sorted=True)
+    assert len(gt.tabix_intervals('chr1:100-300')) == len(
+        g.intersect(pybedtools.BedTool('chr1 100 300', from_string=True),
+                    u=True, engine='native'))
+
+    # unsorted input
+    fn = pybedtools.BedTool._tmp()
+    assert_raises(ValueError, pybedtools.bgzf.compress,
+                  [b'chr1\t10\t20\nchr1\t5\t8\n'], fn, preset='bed')
+    assert_raises(ValueError, pybedtools.bgzf.compress,
+                  [b'chr1\t5\t8\nchr2\t5\t8\nchr1\t9\t10\n'], fn,
+                  preset='bed')
+    pybedtools.tabix.close_all()
+
+
 # ----------------------------------------------------------------------------
 # Streaming and non-file BedTool tests
 # ----------------------------------------------------------------------------
@@ -232,6 +368,43 @@ def test_stream_of_stream():
     stream2_str    = str(stream2)
     assert nonstream2_str == stream2_str == nonstream1_str == stream1_str == a_str
 
+
+def test_stream_pipes():
+    """
+    Chained streaming calls are connected by OS pipes
+    """
+    a = pybedtools.example_bedtool('a.bed')
+    b = pybedtools.example_bedtool('b.bed')
+    expected = str(a.intersect(b).merge().slop(b=1, genome='hg19'))
+
+    c = a.intersect(b, stream=True).merge(stream=True)\
+        .slop(b=1, genome='hg19', stream=True)
+    assert isinstance(c.fn, pybedtools.helpers.PipeOutput)
+    assert c.fn.upstream.upstream is not None
+    assert str(c.saveas()) == expected
+
+    # also when the last step writes to a file
+    c = a.intersect(b, stream=True).merge(stream=True)\
+        .slop(b=1, genome='hg19')
+    assert str(c) == expected
+
+    # this used to deadlock, since the stream was written to the second
+    # process from Python
+    x = pybedtools.BedTool(
+        ('chr1', i, i + 10) for i in range(0, 200000, 5)).saveas()
+    assert len(x.intersect(x, u=True, stream=True)
+               .intersect(x, u=True, stream=True)) == len(x)
+
+    # failures upstream are reported
+    assert_raises(pybedtools.helpers.BEDToolsError,
+                  a.intersect('nonexistent.bed', stream=True).merge)
+
+    # ... also when the stream is read from Python
+    c = a.intersect('nonexistent.bed', stream=True)
+    assert_raises(pybedtools.helpers.BEDToolsError, list, c)
+    assert c.fn.process.returncode is not None
+
+
 def test_generator():
     """
     Equality of BedTools created from file, iter(), and generator
@@ -550,6 +723,41 @@ def test_subset():
     print(len(s2))
     assert len(s2) == len(a)
 
+
+def test_subset_sampling():
+    x = pybedtools.example_bedtool('rmsk.hg18.chr21.small.bed')
+    lines = [str(f) for f in x]
+
+    s = [str(f) for f in x.random_subset(50, seed=3)]
+    assert len(s) == 50
+    assert s == sorted(s, key=lines.index)
+    assert s == [str(f) for f in x.random_subset(50, seed=3)]
+    assert s != [str(f) for f in x.random_subset(50, seed=4)]
+
+    # streaming input
+    assert [str(f) for f in pybedtools.BedTool(iter(x)).random_subset(
+        50, seed=3)] == s
+    assert len(x.random_subset(len(lines) + 10)) == len(lines)
+
+    # weights of zero are never chosen
+    s = x.random_subset(20, seed=1, weights=lambda f: f.strand == '+')
+    assert len(s) == 20
+    assert set(f.strand for f in s) == set(['+'])
+    assert_raises(ValueError, x.random_subset, 5, weights=lambda f: -1)
+
+    # every feature of a heavily weighted group is chosen first
+    heavy = sum(1 for f in x if f.name == 'L2')
+    s = x.random_subset(heavy, seed=1,
+                        weights=lambda f: 1e9 if f.name == 'L2' else 1)
+    assert set(f.name for f in s) == set(['L2'])
+
+    a = pybedtools.example_bedtool('a.bed')
+    s = a.random_subset(2, seed=1, stratify='strand')
+    assert sorted(f.strand for f in s) == ['+', '+', '-']
+    s = a.random_subset(1, seed=1, stratify=lambda f: f.start > 100)
+    assert len(s) == 2
+
+
 def test_eq():
     a = pybedtools.example_bedtool('a.bed')
     b = pybedtools.example_bedtool('a.bed')
@@ -987,6 +1195,96 @@ def test_bam_interval():
     assert x[0].stop == 9365
     assert len(x[0][9]) == len(x[0]) == 36
 
+
+def test_bam_interval_from_segment():
+    from pybedtools.bedtool import BAM
+    fn = pybedtools.example_filename('y.bam')
+    for threads in (1, 2):
+        for i, segment in zip(BAM(fn, threads=threads),
+                              pysam.AlignmentFile(fn)):
+            # the same as parsing the SAM line
+            line = pybedtools.create_interval_from_list(
+                segment.to_string().split('\t'))
+            assert (i.chrom, i.start, i.end, i.strand, i.score) == \
+                (line.chrom, line.start, line.end, line.strand, line.score)
+            assert i.fields == line.fields
+            assert i.end == segment.reference_end
+            assert i.strand == ('-' if segment.is_reverse else '+')
+
+    # the end comes from the CIGAR; fields are formatted on first use, and
+    # edits made before that are kept
+    segment = next(pysam.AlignmentFile(fn))
+    assert segment.cigarstring == '3S33M'
+    i = pybedtools.cbedtools.create_interval_from_segment(segment)
+    assert (i.chrom, i.start, i.end) == ('chr1', 16285, 16318)
+    i.append('XX:Z:edit')
+    assert i[3] == '16286'
+    assert str(i).endswith('\tjM:B:c,-1\tjI:B:i,-1\tRG:Z:foo\tXX:Z:edit\n')
+
+
+def test_bam_fetch():
+    from pybedtools import bamindex
+    fn = pybedtools.BedTool._tmp()
+    with open(pybedtools.example_filename('x.bam'), 'rb') as fin:
+        with open(fn, 'wb') as fout:
+            fout.write(fin.read())
+    x = pybedtools.BedTool(fn)
+    assert_raises(ValueError, x.fetch, 'chr2L')
+    pysam.index(fn)
+    try:
+        # overlapping regions, a whole chromosome, and one not in the BAM
+        regions = ['chr2L:10000-20000', 'chr2L:15000-30000', 'chr4',
+                   'chr3L:0-100000', 'chrNope:1-10']
+        reads = list(pysam.AlignmentFile(fn))
+
+        def overlaps(read):
+            for r in regions:
+                chrom, start, end = bamindex.region(r)
+                if read.reference_name == chrom and (
+                        start is None or (read.reference_start < end and
+                                          read.reference_end > start)):
+                    return True
+            return False
+        expected = [str(i) for i, read in zip(x, reads)
+                    if not read.is_unmapped and overlaps(read)]
+        assert len(expected) > 10
+        for threads in (None, 2):
+            assert [str(i) for i in x.fetch(regions, stream=True,
+                                             threads=threads)] == expected
+        y = x.fetch(pybedtools.BedTool(
+            'chr2L 15000 30000\nchr2L 10000 20000\nchr4 0 1351857\n'
+            'chr3L 0 100000', from_string=True))
+        assert y._isbam and [str(i) for i in y] == expected
+
+        # intersect/coverage inputs are only restricted when reads elsewhere
+        # can't change the output
+        targets = pybedtools.BedTool('chr2L 10000 30000', from_string=True)
+        kwargs = bamindex.restrict({'abam': fn, 'b': targets.fn, 'u': True},
+                                   {'abam': ('b', ['v'])})
+        assert kwargs['abam'] != fn and kwargs['u']
+        assert [str(i) for i in pybedtools.BedTool(kwargs['abam'])] == \
+            [str(i) for i in x.fetch('chr2L:10000-30000')]
+        # zero-length features find the reads around them, as in BEDTools
+        point = pybedtools.BedTool('chr2L 14977 14977', from_string=True)
+        kwargs = bamindex.restrict({'abam': fn, 'b': point.fn, 'u': True},
+                                   {'abam': ('b', ['v'])})
+        restricted = [str(i) for i in pybedtools.BedTool(kwargs['abam'])]
+        assert restricted == [str(i) for i in x.fetch('chr2L:14976-14978')]
+        assert any(i.start == 14976 for i in
+                   pybedtools.BedTool(kwargs['abam']))
+        for kwargs in [{'abam': fn, 'b': targets.fn, 'v': True},
+                       {'abam': fn, 'b': fn}]:
+            assert bamindex.restrict(kwargs, {'abam': ('b', ['v'])}) == kwargs
+        orig, pybedtools.settings.bam_pushdown_regions = \
+            pybedtools.settings.bam_pushdown_regions, 0
+        try:
+            kwargs = {'abam': fn, 'b': targets.fn}
+            assert bamindex.restrict(kwargs, {'abam': ('b', [])}) == kwargs
+        finally:
+            pybedtools.settings.bam_pushdown_regions = orig
+    finally:
+        os.unlink(fn + '.bai')
+
 def test_bam_regression():
     # Regression test:  with extra fields, the first item in x.bam was being
     # parsed as gff (cause not ==13 fields).  This does a check to prevent that
@@ -1446,6 +1744,56 @@ def test_gtf_gff_attrs():
     #           class_code "="
 
 
+def test_lazy_attrs():
+    line = ['chr1', 'fake', 'exon', '51', '300', '.', '+', '.',
+            'gene_id "g1"; transcript_id "t1"; gene_id "g2"; level 2;']
+
+    # single attributes are found without building the dict, and agree
+    # with it
+    gff = pybedtools.create_interval_from_list(line)
+    assert gff['transcript_id'] == 't1'
+    assert gff['gene_id'] == 'g2'
+    assert gff.name == 't1'
+    assert_raises(AttributeError, gff.__getitem__, 'missing')
+    assert featurefuncs.gff2bed(gff, 'level').name == '2'
+    assert featurefuncs.gff2bed(gff, 'missing').name == '.'
+    assert dict(gff.attrs) == {'gene_id': 'g2', 'transcript_id': 't1',
+                               'level': '2'}
+
+    # reading the attributes doesn't rewrite them...
+    assert str(gff) == '\t'.join(line) + '\n'
+
+    # ...but changing them does
+    gff.attrs['level'] = '3'
+    assert gff[8] == 'gene_id "g2";transcript_id "t1";level 3;'
+    del gff.attrs['level']
+    assert gff.fields[8] == 'gene_id "g2";transcript_id "t1";'
+    gff.attrs.update(exon_number='1')
+    assert str(gff).endswith('transcript_id "t1";exon_number 1;\n')
+
+    # as do in-place merges and new separators
+    gff = pybedtools.create_interval_from_list(line[:8] + ['ID=a;Name=b'])
+    attrs = gff.attrs
+    attrs |= {'X': '1'}
+    assert gff[8] == 'ID=a;Name=b;X=1;'
+    gff = pybedtools.create_interval_from_list(line[:8] + ['ID=a;Name=b'])
+    gff.attrs.field_sep = ' '
+    assert str(gff).endswith('\tID a;Name b;\n')
+    gff = pybedtools.create_interval_from_list(line[:8] + ['ID=a;Name=b'])
+    gff.attrs.sep = ','
+    assert gff.fields[8] == 'ID=a,Name=b,'
+
+    # attributes from elsewhere are always written
+    other = pybedtools.create_interval_from_list(line)
+    other.attrs = pybedtools.Attributes('ID=x')
+    assert other[8] == 'ID=x;'
+
+    # pairs without a separator are still an error
+    bad = pybedtools.create_interval_from_list(line[:8] + ['ID=1;oops'])
+    assert_raises(ValueError, bad.__getitem__, 'ID')
+    assert_raises(ValueError, getattr, bad, 'attrs')
+
+
 def test_jaccard():
     x = pybedtools.example_bedtool('a.bed')
 
@@ -1705,6 +2053,652 @@ def test_to_dataframe():
     assert results == expected
 
 
+def test_to_arrays():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy not installed; skipping test")
+
+    for fn in ('a.bed', 'd.gff', 'v.vcf', 'rmsk.hg18.chr21.small.bed.gz',
+               'hg38-base.bed'):
+        x = pybedtools.example_bedtool(fn)
+        arr = x.to_arrays()
+        features = list(x)
+        assert len(arr) == len(features)
+        assert arr.file_type == features[0].file_type
+        assert list(arr.chrom) == [f.chrom for f in features]
+        assert list(arr.starts) == [f.start for f in features]
+        assert list(arr.ends) == [f.end for f in features]
+        assert list(arr.lengths) == [len(f) for f in features]
+        assert [i.decode() for i in arr.strands] == [f.strand for f in features]
+        assert [str(f) for f in arr] == [str(f) for f in features]
+        assert str(arr[-1]) == str(features[-1])
+        assert str(arr.to_bedtool()) == str(x)
+
+    a = pybedtools.example_bedtool('a.bed').to_arrays()
+    assert list(a.scores) == [0, 0, 0, 0]
+    assert list(a.column(3)) == ['feature1', 'feature2', 'feature3', 'feature4']
+
+    b = a.filter(a.lengths >= 100)
+    assert list(b.starts) == [100, 150]
+    assert str(b.to_bedtool()) == fix("""
+        chr1	100	200	feature2	0	+
+        chr1	150	500	feature3	0	-""")
+    empty = a.filter(a.starts > 10 ** 9).to_bedtool()
+    assert os.path.exists(empty.fn) and str(empty) == ''
+    assert list(a[1:3].starts) == [100, 150]
+    assert list(a[::-1].sort().starts) == [1, 100, 150, 900]
+    assert_raises(ValueError, a.filter, [True])
+
+    x = pybedtools.BedTool(
+        """
+        track name=test
+        chr2 5 10
+        chr1 10 20
+        chr10 1 2
+        chr1 1 5
+        """, from_string=True)
+    arr = x.to_arrays()
+    assert arr.chroms == ['chr2', 'chr1', 'chr10']
+    assert str(arr.sort().to_bedtool()) == fix("""
+        chr1 1 5
+        chr1 10 20
+        chr10 1 2
+        chr2 5 10""")
+    assert list(arr.scores[:1]) != list(arr.scores[:1])  # NaN
+
+    bad = pybedtools.BedTool('chr1 1 5\nchr1 1 x\n', from_string=True)
+    assert_raises(pybedtools.MalformedBedLineError, bad.to_arrays)
+    assert_raises(ValueError, pybedtools.example_bedtool('x.bam').to_arrays)
+
+
+def test_native_shuffle():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy not installed; skipping test")
+    from pybedtools.arrays import Shuffler, OverlapCounter
+
+    a = pybedtools.example_bedtool('a.bed')
+    b = pybedtools.example_bedtool('b.bed')
+    genome = {'chr1': (0, 1000), 'chr2': (100, 600)}
+
+    def shuffled(shuffler, iterations=200):
+        starts, ends = next(shuffler.shuffle(iterations))
+        chroms, positions = shuffler.coordinates(starts)
+        return starts, ends, chroms, positions
+
+    starts, ends, chroms, positions = shuffled(Shuffler(a, genome, seed=1))
+    assert starts.shape == (200, 4)
+    assert (ends - starts == a.to_arrays().lengths).all()
+    assert set(chroms.ravel()) == set(['chr1', 'chr2'])
+    assert (positions[chroms == 'chr2'] >= 100).all()
+    assert (positions + (ends - starts) <=
+            np.where(chroms == 'chr1', 1000, 600)).all()
+
+    # the same seed draws the same replicates
+    assert (Shuffler(a, genome, seed=1)._place(200) == starts).all()
+
+    _, _, chroms, _ = shuffled(Shuffler(a, genome, chrom=True))
+    assert (chroms == 'chr1').all()
+
+    _, _, _, positions = shuffled(Shuffler(a, genome, incl=b, chrom=True))
+    assert ((positions >= 155) & (positions < 901)).all()
+
+    shuffler = Shuffler(a, genome, excl=b)
+    counter = shuffler.counter(b)
+    starts, ends, _, _ = shuffled(shuffler)
+    assert (counter.counts(starts, ends) == 0).all()
+
+    starts, ends, _, _ = shuffled(
+        Shuffler(a, {'chr1': (0, 1000)}, noOverlapping=True))
+    order = np.argsort(starts, axis=1)
+    rows = np.arange(len(starts))[:, None]
+    assert (starts[rows, order][:, 1:] >= ends[rows, order][:, :-1]).all()
+
+    assert_raises(ValueError, Shuffler, a, {'chr2': (0, 1000)})
+
+    # counts, bp and jaccard agree with intersect and jaccard
+    shuffler = Shuffler(a, {'chr1': (0, 1000)}, seed=2)
+    counter = shuffler.counter(b)
+    starts, ends = next(shuffler.shuffle(20))
+    counts = counter.counts(starts, ends)
+    bp = counter.bp(starts, ends)
+    jaccard = counter.jaccard(starts, ends)
+    merged_b = b.sort(engine='native').merge(engine='native')
+    for i in range(len(starts)):
+        x = pybedtools.BedTool(
+            ''.join('chr1\t%s\t%s\n' % j for j in zip(starts[i], ends[i])),
+            from_string=True).saveas()
+        assert [f.count for f in x.intersect(b, c=True, engine='native')] \
+            == list(counts[i])
+        assert sum(len(f) for f in x.intersect(b, engine='native')) \
+            == bp[i].sum()
+        merged_x = x.sort(engine='native').merge(engine='native')
+        intersection = sum(
+            len(f) for f in merged_x.intersect(merged_b, engine='native'))
+        union = sum(len(f) for f in merged_x) + \
+            sum(len(f) for f in merged_b) - intersection
+        assert jaccard['intersection'][i] == intersection
+        assert jaccard['union-intersection'][i] == union
+
+    # rows are kept apart even when one ends where the next one starts
+    counter = OverlapCounter(np.array([0]), np.array([10]), span=100)
+    jaccard = counter.jaccard(np.array([[90], [0]]), np.array([[100], [10]]))
+    assert list(jaccard['intersection']) == [0, 10]
+    assert list(jaccard['union-intersection']) == [20, 10]
+
+    a = a.set_chromsizes({'chr1': (0, 1000)})
+    results = list(a.randomintersection(b, 50, debug=True, engine='native'))
+    assert len(results) == 50
+    assert results == list(
+        a.randomintersection(b, 50, debug=True, engine='native'))
+    assert set(results) <= set(range(5))
+    genome_fn = pybedtools.chromsizes_to_file({'chr1': (0, 1000)})
+    assert len(a.randomintersection_bp(
+        b, 5, genome_fn, engine='native')) == 5
+    jaccards = a.random_jaccard(b, genome_fn, iterations=5, engine='native')
+    assert sorted(jaccards[0].keys()) == [
+        'intersection', 'jaccard', 'n_intersections', 'union-intersection']
+    assert pybedtools.stats.random_intersections(
+        a, b, genome_fn, 5, {'f': 0.5}, {}) is NotImplemented
+
+
+def test_native_randomstats():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy not installed; skipping test")
+    a = pybedtools.example_bedtool('a.bed')
+    a = a.set_chromsizes({'chr1': (0, 1000)})
+    b = pybedtools.example_bedtool('b.bed')
+    results = a.randomstats(b, 200, engine='native', debug=True,
+                            include_distribution=True,
+                            statistics=['bp', 'jaccard'])
+    assert results['actual'] == 3
+    assert results['self'] == 4 and results['other'] == 2
+    assert len(results['distribution']) == 200
+    assert list(results['distribution']) == list(
+        a.randomintersection(b, 200, debug=True, engine='native'))
+    stats = results['statistics']
+    assert sorted(stats.keys()) == ['bp', 'count', 'jaccard']
+    assert stats['count']['actual'] == 3
+    assert stats['bp']['actual'] == 500
+    assert stats['jaccard']['actual'] == 46 / 649.
+    assert 0 <= stats['jaccard']['percentile'] <= 100
+    assert_raises(ValueError, a.randomstats, b, 10, engine='bedtools',
+                  statistics=['bp'])
+
+
+def test_native_intersect_cases():
+    # every intersect case in test_cases.yaml that the native engine
+    # supports, with each pair of the input kinds used by test_iter
+    try:
+        import yaml
+    except ImportError:
+        raise SkipTest("PyYAML not installed; skipping test")
+    import itertools
+    from pybedtools import native
+    from pybedtools.test import test_iter
+    with open(test_iter.config_fn) as fin:
+        cases = yaml.safe_load(fin)
+    n = 0
+    failed = []
+    for case in cases:
+        kwargs = dict(case['kwargs'])
+        if case['method'] != 'intersect' or 'a' not in kwargs \
+                or 'b' not in kwargs:
+            continue
+        orig_a = pybedtools.example_bedtool(kwargs.pop('a'))
+        orig_b = pybedtools.example_bedtool(kwargs.pop('b'))
+        expected = fix(case['expected'])
+        for kind_a, kind_b in itertools.product(
+                ('filename', 'generator', 'stream', 'gzip'), repeat=2):
+            if (orig_a._isbam and kind_a != 'filename') or \
+                    (orig_b._isbam and kind_b != 'filename'):
+                continue
+            a = test_iter.converter[kind_a](orig_a)
+            b = test_iter.converter[kind_b](orig_b)
+            result = native.intersect(a, b=b, **kwargs)
+            if result is NotImplemented:
+                continue
+            n += 1
+            if str(result) != expected:
+                failed.append((kind_a, kind_b, case['kwargs']))
+    assert not failed, failed
+    assert n == 96, n
+
+
+def test_native_intersect():
+    a = pybedtools.example_bedtool('a.bed')
+    b = pybedtools.example_bedtool('b.bed')
+
+    def native(**kwargs):
+        return str(a.intersect(b, engine='native', **kwargs))
+
+    assert native() == fix("""
+        chr1	155	200	feature2	0	+
+        chr1	155	200	feature3	0	-
+        chr1	900	901	feature4	0	+""")
+    assert native(v=True) == fix("""
+        chr1	1	100	feature1	0	+""")
+    assert native(c=True, s=True) == fix("""
+        chr1	1	100	feature1	0	+	0
+        chr1	100	200	feature2	0	+	0
+        chr1	150	500	feature3	0	-	1
+        chr1	900	950	feature4	0	+	1""")
+    assert native(wao=True) == fix("""
+        chr1	1	100	feature1	0	+	.	-1	-1	.	-1	.	0
+        chr1	100	200	feature2	0	+	chr1	155	200	feature5	0	-	45
+        chr1	150	500	feature3	0	-	chr1	155	200	feature5	0	-	45
+        chr1	900	950	feature4	0	+	chr1	800	901	feature6	0	+	1""")
+    assert native(f=0.2, u=True) == fix("""
+        chr1	100	200	feature2	0	+""")
+    assert native(F=0.5, u=True) == fix("""
+        chr1	100	200	feature2	0	+
+        chr1	150	500	feature3	0	-""")
+    assert native(f=0.5, F=0.5, e=True, u=True) == native(F=0.5, u=True)
+    assert native(f=0.5, r=True, u=True) == ""
+    assert str(a.intersect(b, u=True, engine='native', stream=True)) \
+        == native(u=True)
+
+    # book-ended features don't overlap; zero-length features overlap
+    # features that contain them or are adjacent to them
+    x = pybedtools.BedTool('chr1 10 20', from_string=True)
+    y = pybedtools.BedTool(
+        """
+        chr1 20 30
+        chr1 15 15
+        chr1 20 20
+        chr1 21 21
+        """, from_string=True)
+    assert str(x.intersect(y, c=True, engine='native')) == fix(
+        "chr1 10 20 2")
+
+    # a zero-length query doesn't put sorted queries out of order
+    x = pybedtools.BedTool(
+        """
+        chr1 10 20
+        chr1 10 10
+        """, from_string=True)
+    y = pybedtools.BedTool('chr1 5 15', from_string=True)
+    expected = fix("""
+        chr1 10 15
+        chr1 10 10""")
+    assert str(x.intersect(y, engine='native')) == expected
+    assert str(x.intersect(y, engine='native', sorted=True)) == expected
+
+    assert_raises(ValueError, a.intersect, b, engine='nonexistent')
+
+
+def test_native_sort_merge_complement():
+    a = pybedtools.BedTool(
+        """
+        chr9 300 400 f1 1 +
+        chr1 100 200 f2 2 -
+        chr1 1 50 f3 3 +
+        chr12 1 100 f4 4 +
+        chr1 150 160 f5 5 +
+        chr9 500 600 f6 6 +
+        """, from_string=True)
+
+    s = a.sort(engine='native')
+    assert str(s) == fix("""
+        chr1	1	50	f3	3	+
+        chr1	100	200	f2	2	-
+        chr1	150	160	f5	5	+
+        chr12	1	100	f4	4	+
+        chr9	300	400	f1	1	+
+        chr9	500	600	f6	6	+""")
+    assert [len(i) for i in a.sort(chrThenSizeA=True, engine='native')] \
+        == [10, 49, 100, 99, 100, 100]
+
+    # sorting in several runs gives the same result
+    orig = pybedtools.native._sort_chunksize
+    try:
+        pybedtools.native._sort_chunksize = 2
+        assert str(a.sort(engine='native')) == str(s)
+    finally:
+        pybedtools.native._sort_chunksize = orig
+
+    assert str(s.merge(engine='native', c='5,4', o='sum,collapse')) == fix("""
+        chr1	1	50	3	f3
+        chr1	100	200	7	f2,f5
+        chr12	1	100	4	f4
+        chr9	300	400	1	f1
+        chr9	500	600	6	f6""")
+    assert str(s.merge(engine='native', s=True, d=100, c=5,
+                       o='mean')) == fix("""
+        chr1	1	160	+	4
+        chr1	100	200	-	2
+        chr12	1	100	+	4
+        chr9	300	600	+	3.5""")
+
+    # like BEDTools, merge needs sorted input
+    assert_raises(pybedtools.helpers.BEDToolsError, a.merge, engine='native')
+
+    c = s.complement(g={'chr1': (0, 300), 'chr2': (0, 50)}, engine='native')
+    assert str(c) == fix("""
+        chr1	0	1
+        chr1	50	100
+        chr1	200	300
+        chr2	0	50""")
+
+
+def test_lazy():
+    a = pybedtools.example_bedtool('a.bed')
+    b = pybedtools.example_bedtool('b.bed')
+
+    def steps(x):
+        return [str(step) for step in x.plan()[1]]
+
+    # redundant sorts and merges are dropped
+    x = a.lazy().sort().sort().merge().sort().merge()
+    assert steps(x) == ['.sort()', '.merge()']
+    assert x.sorted and x.merged and x.bed3
+    assert steps(a.lazy(sorted=True).sort(sizeD=True).sort()) == \
+        ['.sort(sizeD=True)', '.sort()']
+
+    # sorting in the chromosome order of a genome file isn't redundant, and
+    # doesn't give the order of sort()
+    for kwargs in ({'g': 'hg19.genome'}, {'faidx': 'hg19.fai'}):
+        x = a.lazy(sorted=True).sort(**kwargs)
+        assert [s.kwargs for s in x.plan()[1]] == [kwargs]
+        assert not x.sorted
+        assert len(x.sort().plan()[1]) == 2
+
+    # merging with a negative distance leaves some overlaps unmerged
+    x = a.lazy().sort().merge(d=-5)
+    assert x.sorted and not x.merged
+    assert steps(x.merge()) == ['.sort()', '.merge(d=-5)', '.merge()']
+    assert a.lazy().sort().merge(d=10).merged
+
+    # filters go before sorts and u/v intersections, but not other steps
+    x = a.lazy().sort().intersect(b, v=True).filter(len).slop(b=1).filter(len)
+    assert [s.method for s in x.plan()[1]] == \
+        ['filter', 'sort', 'intersect', 'slop', 'filter']
+    x = a.lazy().intersect(b, c=True).filter(len)
+    assert [s.method for s in x.plan()[1]] == ['intersect', 'filter']
+
+    # sorted inputs use the chromsweep algorithm
+    x = a.lazy().sort().intersect(b.lazy().sort(), u=True)
+    assert x.plan()[1][-1].kwargs == {'u': True, 'sorted': True}
+    x = a.lazy().sort().intersect(b, u=True)
+    assert 'sorted' not in x.plan()[1][-1].kwargs
+
+    x = a.lazy().sort(engine='native').merge(engine='native')\
+        .filter(lambda f: f.start > 100)\
+        .intersect(b.lazy(), u=True, engine='native')
+    assert str(x) == fix("chr1	900	950")
+    assert x.compute() is x.compute()
+    assert x.count() == 1
+
+    # a streaming result can be used more than once
+    x = a.lazy().filter(lambda f: f.start < 1000)
+    assert len(x) == 4
+    assert str(x.compute()) == str(a)
+    assert [str(f) for f in x] == [str(f) for f in a]
+
+
+def test_line_index():
+    x = pybedtools.BedTool(
+        """
+        track name=test
+        # comment
+        chr1 1 100 feature1 0 +
+        chr1 100 200 feature2 0 +
+
+        chr1 150 500 feature3 0 -
+        chr1 900 950 feature4 0 +
+        """, from_string=True)
+    features = [str(f) for f in x]
+    pybedtools.settings.line_index = True
+    try:
+        assert str(x[2]) == features[2]
+        assert str(x[-1]) == features[-1]
+        assert [str(f) for f in x[1:3]] == features[1:3]
+        assert [str(f) for f in x[::-2]] == features[::-2]
+        assert_raises(IndexError, x.__getitem__, 4)
+        assert os.path.exists(x.fn + '.pbtlines')
+        assert str(x.at([3, 0])) == features[3] + features[0]
+
+        subset = x.random_subset(3, seed=1)
+        lines = [str(f) for f in subset]
+        assert len(lines) == 3
+        assert lines == sorted(lines, key=features.index)
+        assert lines == [str(f) for f in x.random_subset(3, seed=1)]
+
+        # a rewritten file gets a new index
+        with open(x.fn, 'w') as fout:
+            fout.write('chr2\t5\t10\n')
+        assert str(x[0]) == 'chr2\t5\t10\n'
+        assert_raises(IndexError, x.__getitem__, 1)
+    finally:
+        pybedtools.settings.line_index = False
+        os.unlink(x.fn + '.pbtlines')
+    assert str(x[0]) == 'chr2\t5\t10\n'
+
+
+def test_cached_file_stats():
+    from pybedtools.bedtool import _file_stats
+    for fn in ('a.bed', 'd.gff', 'v.vcf', 'rmsk.hg18.chr21.small.bed.gz',
+               'x.bam', 'gdc.othersort.bam'):
+        x = pybedtools.example_bedtool(fn)
+        assert x.count() == len(list(iter(x)))
+
+    x = pybedtools.BedTool(
+        """
+        track name=test
+        # comment
+        chr1 1 100 feature1
+
+        chr1 150 500 feature3
+        """, from_string=True)
+    assert len(x) == 2
+    assert x.field_count() == 4
+    assert x.file_type == 'bed'
+    signature, values = _file_stats[os.path.abspath(x.fn)]
+    assert values == {'count': 2, ('field_count', 10): 4, 'file_type': 'bed'}
+
+    # the cached values are only used while the file is unchanged
+    with open(x.fn, 'w') as fout:
+        fout.write('chr1\t1\t2\nchr1\t3\t4\nchr1\t5\t6')
+    assert len(x) == 3
+    assert x.field_count() == 3
+    with open(x.fn, 'w') as fout:
+        fout.write('')
+    assert len(x) == 0
+    assert x.file_type == 'empty'
+
+
+def test_tempfile_lifecycle():
+    import gc
+    a = pybedtools.example_bedtool('a.bed')
+    b = pybedtools.example_bedtool('b.bed')
+    orig = pybedtools.settings.tempfile_refcount, \
+        pybedtools.settings.tempfile_quota
+    try:
+        # by default, tagged BedTools and their tempfiles are kept
+        x = a.intersect(b, engine='native')
+        tag, fn = x._tag, x.fn
+        del x
+        gc.collect()
+        assert pybedtools.find_tagged(tag).fn == fn
+        assert os.path.exists(fn)
+
+        # with refcounting, tempfiles go away with the last BedTool using them
+        pybedtools.settings.tempfile_refcount = True
+        x = a.intersect(b, engine='native')
+        y = pybedtools.BedTool(x.fn)
+        fn = x.fn
+        del x
+        gc.collect()
+        assert os.path.exists(fn)
+        deleted = pybedtools.tempfile_info()['deleted']
+        del y
+        gc.collect()
+        assert not os.path.exists(fn)
+        assert pybedtools.tempfile_info()['deleted'] == deleted + 1
+
+        # intermediate files are removed along the way
+        z = a.intersect(b, engine='native').merge(engine='native')
+        assert str(z) == fix("""
+            chr1	155	200
+            chr1	900	901""")
+
+        # with a quota, unused tempfiles are deleted once it is exceeded
+        pybedtools.settings.tempfile_refcount = False
+        pybedtools.settings.tempfile_quota = 0
+        x = a.intersect(b, engine='native')
+        fn = x.fn
+        del x
+        gc.collect()
+        assert not os.path.exists(fn)
+        x = a.intersect(b, engine='native')
+        assert os.path.exists(x.fn)
+        assert pybedtools.tempfile_info()['in_use'] >= 2
+
+        # the quota is checked against a running total of tempfile sizes
+        from pybedtools import filenames
+        assert filenames._sizes[x.fn] == os.path.getsize(x.fn) > 0
+        assert filenames._held == sum(filenames._sizes.values())
+    finally:
+        pybedtools.settings.tempfile_refcount, \
+            pybedtools.settings.tempfile_quota = orig
+
+
+def test_worker_pool():
+    from pybedtools.parallel import parallel_apply, WorkerPool, _with_seed
+    a = pybedtools.example_bedtool('a.bed')
+    b = pybedtools.example_bedtool('b.bed')
+    kwargs = dict(method_kwargs=dict(b=b, u=True, engine='native'),
+                  shuffle=False, reduce_func=len, iterations=10)
+    expected = list(parallel_apply(a, 'intersect', **kwargs))
+    assert expected == [3] * 10
+
+    with WorkerPool(processes=2) as pool:
+        assert list(parallel_apply(a, 'intersect', pool=pool, chunksize=3,
+                                   **kwargs)) == expected
+        assert list(parallel_apply(a, 'intersect', pool=pool, ordered=False,
+                                   **kwargs)) == expected
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+    except ImportError:
+        pass
+    else:
+        with ProcessPoolExecutor(2) as executor:
+            assert list(parallel_apply(a, 'intersect', pool=executor,
+                                       **kwargs)) == expected
+
+    # seeds are per iteration, without changing the shared kwargs
+    job = dict(shuffle_kwargs={'chrom': True})
+    assert _with_seed(5, job, True)['shuffle_kwargs'] == \
+        {'chrom': True, 'seed': 5}
+    assert job == dict(shuffle_kwargs={'chrom': True})
+    assert _with_seed(5, job, False) is job
+
+
+def test_interval_batch():
+    import pickle
+    from pybedtools.parallel import parallel_apply, WorkerPool
+    gff = list(pybedtools.example_bedtool('d.gff'))
+    gff[0].attrs['ID'] = 'changed'
+    sam = list(pybedtools.example_bedtool('x.bam'))[:5]
+    for intervals in (list(pybedtools.example_bedtool('a.bed')), gff, sam,
+                      []):
+        protocols = [pickle.HIGHEST_PROTOCOL]
+        if pickle.HIGHEST_PROTOCOL >= 5:
+            protocols.append(4)
+        for protocol in protocols:
+            batch = pickle.loads(pickle.dumps(
+                pybedtools.IntervalBatch(intervals), protocol))
+            assert len(batch) == len(intervals)
+            for x in (list(batch), batch[:], [batch[i] for i in
+                                              range(-len(batch), 0)]):
+                assert [i.fields for i in x] == \
+                    [i.fields for i in intervals]
+                assert [i.file_type for i in x] == \
+                    [i.file_type for i in intervals]
+    assert_raises(IndexError, pybedtools.IntervalBatch(gff).__getitem__, 5)
+
+    # out-of-band, the Intervals aren't copied into the pickle
+    if pickle.HIGHEST_PROTOCOL >= 5:
+        buffers = []
+        data = pickle.dumps(pybedtools.IntervalBatch(gff), 5,
+                            buffer_callback=buffers.append)
+        assert len(buffers) == 1 and len(data) < 100
+        batch = pickle.loads(data, buffers=buffers)
+        assert batch[0]['ID'] == 'changed'
+
+    # lists of Intervals returned by workers come back as lists
+    a = pybedtools.example_bedtool('a.bed')
+    b = pybedtools.example_bedtool('b.bed')
+    expected = [str(i) for i in a.intersect(b, engine='native')]
+    with WorkerPool(processes=2) as pool:
+        for result in parallel_apply(
+                a, 'intersect', method_kwargs=dict(b=b, engine='native'),
+                shuffle=False, reduce_func=list, iterations=2, pool=pool):
+            assert isinstance(result, list)
+            assert [str(i) for i in result] == expected
+
+
+def test_import_runs_no_programs():
+    # BEDTools help for the docstrings is fetched on first lookup, not by
+    # running every program at import
+    import subprocess
+    code = ('import subprocess\n'
+            'def popen(*args, **kwargs):\n'
+            '    raise AssertionError("ran %r at import" % (args,))\n'
+            'subprocess.Popen = popen\n'
+            'import pybedtools\n')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    p = subprocess.Popen([sys.executable, '-c', code], env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+    assert p.returncode == 0, stderr
+
+    doc = pybedtools.BedTool.intersect.__doc__
+    assert 'intersectBed' in doc.split('Original BEDTools help')[-1]
+    a = pybedtools.example_bedtool('a.bed')
+    assert a.intersect.__doc__ == doc
+
+
+def test_parallel_shards():
+    lines = []
+    for chrom in ['chr1', 'chr2', 'chr3', 'chrX']:
+        for i in range(200):
+            lines.append('%s\t%s\t%s\tf%s\n' % (chrom, i * 50, i * 50 + 70, i))
+    a = pybedtools.BedTool(''.join(lines), from_string=True).saveas()
+    # no features on chr3
+    b = pybedtools.BedTool(
+        'chrX 100 130\nchr2 0 500\nchr1 4000 4100\nchr2 9000 9100',
+        from_string=True).sort(engine='native')
+
+    p = a.parallel(processes=2)
+    for kwargs in [dict(u=True), dict(v=True), dict(wa=True, wb=True),
+                   dict(c=True)]:
+        x = p.intersect(b, engine='native', **kwargs)
+        assert x == a.intersect(b, engine='native', **kwargs), kwargs
+    x = p.merge(engine='native', d=10)
+    assert [i.chrom for i in x] == ['chr1', 'chr2', 'chr3', 'chrX']
+    assert x == a.merge(engine='native', d=10)
+
+    # b as a filename, and explicit output
+    fn = pybedtools.BedTool._tmp()
+    x = p.intersect(b=b.fn, wa=True, engine='native', output=fn)
+    assert x.fn == fn
+    assert x == a.intersect(b=b.fn, wa=True, engine='native')
+
+    # methods and arguments that can't be split are run as usual
+    assert p.count() == 800
+    assert not p._shardable('coverage', dict(hist=True))
+    assert not p._shardable('genome_coverage', dict(ibam=True, bg=True))
+    assert not p._shardable('genome_coverage', dict(g='hg19'))
+    assert p._shardable('genome_coverage', dict(g='hg19', bg=True))
+
+    from pybedtools.parallel import _pack
+    shards = _pack(['a', 'b', 'c', 'd'], dict(a=5, b=4, c=3, d=3), 2)
+    assert sorted(shards) == [(7, ['b', 'c']), (8, ['a', 'd'])]
 
 
 def test_tail():
@@ -280,6 +280,107 @@ class IntervalTest(unittest.TestCase):
 class IntervalFileGzTest(IntervalFileTest):
     file = "data/rmsk.hg18.chr21.small.bed.gz"
 
+
+class IntervalFileIndexTest(unittest.TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmpdir, 'x.gff')
+        shutil.copy(os.path.join(PATH, "data/hg19.gff"), self.fn)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def testIndexMatchesMemory(self):
+        mem = IntervalFile(self.fn)
+        idx = IntervalFile(self.fn, index=True)
+        self.assert_(idx.indexed)
+        self.assert_(os.path.exists(self.fn + '.pbtidx'))
+
+        chroms = set(i.chrom for i in IntervalFile(self.fn))
+        for chrom in list(chroms) + ['chrZ']:
+            for start, end in [(0, 1), (1, 1), (10000, 30000),
+                               (0, 5000000), (12000, 12000)]:
+                for strand in '+-.':
+                    i = Interval(chrom, start, end, strand=strand)
+                    for same_strand in (False, True):
+                        for overlap in (0.0, 0.5):
+                            args = (i, same_strand, overlap)
+                            expected = [(str(h), h.o_start, h.o_end)
+                                        for h in mem.all_hits(*args)]
+                            found = [(str(h), h.o_start, h.o_end)
+                                     for h in idx.all_hits(*args)]
+                            self.assertEqual(found, expected)
+                            self.assertEqual(idx.count_hits(*args),
+                                             mem.count_hits(*args))
+                            self.assertEqual(idx.any_hits(*args),
+                                             mem.any_hits(*args))
+
+    def testHitsMany(self):
+        queries = []
+        for chrom in sorted(set(i.chrom for i in IntervalFile(self.fn))):
+            for start, end in [(0, 0), (0, 1), (1, 1), (10000, 30000),
+                               (12000, 12000), (12000, 5000000),
+                               (16384, 16384)]:
+                for strand in '+-':
+                    queries.append(Interval(chrom, start, end, strand=strand))
+        tuples = [(i.chrom, i.start, i.end, i.strand) for i in queries]
+
+        for index in (False, True):
+            ivf = IntervalFile(self.fn, index=index)
+            for same_strand in (False, True):
+                for overlap in (0.0, 0.5):
+                    kwargs = dict(same_strand=same_strand, overlap=overlap)
+                    expected = [[(str(h), h.o_start, h.o_end)
+                                 for h in ivf.all_hits(q, **kwargs)]
+                                for q in queries]
+                    for sorted_ in (False, True):
+                        offsets, hits = ivf.all_hits_many(
+                            queries, sorted=sorted_, **kwargs)
+                        found = [[(str(h), h.o_start, h.o_end)
+                                  for h in hits[offsets[j]:offsets[j + 1]]]
+                                 for j in range(len(queries))]
+                        self.assertEqual(found, expected)
+                        self.assertEqual(
+                            list(ivf.count_hits_many(
+                                tuples, sorted=sorted_, **kwargs)),
+                            [len(e) for e in expected])
+                        self.assertEqual(
+                            list(ivf.any_hits_many(
+                                queries, sorted=sorted_, **kwargs)),
+                            [int(bool(e)) for e in expected])
+
+        ivf = IntervalFile(self.fn)
+        self.assertRaises(
+            ValueError, ivf.count_hits_many,
+            [('chr1', 100, 200), ('chr1', 50, 60)], sorted=True)
+        self.assertRaises(
+            ValueError, ivf.count_hits_many,
+            [('chr1', 100, 200), ('chr2', 50, 60), ('chr1', 300, 400)],
+            sorted=True)
+
+    def testStaleIndexIsRebuilt(self):
+        from pybedtools.cbedtools import IntervalIndex
+        IntervalFile(self.fn).build_index()
+        with open(self.fn, 'a') as fout:
+            fout.write('chrZ\tx\texon\t10\t20\t.\t+\t.\tID=new\n')
+        self.assertRaises(
+            ValueError, IntervalIndex, self.fn + '.pbtidx', self.fn)
+        idx = IntervalFile(self.fn, index=True)
+        self.assertEqual(idx.count_hits(Interval('chrZ', 0, 100)), 1)
+
+    def testGzipFallsBack(self):
+        fn = os.path.join(PATH, "data/rmsk.hg18.chr21.small.bed.gz")
+        index_fn = os.path.join(self.tmpdir, 'rmsk.pbtidx')
+        ivf = IntervalFile(fn, index=index_fn)
+        self.assertFalse(ivf.indexed)
+        self.assertEqual(
+            ivf.count_hits(Interval("chr21", 9719768, 9739768)), 8)
+        self.assertFalse(os.path.exists(index_fn))
+
+
 class IntervalFileGFFTest(IntervalTest):
     file = 'data/d.gff'
     chrpos = 0
@@ -378,6 +479,49 @@ def test_missing_files():
 
     assert_raises(BedToolsFileError, crashes)
 
+
+def test_buffered_iterator_matches_interval_iterator():
+    import io
+    import gzip
+    from pybedtools.cbedtools import (IntervalIterator,
+                                      BufferedIntervalIterator)
+
+    def parsed(it):
+        try:
+            return [(str(i), i.file_type, i.fields, i.start, i.end, i.name,
+                     i.score, i.strand) for i in it]
+        except Exception as e:
+            return type(e)
+
+    for fn in ('a.bed', 'c.gff', 'v.vcf', '164.gtf', 'mm9.bed12',
+               'dm3-chr2L-5M.gff.gz'):
+        fn = pybedtools.example_filename(fn)
+        if fn.endswith('.gz'):
+            expected = parsed(IntervalIterator(gzip.open(fn, 'rt')))
+            opener = lambda: gzip.open(fn, 'rb')
+        else:
+            expected = parsed(IntervalIterator(open(fn)))
+            opener = lambda: open(fn, 'rb')
+
+        # small block sizes exercise lines split across reads
+        for blocksize in (1, 7, 2 ** 20):
+            assert parsed(
+                BufferedIntervalIterator(opener(), blocksize)) == expected
+
+    for s in [
+        "chr1\t1\t5\r\n",
+        "\n  \ntrack name=x\n#comment\nchr1\t1\t2\tn\t3\t+\tx\ty",
+        "chr1\t1\t99999999999\n",
+        "chr1\tsrc\tgene\t0\t10\t.\t+\t.\tID=a\n",
+        "chr1\t10\t5\n",
+        "chr1\t5\n",
+        "r1\t0\tchr1\t100\t255\t10M\t*\t0\t0\tACGTACGTAC\t*\n",
+    ]:
+        expected = parsed(IntervalIterator(io.StringIO(s)))
+        assert parsed(
+            BufferedIntervalIterator(io.BytesIO(s.encode()))) == expected
+
+
 if __name__ == "__main__":
     unittest.main()
     pybedtools.cleanup(remove_all=True)
@@ -153,6 +153,87 @@ def test_getting_example_beds():
     assert_raises(ValueError, pybedtools.set_tempdir, 'nonexistent')
 
 
+def test_result_cache():
+    from pybedtools import cache
+    orig = pybedtools.settings.result_cache, \
+        pybedtools.settings.result_cache_size
+    pybedtools.settings.result_cache = os.path.join(test_tempdir, 'cache')
+    try:
+        x = pybedtools.example_bedtool('a.bed').saveas()
+        y = pybedtools.example_bedtool('a.bed').saveas()
+        cmds = ['intersectBed', '-a', x.fn, '-b', x.fn]
+
+        # identical content gives identical keys
+        key = cache.key(cmds)
+        assert key == cache.key(['intersectBed', '-a', y.fn, '-b', y.fn])
+        assert key != cache.key(['intersectBed', '-u', '-a', x.fn,
+                                 '-b', x.fn])
+        pybedtools.settings.result_cache_key = 'mtime'
+        assert cache.key(cmds) != \
+            cache.key(['intersectBed', '-a', y.fn, '-b', y.fn])
+        pybedtools.settings.result_cache_key = 'content'
+
+        out = x._tmp()
+        assert not cache.fetch(key, out)
+        cache.store(key, x.fn)
+        assert cache.fetch(key, out)
+        assert open(out).read() == open(x.fn).read()
+        info = cache.info()
+        assert (info['hits'], info['misses'], info['entries']) == (1, 1, 1)
+
+        # changing an input changes the key
+        with open(y.fn, 'a') as fout:
+            fout.write('chr2\t1\t2\n')
+        key2 = cache.key(['intersectBed', '-a', y.fn, '-b', y.fn])
+        assert key2 != key
+
+        # least recently used results are evicted
+        pybedtools.settings.result_cache_size = os.path.getsize(y.fn)
+        cache.store(key2, y.fn)
+        assert cache.info()['entries'] == 1
+        assert not cache.fetch(key, out)
+        assert cache.fetch(key2, out)
+
+        cache.clear()
+        assert cache.info() == dict(
+            hits=0, misses=0, evictions=0, entries=0, size=0)
+    finally:
+        pybedtools.settings.result_cache, \
+            pybedtools.settings.result_cache_size = orig
+        pybedtools.settings.result_cache_key = 'content'
+
+
+def test_result_cache_random():
+    from pybedtools import cache
+    orig = pybedtools.settings.result_cache
+    pybedtools.settings.result_cache = os.path.join(test_tempdir, 'cache')
+    try:
+        x = pybedtools.example_bedtool('a.bed')
+        g = pybedtools.chromsizes_to_file(pybedtools.chromsizes('hg19'))
+
+        # random programs are only cached when seeded
+        for cmds in (['shuffleBed', '-i', x.fn, '-g', g],
+                     ['bedtools', 'shuffle', '-i', x.fn, '-g', g],
+                     ['bedtools', 'random', '-l', '10', '-g', g],
+                     ['bedtools', 'sample', '-i', x.fn, '-n', '2']):
+            assert cache.key(cmds) is None
+            assert cache.key(cmds + ['-seed', '1']) is not None
+
+        # so two unseeded shuffles are both run
+        cache.clear()
+        x.shuffle(g=g, chrom=True)
+        x.shuffle(g=g, chrom=True)
+        info = cache.info()
+        assert (info['hits'], info['entries']) == (0, 0)
+        x.shuffle(g=g, chrom=True, seed=1)
+        x.shuffle(g=g, chrom=True, seed=1)
+        info = cache.info()
+        assert (info['hits'], info['entries']) == (1, 1)
+        cache.clear()
+    finally:
+        pybedtools.settings.result_cache = orig
+
+
 def teardown():
     # always run this!
     pybedtools.cleanup(remove_all=True)
@@ -78,6 +78,11 @@ void BedFile::Seek(unsigned long offset) {
     _bedStream->seekg(offset);
 }
 
+// Report the current byte in the file
+unsigned long BedFile::Tell(void) {
+    return _bedStream->tellg();
+}
+
 // Close the BED file
 void BedFile::Close(void) {
     if (bedFile != "stdin") delete _bedStream;
@@ -280,6 +280,9 @@ public:
 
     // Jump to a specific byte in the file
     void Seek(unsigned long offset);
+
+    // Report the current byte offset in the file
+    unsigned long Tell(void);
     
     // Close an opened BED file.
     void Close(void);
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+Time `import pybedtools` in fresh interpreters, and count the subprocesses
+started while importing (there should be none; BEDTools help for the method
+docstrings is only fetched when it is looked up).
+
+Usage::
+
+    python tools/benchmark_import.py [--repeat N]
+"""
+from __future__ import print_function
+import argparse
+import subprocess
+import sys
+
+CODE = '''
+import subprocess
+import time
+calls = []
+_Popen = subprocess.Popen
+class Popen(_Popen):
+    def __init__(self, *args, **kwargs):
+        calls.append(args[0])
+        _Popen.__init__(self, *args, **kwargs)
+subprocess.Popen = Popen
+t0 = time.time()
+import pybedtools
+print(time.time() - t0, len(calls))
+'''
+
+
+def main():
+    ap = argparse.ArgumentParser(usage=__doc__)
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args()
+
+    times = []
+    for _ in range(args.repeat):
+        out = subprocess.check_output([sys.executable, '-c', CODE])
+        elapsed, n = out.decode().split()
+        times.append(float(elapsed))
+    print('import pybedtools: best %.3f s, median %.3f s over %d runs; '
+          '%s subprocesses started'
+          % (min(times), sorted(times)[len(times) // 2], len(times), n))
+
+
+if __name__ == "__main__":
+    main()
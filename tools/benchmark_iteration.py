@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Compare the speed of iterating over a file with IntervalIterator (text mode,
+per-line str.split) and BufferedIntervalIterator (block reads, C-level
+parsing), which is what BedTool.__iter__ uses for files.
+
+Usage::
+
+    python tools/benchmark_iteration.py [--lines N] [FILE ...]
+
+With no files, synthetic BED6 and GFF files of N lines (plus gzipped copies)
+are written to a temp dir and used instead.
+"""
+from __future__ import print_function
+import argparse
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from pybedtools.cbedtools import IntervalIterator, BufferedIntervalIterator
+from pybedtools.helpers import isGZIP
+
+
+def make_files(tmpdir, n):
+    rng = random.Random(0)
+    bed = os.path.join(tmpdir, 'synthetic.bed')
+    gff = os.path.join(tmpdir, 'synthetic.gff')
+    with open(bed, 'w') as b, open(gff, 'w') as g:
+        for i in range(n):
+            chrom = 'chr%d' % rng.randint(1, 22)
+            start = rng.randint(0, 10 ** 8)
+            stop = start + rng.randint(1, 5000)
+            strand = rng.choice('+-')
+            b.write('%s\t%d\t%d\tfeature%d\t%d\t%s\n'
+                    % (chrom, start, stop, i, i % 1000, strand))
+            g.write('%s\tsynthetic\texon\t%d\t%d\t.\t%s\t.\t'
+                    'gene_id "g%d"; transcript_id "t%d";\n'
+                    % (chrom, start + 1, stop, strand, i // 10, i // 5))
+    fns = [bed, gff]
+    for fn in list(fns):
+        with open(fn, 'rb') as fin, gzip.open(fn + '.gz', 'wb') as fout:
+            shutil.copyfileobj(fin, fout)
+        fns.append(fn + '.gz')
+    return fns
+
+
+def timeit(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        n = func()
+        elapsed = time.time() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, n
+
+
+def consume(it):
+    n = 0
+    for _ in it:
+        n += 1
+    return n
+
+
+def main():
+    ap = argparse.ArgumentParser(usage=__doc__)
+    ap.add_argument('files', nargs='*')
+    ap.add_argument('--lines', type=int, default=500000)
+    ap.add_argument('--repeat', type=int, default=3)
+    args = ap.parse_args()
+
+    tmpdir = None
+    fns = args.files
+    if not fns:
+        tmpdir = tempfile.mkdtemp(prefix='pybedtools.bench.')
+        fns = make_files(tmpdir, args.lines)
+
+    try:
+        print('%-30s %10s %12s %12s %8s'
+              % ('file', 'features', 'old (s)', 'new (s)', 'speedup'))
+        for fn in fns:
+            if isGZIP(fn):
+                old = lambda: consume(IntervalIterator(gzip.open(fn, 'rt')))
+                new = lambda: consume(
+                    BufferedIntervalIterator(gzip.open(fn, 'rb')))
+            else:
+                old = lambda: consume(IntervalIterator(open(fn, 'r')))
+                new = lambda: consume(BufferedIntervalIterator(open(fn, 'rb')))
+            t_old, n_old = timeit(old, args.repeat)
+            t_new, n_new = timeit(new, args.repeat)
+            assert n_old == n_new, (n_old, n_new)
+            print('%-30s %10d %12.3f %12.3f %7.1fx'
+                  % (os.path.basename(fn), n_new, t_old, t_new,
+                     t_old / t_new))
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()